@@ -0,0 +1 @@
+from .build import LegsError, compile
@@ -1,23 +1,29 @@
 #!/usr/bin/env python3
 # Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
 
+import json
 from argparse import ArgumentParser, Namespace
-from collections import defaultdict
-from itertools import chain, count
+from codecs import lookup as lookup_codec
+from itertools import chain
 from typing import DefaultDict, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
 
-from pithy.dict import dict_put
 from pithy.io import errL, errLL, errSL, errZ, outL, outZ
 from pithy.iterable import first_el
 from pithy.path import path_ext, path_join, path_name, split_dir_name
 from pithy.string import pluralize
 
-from ..defs import ModeTransitions
-from ..dfa import DFA, DfaTransitions, minimize_dfa
-from ..nfa import NFA, NfaTransitions, gen_dfa
+from ..build import extract_keywords, gen_nfa, gen_pattern_descs, mode_name_key
+from ..code_classes import encode_keywords, gen_single_byte_dfas
+from ..defs import Keywords, ModeTransitions
+from ..dfa import DFA, DfaTransitions, minimize_dfa, renumber_dfa
+from ..legsdfa import output_legsdfa
+from ..lint import lint_perf, munch_choices
+from ..nfa import NFA, gen_dfa
 from ..parse import parse_legs
-from ..patterns import LegsPattern, NfaMutableTransitions, gen_incomplete_pattern
-from ..python import output_python, output_python_re
+from ..patterns import LegsPattern, gen_incomplete_pattern
+from ..provenance import describe_heat, output_provenance
+from ..python import (output_python, output_python_code, output_python_comb, output_python_hybrid, output_python_lazy,
+  output_python_re, output_python_sparse, output_python_str, output_python_stride, output_python_table, output_python_units)
 from ..swift import output_swift
 from ..vscode import output_vscode
 
@@ -41,13 +47,38 @@ lexical errors are found at the ends of `incomplete` tokens and the starts of `i
 def main() -> None:
   parser = ArgumentParser(prog='legs', description=description)
   parser.add_argument('path', nargs='?', help='Path to the .legs file.')
+  parser.add_argument('-byteorder', choices=('little', 'big'), default='little',
+    help='Byte order of the text for the `python-utf16` and `python-utf32` lexers.')
   parser.add_argument('-dbg', action='store_true', help='Verbose debug printing.')
+  parser.add_argument('-encoding', default=None,
+    help='Single-byte encoding (e.g. `latin-1` or `cp1252`) of the text for the byte lexers, instead of UTF-8;'
+    ' the automata are remapped so that the lexers run on the encoded bytes directly.')
+  parser.add_argument('-heat', default=None,
+    help='Path to a JSON file of state visit counts; print a per-pattern heat report and exit.')
+  parser.add_argument('-keywords', action='store_true',
+    help='Remove keyword literals that are also matched by a general pattern (e.g. an identifier) from the automata;'
+    ' generated lexers match the general pattern and then reclassify the token by looking up its text.')
   parser.add_argument('-langs', nargs='+', default=[], help='Target languages for which to generate lexers.')
+  parser.add_argument('-lint-perf', action='store_true',
+    help='Analyze the worst-case rescan distance of each mode, flagging patterns that can cause quadratic lexing, and exit.')
   parser.add_argument('-match', nargs='+', help='Attempt to lex each argument string.')
   parser.add_argument('-mode', default=None, help='Mode with which to lex the arguments to `-match`.')
+  parser.add_argument('-munch', choices=munch_choices, default='auto',
+    help='Maximal munch strategy for the `python` and `swift` lexers: `linear` memoizes failed scans to guarantee'
+    ' linear-time lexing; `backtrack` simply rescans; `auto` (the default) chooses `linear` if the grammar has post-match nodes.')
   parser.add_argument('-output', default=None, help='Path to output generated source.')
   parser.add_argument('-patterns', nargs='+', help='Specify legs patterns for quick testing.')
+  parser.add_argument('-profile', default=None,
+    help='Path to a JSON file of state visit counts (as for `-heat`) from a lexer generated without `-profile`;'
+    ' number the hottest states of each mode first, so that they are packed together in generated tables.')
+  parser.add_argument('-provenance', action='store_true',
+    help='Also output a JSON map from generated lexer states to the patterns and source lines they derive from.')
+  parser.add_argument('-sparse-threshold', type=int, default=16,
+    help='For `python-sparse`, the maximum number of byte ranges for which a state is stored as a range list'
+    ' rather than a dense row.')
   parser.add_argument('-stats', action='store_true', help='Print statistics about the generated automata.')
+  parser.add_argument('-stride-budget', type=int, default=1<<18,
+    help='For `python-stride`, the maximum size in bytes of the two-byte transition table.')
   parser.add_argument('-syntax-exts', nargs='*', help='Extensions list for syntax definitions.')
   parser.add_argument('-syntax-name', help='Syntax readable name for syntax definitions.')
   parser.add_argument('-syntax-scope', help='Syntax scope name for textmate-style syntax definitions.')
@@ -68,6 +99,9 @@ def main() -> None:
   if args.match and args.output: exit('`-match` and `-output` are mutually exclusive.')
   if args.match and args.langs: exit('`-match` and `-langs` are mutually exclusive.')
   if args.match and args.test: exit('`-match` and `-test` are mutually exclusive.')
+  if args.match and args.heat: exit('`-match` and `-heat` are mutually exclusive.')
+  if args.match and args.lint_perf: exit('`-match` and `-lint-perf` are mutually exclusive.')
+  if args.match and args.encoding: exit('`-match` and `-encoding` are mutually exclusive.')
 
   langs:Set[str]
   if args.langs:
@@ -99,7 +133,7 @@ def main() -> None:
   else:
     exit('`must specify either `path` or `-patterns`.')
 
-  license, patterns, mode_pattern_kinds, mode_transitions = parse_legs(path, src)
+  license, patterns, mode_pattern_kinds, mode_transitions, pattern_lines = parse_legs(path, src)
 
   if dbg:
     errSL('\nPatterns:')
@@ -107,7 +141,29 @@ def main() -> None:
       pattern.describe(name=name)
     errL()
 
+  # Syntax definitions highlight keywords, so they use the original pattern kinds.
+  syntax_mode_pattern_kinds = mode_pattern_kinds
+  keywords:Keywords = {}
+  if args.keywords:
+    mode_pattern_kinds, keywords = extract_keywords(patterns, mode_pattern_kinds)
+    if dbg or args.stats:
+      errL('Keywords: ', pluralize(sum(len(texts) for texts in keywords.values()), 'keyword'), ' extracted.')
+      for general, texts in keywords.items():
+        errSL(f'  {general}:', *sorted(texts.values()))
+
+  # Lazy lexers determinize at runtime, so when they are the only output, skip building DFAs.
+  nfa_only = (langs == {'python-lazy'} and not (args.match or args.heat or args.lint_perf or args.provenance
+    or args.stats or dbg))
+
+  profile_counts:Optional[Dict[int,int]] = None
+  if args.profile:
+    try:
+      with open(args.profile) as f: profile_counts = { int(state) : count for state, count in json.load(f).items() }
+    except FileNotFoundError: exit(f'legs error: no such profile file: {args.profile!r}')
+
+  nfas:List[NFA] = []
   dfas:List[DFA] = []
+  mode_kind_sets:Dict[str,FrozenSet[FrozenSet[str]]] = {} # The sets of kinds matched by the states of each fat DFA.
   start_node = 0
   for mode, pattern_kinds in sorted(mode_pattern_kinds.items(), key=lambda p: mode_name_key(p[0])):
     if args.match and mode != match_mode: continue
@@ -120,12 +176,15 @@ def main() -> None:
     if msgs:
       errLL(*msgs)
       exit(1)
+    nfas.append(nfa)
+    if nfa_only: continue
 
     fat_dfa = gen_dfa(nfa)
     if dbg: fat_dfa.describe('Fat DFA')
     if dbg or args.stats: fat_dfa.describe_stats('Fat DFA Stats')
+    mode_kind_sets[mode] = frozenset(fat_dfa.match_node_kind_sets.values())
 
-    min_dfa = minimize_dfa(fat_dfa, start_node=start_node)
+    min_dfa = renumber_dfa(minimize_dfa(fat_dfa, start_node=start_node), counts=profile_counts)
     start_node = min_dfa.end_node
     if dbg: min_dfa.describe('Min DFA')
     if dbg or args.stats: min_dfa.describe_stats('Min DFA Stats')
@@ -144,13 +203,35 @@ def main() -> None:
 
   if args.match: exit(f'bad mode: {match_mode!r}')
 
-  pattern_descs = { name : pattern.literal_desc or name for name, pattern in patterns.items() }
-  pattern_descs.update((n, n) for n in ['invalid', 'incomplete'])
+  if any(pattern.tag_names for pattern in patterns.values()):
+    if not args.langs: langs -= untagged_langs # Default test languages.
+    unsupported = sorted(langs & untagged_langs)
+    if unsupported: exit(f'`@` tags are not supported for languages: {", ".join(unsupported)}.')
+
+  encoding = 'utf-8'
+  if args.encoding:
+    if not args.langs: langs -= non_byte_langs # Default test languages.
+    unsupported = sorted(langs & non_byte_langs)
+    if unsupported: exit(f'`-encoding` is not supported for languages: {", ".join(unsupported)}.')
+    # The UTF-8 automata above validate the grammar; replace them with the remapped byte automata.
+    dfas = gen_single_byte_dfas(patterns, mode_pattern_kinds, encoding=args.encoding, counts=profile_counts)
+    encoding = lookup_codec(args.encoding).name
+    keywords = encode_keywords(keywords, encoding)
+  args.encoding = encoding
+
+  if args.heat:
+    describe_heat(args.heat, dfas=dfas, pattern_lines=pattern_lines)
+    exit(0)
+
+  if args.lint_perf:
+    exit(1 if lint_perf(dfas) else 0)
+
+  pattern_descs = gen_pattern_descs(patterns)
 
   incomplete_patterns:Dict[str,Optional[LegsPattern]] = {
     dfa.name : gen_incomplete_pattern(dfa.kinds_greedy_ordered, patterns) for dfa in dfas }
 
-  if not (langs or args.test): # Print and exit.
+  if not (langs or args.test or args.provenance): # Print and exit.
     for name, pattern in patterns.items():
       pattern.describe(name=name)
     for name, inc_pattern in incomplete_patterns.items():
@@ -171,39 +252,100 @@ def main() -> None:
   out_name_stem = out_name[:out_name.find('.')] if '.' in out_name else out_name # TODO: path_stem should be changed to do this.
   out_stem = path_join(out_dir, out_name_stem)
 
+  if 'legsdfa' in langs:
+    path = out_stem + '.legsdfa'
+    output_legsdfa(path, dfas=dfas, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', '-m', 'legs_base', path] + args.test)
+
   if 'python' in langs:
     path = out_stem + '.py'
     output_python(path, dfas=dfas, mode_transitions=mode_transitions,
-      pattern_descs=pattern_descs, license=license, args=args)
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  if 'python-code' in langs:
+    path = out_stem + '.code.py'
+    output_python_code(path, dfas=dfas, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  if 'python-comb' in langs:
+    path = out_stem + '.comb.py'
+    output_python_comb(path, dfas=dfas, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  if 'python-hybrid' in langs:
+    path = out_stem + '.hybrid.py'
+    output_python_hybrid(path, dfas=dfas, mode_transitions=mode_transitions, patterns=patterns,
+      mode_kind_sets=mode_kind_sets, keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  if 'python-lazy' in langs:
+    path = out_stem + '.lazy.py'
+    output_python_lazy(path, nfas=nfas, patterns=patterns, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
     if args.test: test_cmds.append(['python3', path] + args.test)
 
   if 'python-re' in langs:
     path = out_stem + '.re.py'
     output_python_re(path, dfas=dfas, mode_transitions=mode_transitions,
       patterns=patterns, incomplete_patterns=incomplete_patterns,
-      pattern_descs=pattern_descs, license=license, args=args)
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  if 'python-table' in langs:
+    path = out_stem + '.table.py'
+    output_python_table(path, dfas=dfas, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  if 'python-sparse' in langs:
+    path = out_stem + '.sparse.py'
+    output_python_sparse(path, dfas=dfas, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  if 'python-str' in langs:
+    path = out_stem + '.str.py'
+    output_python_str(path, patterns=patterns, mode_pattern_kinds=mode_pattern_kinds, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  for lang, bits in [('python-utf16', 16), ('python-utf32', 32)]:
+    if lang not in langs: continue
+    path = out_stem + f'.utf{bits}.py'
+    output_python_units(path, patterns=patterns, mode_pattern_kinds=mode_pattern_kinds, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args,
+      encoding=f'utf-{bits}-{args.byteorder[0]}e')
+    if args.test: test_cmds.append(['python3', path] + args.test)
+
+  if 'python-stride' in langs:
+    path = out_stem + '.stride.py'
+    output_python_stride(path, dfas=dfas, mode_transitions=mode_transitions,
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
     if args.test: test_cmds.append(['python3', path] + args.test)
 
   if 'swift' in langs:
     path = out_stem + '.swift'
     output_swift(path, dfas=dfas, mode_transitions=mode_transitions,
-      pattern_descs=pattern_descs, license=license, args=args)
+      keywords=keywords, pattern_descs=pattern_descs, license=license, args=args)
     if args.test: test_cmds.append(['swift', path] + args.test)
 
   if 'vscode' in langs:
     path = out_stem + '.json'
-    output_vscode(path, patterns=patterns, mode_pattern_kinds=mode_pattern_kinds,
+    output_vscode(path, patterns=patterns, mode_pattern_kinds=syntax_mode_pattern_kinds,
       pattern_descs=pattern_descs, license=license, args=args)
 
+  if args.provenance:
+    path = out_stem + '.provenance.json'
+    output_provenance(path, dfas=dfas, pattern_lines=pattern_lines, license=license, args=args)
+
   if args.test:
     run_tests(test_cmds, dbg=args.dbg)
 
 
-def mode_name_key(name:str) -> str:
-  'Always place main mode first.'
-  return '' if name == 'main' else name
-
-
 def run_tests(test_cmds:List[List[str]], dbg:bool) -> None:
   # For each language, run against the specified match arguments, and capture output.
   # Print the output from the first test, and then the diff for each subsequent output that differs.
@@ -260,42 +402,32 @@ def match_string(nfa:NFA, fat_dfa:DFA, min_dfa:DFA, string: str) -> None:
     outL(f'match: {string!r} -- <none>')
 
 
-def gen_nfa(name:str, named_patterns:List[Tuple[str, LegsPattern]]) -> NFA:
-  '''
-  Generate an NFA from a set of patterns.
-  The NFA can be used to match against an argument string,
-  but cannot produce a token stream directly.
-  The `invalid` node is unreachable, and reserved for later use by the derived DFA.
-  '''
-
-  indexer = iter(count())
-  def mk_node() -> int: return next(indexer)
-
-  start = mk_node() # always 0; see gen_dfa.
-  invalid = mk_node() # always 1; see gen_dfa.
-
-  match_node_kinds:Dict[int, str] = { invalid: 'invalid' }
-
-  transitions_dd:NfaMutableTransitions = defaultdict(lambda: defaultdict(set))
-  for kind, pattern in named_patterns:
-    match_node = mk_node()
-    pattern.gen_nfa(mk_node, transitions_dd, start, match_node)
-    dict_put(match_node_kinds, match_node, kind)
-  lit_patterns = { n for n, pattern in named_patterns if pattern.is_literal }
-
-  transitions:NfaTransitions = {
-    src: {char: frozenset(dst) for char, dst in d.items() } for src, d in transitions_dd.items() }
-  return NFA(name=name, transitions=transitions, match_node_kinds=match_node_kinds, lit_patterns=lit_patterns)
-
-
 ext_langs = {
+  '.legsdfa' : 'legsdfa',
   '.py' : 'python',
+  '.code.py' : 'python-code',
+  '.comb.py' : 'python-comb',
+  '.hybrid.py' : 'python-hybrid',
+  '.lazy.py' : 'python-lazy',
   '.re.py' : 'python-re',
+  '.sparse.py' : 'python-sparse',
+  '.str.py' : 'python-str',
+  '.stride.py' : 'python-stride',
+  '.table.py' : 'python-table',
+  '.utf16.py' : 'python-utf16',
+  '.utf32.py' : 'python-utf32',
   '.swift' : 'swift',
 }
 
-supported_langs = {'python', 'python-re', 'swift', 'vscode'}
-test_langs = {'python', 'swift'}
+supported_langs = {
+  'legsdfa', 'python', 'python-code', 'python-comb', 'python-hybrid', 'python-lazy', 'python-re', 'python-sparse',
+  'python-str', 'python-stride', 'python-table', 'python-utf16', 'python-utf32', 'swift', 'vscode'}
+non_byte_langs = { 'python-hybrid', 'python-lazy', 'python-re', 'python-str', 'python-utf16', 'python-utf32', 'swift' }
+untagged_langs = {
+  'python-code', 'python-comb', 'python-hybrid', 'python-lazy', 'python-re', 'python-sparse', 'python-stride', 'swift' }
+test_langs = {
+  'legsdfa', 'python', 'python-code', 'python-comb', 'python-hybrid', 'python-lazy', 'python-sparse', 'python-str',
+  'python-stride', 'python-table', 'python-utf16', 'python-utf32', 'swift'}
 
 
 if __name__ == "__main__": main()
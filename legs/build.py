@@ -0,0 +1,227 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+The grammar compilation pipeline, and the in-process compilation API.
+
+`compile` parses grammar source, determinizes and minimizes each mode, and returns a lexer class
+bound to the flat table engine (`legs_base.ArrayLexerBase`), without generating or importing any source code.
+The class includes the ASCII projection of the table (see `legs.tables.gen_ascii_table`) where that is smaller.
+Results are memoized in-process and in an on-disk cache, both keyed by a digest of the source.
+'''
+
+from array import array
+from codecs import lookup as lookup_codec
+from collections import defaultdict
+from hashlib import sha256
+from itertools import count
+from os import environ
+from os.path import expanduser
+from typing import Any, Dict, FrozenSet, List, Optional, Set, Tuple, Type
+
+from legs_base import ArrayLexerBase, ArrayTable, Keywords
+from pithy.dict import dict_put
+from pithy.fs import path_join
+from pithy.iterable import first_el
+
+from .dfa import DFA, Tag, minimize_dfa, renumber_dfa
+from .nfa import NFA, NfaTransitions, gen_dfa
+from .parse import parse_legs
+from .patterns import ImportedPattern, LegsPattern, NfaMutableTransitions
+from .cache import load_cached, save_cached
+from .tables import FlatTable, gen_ascii_table, gen_flat_table
+
+
+cache_version = 8 # Increment whenever the compiled artifact or the DFA generation changes.
+
+
+def gen_nfa(name:str, named_patterns:List[Tuple[str, LegsPattern]]) -> NFA:
+  '''
+  Generate an NFA from a set of patterns.
+  The NFA can be used to match against an argument string,
+  but cannot produce a token stream directly.
+  The `invalid` node is unreachable, and reserved for later use by the derived DFA.
+  '''
+
+  indexer = iter(count())
+  def mk_node() -> int: return next(indexer)
+
+  start = mk_node() # always 0; see gen_dfa.
+  invalid = mk_node() # always 1; see gen_dfa.
+
+  match_node_kinds:Dict[int, str] = { invalid: 'invalid' }
+  node_patterns:Dict[int, str] = { invalid: 'invalid' } # Provenance of every node except `start`.
+  tag_nodes:Dict[int,Tag] = {}
+
+  transitions_dd:NfaMutableTransitions = defaultdict(lambda: defaultdict(set))
+  for kind, pattern in named_patterns:
+    def mk_pattern_node() -> int:
+      node = mk_node()
+      node_patterns[node] = kind
+      return node
+    match_node = mk_pattern_node()
+    for node, tag in pattern.gen_tagged_nfa(mk_pattern_node, transitions_dd, start, match_node).items():
+      tag_nodes[node] = (kind, tag)
+    dict_put(match_node_kinds, match_node, kind)
+  lit_patterns = { n for n, pattern in named_patterns if pattern.is_literal }
+
+  transitions:NfaTransitions = {
+    src: {char: frozenset(dst) for char, dst in d.items() } for src, d in transitions_dd.items() }
+  return NFA(name=name, transitions=transitions, match_node_kinds=match_node_kinds, lit_patterns=lit_patterns,
+    node_patterns=node_patterns, tag_nodes=tag_nodes)
+
+
+def mode_name_key(name:str) -> str:
+  'Always place main mode first.'
+  return '' if name == 'main' else name
+
+
+def gen_pattern_descs(patterns:Dict[str,LegsPattern]) -> Dict[str,str]:
+  pattern_descs = { name : pattern.literal_desc or name for name, pattern in patterns.items() }
+  pattern_descs.update((n, n) for n in ['invalid', 'incomplete'])
+  return pattern_descs
+
+
+def extract_keywords(patterns:Dict[str,LegsPattern], mode_pattern_kinds:Dict[str,FrozenSet[str]]) \
+ -> Tuple[Dict[str,FrozenSet[str]],Keywords]:
+  '''
+  Find the literal patterns ("keywords") that are also matched in full by a single general pattern in the same mode,
+  such as `if` and an identifier pattern.
+  Returns the mode pattern kinds with the keywords removed from the modes of their general patterns,
+  and a table mapping each general kind to the texts of its keywords and their kinds.
+  Maximal munch is unaffected by the removal: wherever the keyword matched, the general pattern matches the same span.
+  Therefore a lexer can match the general pattern and then reclassify the token by looking up its text,
+  and the automaton no longer needs to separate the keyword states from the general ones.
+  A keyword is only extracted if every mode containing its general pattern also contains the keyword,
+  so that the table is valid regardless of mode.
+  '''
+  # For each mode, map each literal to the sole non-literal pattern that matches its text.
+  mode_literal_generals:Dict[str,Dict[str,str]] = {}
+  for mode, pattern_kinds in mode_pattern_kinds.items():
+    general_patterns = sorted((kind, patterns[kind]) for kind in pattern_kinds if not patterns[kind].is_literal)
+    if not general_patterns: continue
+    nfa = gen_nfa(name=mode, named_patterns=general_patterns)
+    literal_generals = mode_literal_generals[mode] = {}
+    for kind in pattern_kinds:
+      pattern = patterns[kind]
+      if not pattern.is_literal: continue
+      generals = nfa.match(pattern.literal_pattern)
+      if len(generals) == 1: literal_generals[kind] = first_el(generals)
+
+  general_modes:Dict[str,Set[str]] = defaultdict(set)
+  for mode, pattern_kinds in mode_pattern_kinds.items():
+    for kind in pattern_kinds: general_modes[kind].add(mode)
+
+  keywords:Keywords = {}
+  extracted:Dict[str,Set[str]] = defaultdict(set) # Keyword kinds to remove from each mode.
+  for mode, literal_generals in sorted(mode_literal_generals.items()):
+    for kind, general in sorted(literal_generals.items()):
+      modes = general_modes[general]
+      if not all(mode_literal_generals.get(m, {}).get(kind) == general for m in modes): continue
+      keywords.setdefault(general, {})[patterns[kind].literal_pattern.encode('utf8')] = kind
+      for m in modes: extracted[m].add(kind)
+
+  reduced = { mode : pattern_kinds - extracted[mode] for mode, pattern_kinds in mode_pattern_kinds.items() }
+  return reduced, { general : dict(sorted(texts.items())) for general, texts in sorted(keywords.items()) }
+
+
+def gen_valid_nfa(mode:str, patterns:Dict[str,LegsPattern], pattern_kinds:FrozenSet[str]) -> NFA:
+  'Generate the NFA for a mode. Exits on invalid grammars, as the CLI does.'
+  nfa = gen_nfa(name=mode, named_patterns=sorted((kind, patterns[kind]) for kind in pattern_kinds))
+  msgs = nfa.validate()
+  if msgs: exit('\n'.join(msgs))
+  return nfa
+
+
+def gen_dfas(patterns:Dict[str,LegsPattern], mode_pattern_kinds:Dict[str,FrozenSet[str]]) -> List[DFA]:
+  'Generate the minimized DFA for each mode, with main first. Exits on invalid grammars, as the CLI does.'
+  dfas:List[DFA] = []
+  start_node = 0
+  for mode, pattern_kinds in sorted(mode_pattern_kinds.items(), key=lambda p: mode_name_key(p[0])):
+    nfa = gen_valid_nfa(mode, patterns, pattern_kinds)
+    min_dfa = renumber_dfa(minimize_dfa(gen_dfa(nfa), start_node=start_node))
+    start_node = min_dfa.end_node
+    dfas.append(min_dfa)
+  return dfas
+
+
+def array_table(flat:FlatTable) -> ArrayTable:
+  return ArrayTable(kinds=flat.kinds, final_kind=flat.final_kind, mode_starts=flat.mode_starts, byte_classes=flat.byte_classes,
+    class_count=flat.class_count, table=array(flat.typecode, flat.table), loop_classes=flat.loop_classes,
+    state_tags=flat.state_tags)
+
+
+class LegsError(ValueError):
+  'Raised by `compile` for an invalid grammar; the message is the diagnostic that the CLI would print.'
+
+
+_compiled_lexers:Dict[str,Dict[str,Any]] = {} # In-process memo of lexer class attributes, keyed by digest.
+
+
+def compile(source:str, name:str='', path:str='<source>', keywords:bool=False, encoding:str='utf-8', disk_cache:bool=True,
+ cache_dir:Optional[str]=None) -> Type[ArrayLexerBase]:
+  '''
+  Compile the legs grammar `source` and return a new lexer class named `{name}Lexer`.
+  `path` is used for diagnostics and to resolve imports.
+  If `keywords` is true, keywords are extracted from the automaton and matched by lookup instead;
+  see `extract_keywords`.
+  If `encoding` names a single-byte encoding, the lexer matches source bytes in that encoding instead of UTF-8;
+  see `legs.code_classes.gen_single_byte_dfas`.
+  Grammar errors raise `LegsError`, carrying the diagnostic that the CLI would print.
+
+  Compiled tables are memoized in-process, and also saved to `cache_dir` if `disk_cache` is true;
+  the default directory is `$XDG_CACHE_HOME/legs`, or `~/.cache/legs`.
+  Grammars that import other grammars are not cached, because the digest of `source` does not cover the imports.
+  '''
+  encoding = lookup_codec(encoding).name
+  digest = sha256(f'{cache_version}\n{int(keywords)}\n{encoding}\n{source}'.encode('utf8')).hexdigest()
+  try: attrs = _compiled_lexers[digest]
+  except KeyError: pass
+  else: return type(f'{name}Lexer', (ArrayLexerBase,), dict(attrs))
+
+  if cache_dir is None:
+    cache_dir = path_join(environ.get('XDG_CACHE_HOME') or expanduser('~/.cache'), 'legs')
+  cache_path = path_join(cache_dir, digest + '.lexer')
+  cached = load_cached(cache_path, digest) if disk_cache else None
+  if isinstance(cached, dict):
+    attrs = cached
+    cacheable = True
+  else:
+    try: attrs, cacheable = compile_attrs(source, path=path, keywords=keywords, encoding=encoding)
+    except SystemExit as e: # The pipeline reports grammar errors as the CLI does, by exiting with the diagnostic.
+      raise LegsError(str(e.code)) from None
+    if cacheable and disk_cache: save_cached(cache_path, digest, attrs)
+
+  if cacheable: _compiled_lexers[digest] = attrs
+  return type(f'{name}Lexer', (ArrayLexerBase,), dict(attrs))
+
+
+def compile_attrs(source:str, path:str, keywords:bool, encoding:str) -> Tuple[Dict[str,Any],bool]:
+  'Compile the lexer class attributes for `compile`; also returns whether they can be cached.'
+  _, patterns, mode_pattern_kinds, mode_transitions, _ = parse_legs(path, source)
+  keyword_table:Keywords = {}
+  if keywords: mode_pattern_kinds, keyword_table = extract_keywords(patterns, mode_pattern_kinds)
+  if encoding == 'utf-8':
+    dfas = gen_dfas(patterns, mode_pattern_kinds)
+  else: # Validate the grammar without building the UTF-8 automata; the code point automata are built instead.
+    from .code_classes import encode_keywords, gen_single_byte_dfas # Imports this module.
+    for mode, pattern_kinds in mode_pattern_kinds.items(): gen_valid_nfa(mode, patterns, pattern_kinds)
+    dfas = gen_single_byte_dfas(patterns, mode_pattern_kinds, encoding=encoding)
+    keyword_table = encode_keywords(keyword_table, encoding)
+  flat = gen_flat_table(dfas)
+  ascii_flat = gen_ascii_table(dfas)
+  attrs:Dict[str,Any] = dict(
+    byte_classes=flat.byte_classes,
+    class_count=flat.class_count,
+    kinds=flat.kinds,
+    final_kind=flat.final_kind,
+    loop_classes=flat.loop_classes,
+    mode_starts=flat.mode_starts,
+    mode_transitions=mode_transitions,
+    keywords=keyword_table,
+    encoding=encoding,
+    pattern_descs=gen_pattern_descs(patterns),
+    table=array(flat.typecode, flat.table),
+    state_tags=flat.state_tags,
+    ascii_table=array_table(ascii_flat) if ascii_flat else None)
+  cacheable = not any(isinstance(p, ImportedPattern) for p in patterns.values())
+  return attrs, cacheable
@@ -0,0 +1,32 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+On-disk caching of compiled artifacts, keyed by a digest of their inputs.
+Cache files are pickled (digest, object) pairs; reads of missing, stale or incompatible files are misses,
+and writes are atomic and best-effort, so that the cache can be deleted or shared by concurrent builds at any time.
+'''
+
+import pickle
+from os import makedirs, replace as replace_file
+from typing import Any, Optional
+
+from pithy.fs import path_dir
+
+
+def load_cached(cache_path:str, digest:str) -> Optional[Any]:
+  'Return the object cached at `cache_path` if it was saved with `digest`, or else None.'
+  try:
+    with open(cache_path, 'rb') as f: cached_digest, obj = pickle.load(f)
+  except (OSError, EOFError, ValueError, TypeError, pickle.UnpicklingError, AttributeError, ImportError):
+    return None # Missing, unreadable, or written by an incompatible version.
+  return obj if cached_digest == digest else None
+
+
+def save_cached(cache_path:str, digest:str, obj:Any) -> None:
+  'Write `obj` atomically, so that concurrent builds never observe a partial file. Failures are ignored.'
+  tmp_path = f'{cache_path}.{digest[:16]}.tmp'
+  try:
+    makedirs(path_dir(cache_path) or '.', exist_ok=True)
+    with open(tmp_path, 'wb') as f: pickle.dump((digest, obj), f, protocol=pickle.HIGHEST_PROTOCOL)
+    replace_file(tmp_path, cache_path)
+  except OSError: pass
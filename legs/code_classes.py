@@ -0,0 +1,234 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+Code unit classes, for lexing text other than UTF-8 bytes: `str` and UTF-32 (whose units are code points), or UTF-16;
+and byte automata for single-byte encodings such as Latin-1, remapped from the code point automata.
+
+The unit space is partitioned into intervals at every boundary of every charset in the grammar
+(for UTF-16, at the boundaries of the unit ranges of the encoded charsets; see `utf16_unit_range_seqs`),
+and intervals that belong to exactly the same charset ranges are assigned the same class.
+Each charset is then replaced by its sequences of classes, and the automata are generated over the class alphabet,
+with one transition per unit rather than one per UTF-8 byte.
+The flat table then merges the classes that the minimized automata do not distinguish (see `legs.tables.gen_byte_classes`).
+At runtime the units are translated to table classes once, up front (see `legs_base.StrLexerBase` and `legs_base.UnitLexerBase`),
+so that token positions are unit indices.
+
+Classes are numbered in order of first unit; class 0 contains the units matched by no charset.
+'''
+
+from bisect import bisect_right
+from codecs import getincrementaldecoder, lookup as lookup_codec
+from itertools import chain
+from typing import Callable, Dict, FrozenSet, Hashable, Iterable, List, NamedTuple, Optional, Tuple
+
+from .build import gen_nfa, mode_name_key
+from .defs import Keywords
+from .dfa import DFA, minimize_dfa, renumber_dfa
+from .nfa import gen_dfa
+from .patterns import (Charset, Choice, ImportedPattern, LegsPattern, MkNode, NfaMutableTransitions, QuantityPattern, Seq)
+from .tables import FlatTable, gen_flat_table
+from .unicode import CodeRange, utf16_unit_range_seqs
+
+
+UnitRangeSeq = Tuple[CodeRange,...] # Half-open unit ranges, one per unit of the encoding.
+
+
+def unit_range_seqs(ranges:Iterable[CodeRange], utf16:bool) -> List[UnitRangeSeq]:
+  'Return the unit range sequences that encode the code points of `ranges`: as UTF-16 if `utf16` is true, or else as code points.'
+  if not utf16: return [(r,) for r in ranges]
+  return [tuple((low, high + 1) for low, high in seq) for seq in utf16_unit_range_seqs(ranges)]
+
+
+class CodeClasses(NamedTuple):
+  bounds:Tuple[int,...] # Start unit of each interval, ascending; bounds[0] is 0.
+  interval_classes:Tuple[int,...] # Class of each interval.
+  class_count:int
+
+  def class_for_unit(self, unit:int) -> int:
+    return self.interval_classes[bisect_right(self.bounds, unit) - 1]
+
+  def classes_for_range(self, unit_range:CodeRange) -> Tuple[int,...]:
+    'Return the sorted classes of the units in `unit_range`, which must be aligned to interval bounds.'
+    start, end = unit_range
+    classes = set()
+    i = bisect_right(self.bounds, start) - 1
+    while i < len(self.bounds) and self.bounds[i] < end:
+      classes.add(self.interval_classes[i])
+      i += 1
+    return tuple(sorted(classes))
+
+
+class ClassCharset(Charset):
+  '''
+  A charset over unit classes, which generates one NFA transition per class instead of UTF-8 byte sequences.
+  `is_literal` and `literal_pattern` refer to the original charset.
+  '''
+
+  def __init__(self, charset:Charset, class_seqs:Iterable[Tuple[Tuple[int,...],...]]) -> None:
+    super().__init__(ranges=charset.ranges)
+    self.charset = charset
+    self.class_seqs = tuple(class_seqs) # For each unit range sequence, the classes of each unit.
+
+  def gen_nfa(self, mk_node:MkNode, transitions:NfaMutableTransitions, start:int, end:int) -> None:
+    # As for UTF-8 in `Charset.gen_nfa`, share the intermediate nodes of sequences with the same leading units.
+    prefix_nodes:Dict[Tuple[Tuple[int,...],...],int] = {}
+    for class_seq in self.class_seqs:
+      node = start
+      for i, classes in enumerate(class_seq, 1):
+        if i < len(class_seq):
+          prefix = class_seq[:i]
+          try: dst = prefix_nodes[prefix]
+          except KeyError:
+            dst = prefix_nodes[prefix] = mk_node()
+            for c in classes: transitions[node][c].add(dst)
+          node = dst
+        else:
+          for c in classes: transitions[node][c].add(end)
+
+
+def all_charsets(pattern:LegsPattern) -> Iterable[Charset]:
+  if isinstance(pattern, Charset): yield pattern
+  elif isinstance(pattern, ImportedPattern): yield from all_charsets(pattern.pattern)
+  else:
+    for sub in pattern: yield from all_charsets(sub) # type: ignore[attr-defined]
+
+
+def map_charsets(pattern:LegsPattern, fn:Callable[[Charset],LegsPattern]) -> LegsPattern:
+  'Return a copy of `pattern` with each charset replaced by the result of `fn`.'
+  if isinstance(pattern, Charset): return fn(pattern)
+  if isinstance(pattern, ImportedPattern): return map_charsets(pattern.pattern, fn)
+  if isinstance(pattern, Choice): return Choice(*(map_charsets(sub, fn) for sub in pattern))
+  if isinstance(pattern, Seq): return Seq((map_charsets(sub, fn) for sub in pattern), tags=pattern.tags)
+  if isinstance(pattern, QuantityPattern): return type(pattern)(map_charsets(pattern.sub, fn))
+  raise TypeError(pattern)
+
+
+def gen_code_classes(charset_seqs:List[List[UnitRangeSeq]], unit_end:int) -> CodeClasses:
+  '''
+  Partition the units below `unit_end` into classes for the unit range sequences of each charset.
+  Two units are in the same class if they are in exactly the same charsets at every position of every sequence;
+  at later positions, the leading ranges of the sequence are also distinguished, because they lead to distinct NFA nodes.
+  '''
+  # Sweep over the range bounds, tracking the set of keys that contain each interval.
+  events:Dict[int,List[Tuple[Hashable,int]]] = { 0: [], unit_end: [] }
+  for i, seqs in enumerate(charset_seqs):
+    for seq in seqs:
+      for j, (start, end) in enumerate(seq):
+        seq_key = (i, seq[:j+1]) if len(seq) > 1 else (i,)
+        events.setdefault(start, []).append((seq_key, 1))
+        events.setdefault(end, []).append((seq_key, -1))
+  counts:Dict[Hashable,int] = {}
+  signature_classes:Dict[FrozenSet[Hashable],int] = { frozenset(): 0 }
+  bounds:List[int] = []
+  interval_classes:List[int] = []
+  for unit in sorted(events):
+    if unit == unit_end: break
+    for key, delta in events[unit]:
+      n = counts.get(key, 0) + delta
+      if n: counts[key] = n
+      else: del counts[key]
+    c = signature_classes.setdefault(frozenset(counts), len(signature_classes))
+    if interval_classes and interval_classes[-1] == c: continue # Merge adjacent intervals.
+    bounds.append(unit)
+    interval_classes.append(c)
+  return CodeClasses(bounds=tuple(bounds), interval_classes=tuple(interval_classes), class_count=len(signature_classes))
+
+
+def gen_code_dfas(patterns:Dict[str,LegsPattern], mode_pattern_kinds:Dict[str,FrozenSet[str]], utf16:bool) \
+ -> Tuple[CodeClasses,List[DFA]]:
+  '''
+  Generate the unit classes and the minimized DFA over classes for each mode, with main first.
+  The grammar is assumed to have been validated already by generating the byte DFAs, so notes are omitted.
+  '''
+  charsets = list(chain.from_iterable(all_charsets(p) for p in patterns.values()))
+  charset_seqs = [unit_range_seqs(charset.ranges, utf16=utf16) for charset in charsets]
+  code_classes = gen_code_classes(charset_seqs, unit_end=(0x10000 if utf16 else 0x110000))
+  class_charsets = { id(charset) : ClassCharset(charset,
+    [tuple(code_classes.classes_for_range(r) for r in seq) for seq in seqs]) for charset, seqs in zip(charsets, charset_seqs) }
+  class_patterns = { kind : map_charsets(pattern, lambda charset: class_charsets[id(charset)])
+    for kind, pattern in patterns.items() }
+  dfas:List[DFA] = []
+  start_node = 0
+  for mode, pattern_kinds in sorted(mode_pattern_kinds.items(), key=lambda p: mode_name_key(p[0])):
+    named_patterns = sorted((kind, class_patterns[kind]) for kind in pattern_kinds)
+    nfa = gen_nfa(name=mode, named_patterns=named_patterns)
+    fat_dfa = gen_dfa(nfa, symbol_count=code_classes.class_count)
+    min_dfa = renumber_dfa(minimize_dfa(fat_dfa, start_node=start_node, notes=False))
+    start_node = min_dfa.end_node
+    dfas.append(min_dfa)
+  return code_classes, dfas
+
+
+class CodeTable(NamedTuple):
+  flat:FlatTable # `flat.byte_classes` maps code classes to table classes, and is superseded by `bounds` and `classes`.
+  bounds:Tuple[int,...] # Start unit of each interval, ascending; bounds[0] is 0.
+  classes:bytes # Table class of each interval.
+
+
+def gen_code_table(patterns:Dict[str,LegsPattern], mode_pattern_kinds:Dict[str,FrozenSet[str]], utf16:bool) -> CodeTable:
+  'Generate the flat table over unit classes, with the intervals mapping units directly to table classes.'
+  code_classes, dfas = gen_code_dfas(patterns, mode_pattern_kinds, utf16=utf16)
+  flat = gen_flat_table(dfas, symbol_count=code_classes.class_count)
+  # Compose the interval classes with the table classes, merging adjacent intervals of the same class.
+  bounds:List[int] = []
+  classes:List[int] = []
+  for bound, c in zip(code_classes.bounds, code_classes.interval_classes):
+    table_class = flat.byte_classes[c]
+    if classes and classes[-1] == table_class: continue
+    bounds.append(bound)
+    classes.append(table_class)
+  return CodeTable(flat=flat, bounds=tuple(bounds), classes=bytes(classes))
+
+
+def single_byte_code_points(encoding:str) -> List[Optional[int]]:
+  '''
+  Return the code point of each byte in the single-byte `encoding`, or None for bytes that the encoding leaves undefined.
+  Exits if `encoding` is unknown or is not a single-byte encoding.
+  '''
+  try: name = lookup_codec(encoding).name
+  except LookupError: exit(f'legs error: unknown encoding: {encoding!r}.')
+  codes:List[Optional[int]] = []
+  for byte in range(0x100):
+    decoder = getincrementaldecoder(name)()
+    try: text = decoder.decode(bytes((byte,)), final=False)
+    except UnicodeDecodeError: text = None
+    if text is not None and len(text) != 1:
+      exit(f'legs error: not a single-byte encoding: {encoding!r}.')
+    codes.append(None if text is None else ord(text))
+  return codes
+
+
+def gen_single_byte_dfas(patterns:Dict[str,LegsPattern], mode_pattern_kinds:Dict[str,FrozenSet[str]], encoding:str,
+ counts:Optional[Dict[int,int]]=None) -> List[DFA]:
+  '''
+  Generate the minimized byte DFA for each mode, with main first, for text in the single-byte `encoding`.
+  The code point automata are remapped through the codec table, so that each byte transitions as its code point does;
+  bytes that the encoding leaves undefined are matched by no pattern, and so are `invalid`.
+  The result can be used by any byte lexer backend, which then lexes the encoded bytes directly.
+  `counts` is an optional state profile, as passed to `renumber_dfa`.
+  '''
+  codes = single_byte_code_points(encoding)
+  code_classes, code_dfas = gen_code_dfas(patterns, mode_pattern_kinds, utf16=False)
+  byte_classes = [0 if code is None else code_classes.class_for_unit(code) for code in codes]
+  dfas:List[DFA] = []
+  start_node = 0
+  for code_dfa in code_dfas:
+    transitions = { node : { byte : d[c] for byte, c in enumerate(byte_classes) if c in d }
+      for node, d in code_dfa.transitions.items() }
+    dfa = DFA(name=code_dfa.name, transitions=transitions, match_node_kind_sets=code_dfa.match_node_kind_sets,
+      lit_patterns=code_dfa.lit_patterns, node_patterns=code_dfa.node_patterns, node_tags=code_dfa.node_tags)
+    min_dfa = renumber_dfa(minimize_dfa(dfa, start_node=start_node, notes=False), counts=counts)
+    start_node = min_dfa.end_node
+    dfas.append(min_dfa)
+  return dfas
+
+
+def encode_keywords(keywords:Keywords, encoding:str) -> Keywords:
+  'Re-encode the UTF-8 keyword texts; keywords that `encoding` cannot represent never occur, and are omitted.'
+  encoded:Keywords = {}
+  for general, texts in keywords.items():
+    encoded_texts = encoded[general] = {}
+    for text, kind in texts.items():
+      try: encoded_texts[text.decode('utf8').encode(encoding)] = kind
+      except UnicodeEncodeError: pass
+  return encoded
@@ -47,6 +47,8 @@ DfaState = int
 DfaStateTransitions = Dict[int, DfaState]
 DfaTransitions = Dict[int, DfaStateTransitions]
 
+Tag = Tuple[str,str] # The pattern kind and tag name of an `@name` tag.
+
 FrozenSetStr0:FrozenSet[str] = frozenset()
 
 
@@ -54,13 +56,16 @@ class DFA:
   'Deterministic Finite Automaton.'
 
   def __init__(self, name:str, transitions:DfaTransitions, match_node_kind_sets:Dict[int,FrozenSet[str]], lit_patterns:Set[str],
-   kinds_greedy_ordered=Tuple[str,...]) -> None:
+   kinds_greedy_ordered=Tuple[str,...], node_patterns:Optional[Dict[int,FrozenSet[str]]]=None,
+   node_tags:Optional[Dict[int,FrozenSet[Tag]]]=None) -> None:
     assert name
     self.name = name
     self.transitions = transitions
     self.match_node_kind_sets = match_node_kind_sets
     self.lit_patterns = lit_patterns
     self.kinds_greedy_ordered = kinds_greedy_ordered # The ordering necessary for greedy regex choices to match correctly.
+    self.node_patterns = node_patterns or {} # Provenance: the patterns that contribute to each node.
+    self.node_tags = node_tags or {} # The tags set on entering each node; see `legs.nfa.gen_dfa`.
     self.start_node = min(transitions)
     self.invalid_node = self.start_node + 1
     self.end_node = max(transitions) + 1
@@ -96,6 +101,11 @@ class DFA:
   @property
   def match_nodes(self) -> FrozenSet[int]: return frozenset(self.match_node_kind_sets.keys())
 
+  @property
+  def final_nodes(self) -> FrozenSet[int]:
+    'Match nodes without transitions, for which a lexer can emit the token without reading another byte.'
+    return self.terminal_nodes & self.match_nodes
+
   @property
   def non_match_nodes(self) -> FrozenSet[int]: return self.all_nodes - self.match_nodes
 
@@ -181,7 +191,7 @@ class DFA:
     return first_el(s)
 
 
-def minimize_dfa(dfa:DFA, start_node:int) -> DFA:
+def minimize_dfa(dfa:DFA, start_node:int, notes:bool=True) -> DFA:
   '''
   Optimize a DFA by coalescing redundant states.
   sources:
@@ -191,12 +201,15 @@ def minimize_dfa(dfa:DFA, start_node:int) -> DFA:
 
   Additionally, reduce nodes that match more than one pattern where possible,
   or issue errors if not.
+  If `notes` is false, omit the notes about patterns that cannot be ordered for greedy regex choice.
   '''
 
   alphabet = dfa.alphabet
-  # start with a rough partition; non-match nodes form one set,
+  # start with a rough partition; non-match nodes that set the same tags form one set,
   # and each match node is distinct from all others.
-  init_sets = [set(dfa.non_match_nodes), *({n} for n in dfa.match_nodes)]
+  tag_sets:DefaultDict[FrozenSet[Tag],Set[int]] = defaultdict(set)
+  for node in dfa.non_match_nodes: tag_sets[dfa.node_tags.get(node, frozenset())].add(node)
+  init_sets = [*tag_sets.values(), *({n} for n in dfa.match_nodes)]
 
   part_ids_to_parts = { id(s): s for s in init_sets }
   node_parts = { n: s for s in part_ids_to_parts.values() for n in s }
@@ -312,9 +325,7 @@ def minimize_dfa(dfa:DFA, start_node:int) -> DFA:
   # Check for ambiguous patterns.
   ambiguous_kind_groups = { tuple(sorted(kinds)) for kinds in match_node_kinds.values() if len(kinds) != 1 }
   if ambiguous_kind_groups:
-    for group in sorted(ambiguous_kind_groups):
-      errL('Rules are ambiguous: ', ', '.join(group), '.')
-    exit(1)
+    exit('\n'.join(f'Rules are ambiguous: {", ".join(group)}.' for group in sorted(ambiguous_kind_groups)))
 
   # Determine a satisfactory ordering of kinds for generated greedy regex choices.
   # `kind_rels` is currently half complete: it will prefer more specific patterns over less specific ones.
@@ -339,7 +350,7 @@ def minimize_dfa(dfa:DFA, start_node:int) -> DFA:
       if kind < sup and kind in kind_rels[sup]:
         unorderable_pairs.append((kind, sup))
 
-  if unorderable_pairs:
+  if unorderable_pairs and notes:
     errL(f'note: `{dfa.name}`: minimized DFA contains patterns that cannot be correctly ordered for greedy regex choice: ',
       ', '.join(str(p) for p in unorderable_pairs), '.')
 
@@ -347,5 +358,78 @@ def minimize_dfa(dfa:DFA, start_node:int) -> DFA:
 
   match_node_kind_sets = { node : frozenset(kinds) for node, kinds in match_node_kinds.items() }
 
+  # Provenance: each merged node derives from the union of the patterns of its old nodes.
+  node_patterns_dd:DefaultDict[int,Set[str]] = defaultdict(set)
+  for old_node, patterns in dfa.node_patterns.items():
+    node_patterns_dd[mapping[old_node]].update(patterns)
+  node_patterns = { node : frozenset(patterns) for node, patterns in node_patterns_dd.items() }
+  node_tags = { mapping[old_node] : tags for old_node, tags in dfa.node_tags.items() } # Tags are the same across each part.
+
+  return DFA(name=dfa.name, transitions=transitions, match_node_kind_sets=match_node_kind_sets,
+    lit_patterns=dfa.lit_patterns, kinds_greedy_ordered=kinds_greedy_ordered, node_patterns=node_patterns,
+    node_tags=node_tags)
+
+
+def renumber_dfa(dfa:DFA, counts:Optional[Dict[int,int]]=None) -> DFA:
+  '''
+  Renumber the nodes of `dfa` for locality of reference in generated tables, keeping the same range of node numbers.
+  By default nodes are numbered breadth-first from the start node, so that the states near the start of every token,
+  which are visited most, are adjacent.
+  If `counts` is provided, it maps node numbers to visit counts, as gathered by `legs_base.count_state_visits`
+  with a lexer generated without `counts` (i.e. numbered breadth-first);
+  the nodes are then numbered in order of decreasing count, with ties in breadth-first order,
+  so that the hottest states are packed together.
+  The start and invalid nodes always keep their numbers.
+  '''
+  start = dfa.start_node
+  order = [start]
+  if dfa.invalid_node in dfa.all_nodes: order.append(dfa.invalid_node)
+  fixed = len(order)
+  seen = set(order)
+  i = 0
+  while i < len(order): # Grows as new nodes are discovered.
+    for _, dst in sorted(dfa.transitions.get(order[i], {}).items()):
+      if dst not in seen:
+        seen.add(dst)
+        order.append(dst)
+    i += 1
+  order.extend(sorted(dfa.all_nodes - seen)) # Unreachable nodes, if any, remain last.
+
+  if counts:
+    ranked = sorted(range(fixed, len(order)), key=lambda i: (-counts.get(start + i, 0), i))
+    order = order[:fixed] + [order[i] for i in ranked]
+
+  mapping = { old : new for new, old in enumerate(order, start) }
+  transitions = { mapping[src] : { byte : mapping[dst] for byte, dst in d.items() }
+    for src, d in sorted(dfa.transitions.items(), key=lambda p: mapping[p[0]]) }
+  match_node_kind_sets = { mapping[node] : kinds for node, kinds in dfa.match_node_kind_sets.items() }
+  node_patterns = { mapping[node] : patterns for node, patterns in dfa.node_patterns.items() }
+  node_tags = { mapping[node] : tags for node, tags in dfa.node_tags.items() }
+  return DFA(name=dfa.name, transitions=transitions, match_node_kind_sets=match_node_kind_sets,
+    lit_patterns=dfa.lit_patterns, kinds_greedy_ordered=dfa.kinds_greedy_ordered, node_patterns=node_patterns,
+    node_tags=node_tags)
+
+
+def project_dfa(dfa:DFA, alphabet:Iterable[int]) -> DFA:
+  '''
+  Restrict `dfa` to the bytes of `alphabet`, dropping the nodes that are no longer reachable from the start node.
+  The result lexes any text drawn from `alphabet` exactly as `dfa` does; for example, ASCII text only needs
+  the nodes reachable by ASCII bytes, and none of the multi-byte UTF-8 subautomata of Unicode character classes.
+  Node numbers are unchanged, so the result occupies a subset of the node range of `dfa`.
+  '''
+  alphabet = frozenset(alphabet)
+  start = dfa.start_node
+  transitions:DfaTransitions = {}
+  remaining = [start]
+  while remaining:
+    node = remaining.pop()
+    if node in transitions: continue
+    d = transitions[node] = { byte : dst for byte, dst in dfa.transitions.get(node, {}).items() if byte in alphabet }
+    remaining.extend(dst for dst in d.values() if dst not in transitions)
+  transitions = dict(sorted(transitions.items()))
+  match_node_kind_sets = { node : kinds for node, kinds in dfa.match_node_kind_sets.items() if node in transitions }
+  node_patterns = { node : patterns for node, patterns in dfa.node_patterns.items() if node in transitions }
+  node_tags = { node : tags for node, tags in dfa.node_tags.items() if node in transitions }
   return DFA(name=dfa.name, transitions=transitions, match_node_kind_sets=match_node_kind_sets,
-    lit_patterns=dfa.lit_patterns, kinds_greedy_ordered=kinds_greedy_ordered)
+    lit_patterns=dfa.lit_patterns, kinds_greedy_ordered=dfa.kinds_greedy_ordered, node_patterns=node_patterns,
+    node_tags=node_tags)
@@ -0,0 +1,75 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+Regex fast paths for the hybrid lexer.
+
+The `python-hybrid` backend emits the flat table of `legs.tables.gen_flat_table`,
+and also for each mode a combined regex with one alternative per pattern kind.
+At each token, `legs_base.HybridLexerBase` first tries an anchored match of the regex,
+which runs in C and is fast for long tokens; it only runs the DFA if the regex match might disagree with it.
+
+The regex match is accepted only when the DFA would produce the same token.
+The regex is sound (the matched text is in the language of the matched kind),
+so the DFA, run over the same text, reaches a match state `s` whose patterns include that kind.
+That state ends the token if the following byte has no transition from `s`;
+to check this cheaply, each kind records the bytes on which any such state continues.
+The kind of `s` is then the matched kind, unless the text is also claimed by another pattern:
+* Literal patterns take precedence over the general patterns that also match their text;
+  these texts are looked up in a table for each kind, as for keywords.
+* General patterns that overlap each other are resolved by the subset rule of `legs.dfa.minimize_dfa`.
+  This is rare, and the losing kinds are omitted from the regex so that the DFA always handles them.
+Since the regex contains no `invalid` or `incomplete` alternatives, those tokens are always produced by the DFA.
+'''
+
+from collections import defaultdict
+from typing import DefaultDict, Dict, FrozenSet, Iterable, List, Mapping, Set
+
+from legs_base import HybridMode
+from pithy.iterable import first_el
+
+from .dfa import DFA
+from .patterns import LegsPattern
+
+
+def gen_hybrid_modes(dfas:List[DFA], patterns:Dict[str,LegsPattern],
+ mode_kind_sets:Mapping[str,Iterable[FrozenSet[str]]]) -> Dict[str,HybridMode]:
+  '''
+  Generate the regex fast path for each mode.
+  `mode_kind_sets` holds for each mode the distinct sets of kinds matched by the states of the unminimized DFA.
+  '''
+  flavor = 'py.re.bytes'
+  hybrid_modes:Dict[str,HybridMode] = {}
+  for dfa in dfas:
+    kind_sets = tuple(mode_kind_sets[dfa.name])
+    def is_subset(kind:str, other:str) -> bool:
+      'Whether every state that matches `kind` also matches `other`; see `minimize_dfa`.'
+      return all(other in kinds for kinds in kind_sets if kind in kinds)
+
+    omitted:Set[str] = set() # General kinds that lose to other general kinds.
+    literal_kinds:Dict[str,Dict[bytes,str]] = {}
+    for kinds in kind_sets:
+      if len(kinds) == 1: continue
+      winner = first_el(k for k in kinds if all(is_subset(k, other) for other in kinds))
+      if winner not in dfa.lit_patterns: omitted.update(kinds - dfa.lit_patterns - {winner})
+      for lit in sorted(kinds & dfa.lit_patterns):
+        text = patterns[lit].literal_pattern
+        resolved = first_el(dfa.match(text))
+        for kind in kinds:
+          if kind != resolved: literal_kinds.setdefault(kind, {})[text.encode('utf8')] = resolved
+
+    # For each kind, the bytes on which a match state containing that kind can continue.
+    kind_continuations:DefaultDict[str,Set[int]] = defaultdict(set)
+    for node in dfa.match_nodes:
+      bytes_ = dfa.transitions.get(node, {}).keys()
+      for kind in dfa.node_patterns.get(node, dfa.match_kinds(node)):
+        kind_continuations[kind].update(bytes_)
+
+    mode_kinds = tuple(kind for kind in dfa.kinds_greedy_ordered if kind not in omitted)
+    regexes = [f'( {patterns[kind].gen_regex(flavor=flavor)} )\n' for kind in mode_kinds]
+    regex = ('(?x)\n  ' + '| '.join(regexes)) if regexes else '(?!)' # The empty regex would match; this never does.
+    hybrid_modes[dfa.name] = HybridMode(
+      regex=regex.encode('ascii'),
+      kinds=mode_kinds,
+      continuations=tuple(bytes(sorted(kind_continuations[kind])) for kind in mode_kinds),
+      literals=tuple(dict(sorted(literal_kinds.get(kind, {}).items())) for kind in mode_kinds))
+  return hybrid_modes
@@ -0,0 +1,88 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+Grammar imports.
+
+A grammar can import the patterns of another grammar with an `# Imports` section:
+each line names a grammar file in the same directory (without the `.legs` extension),
+optionally followed by a colon and the names of the patterns to import; by default all patterns are imported.
+Only patterns are imported; the modes and transitions of imported grammars are ignored.
+
+An imported grammar is compiled once into an artifact containing its parsed patterns
+along with a precompiled NFA fragment for each pattern.
+Artifacts are memoized in-process, and cached on disk in a `__legscache__` directory next to the grammar,
+keyed by a digest of the grammar source, so that importing grammars reuse them instead of recompiling.
+An artifact also records the digests of the grammars it imports, and is only reused if they are unchanged,
+so that editing a transitively imported grammar invalidates every grammar that depends on it.
+'''
+
+from hashlib import sha256
+from typing import Dict, Optional, Tuple
+
+from pithy.fs import path_dir, path_join, path_name
+
+from .cache import load_cached, save_cached
+from .patterns import ImportedPattern, LegsPattern, gen_nfa_fragment
+
+
+cache_version = 3 # Increment whenever the artifact contents or the NFA generation change.
+
+
+class CompiledGrammar:
+  '''
+  The reusable artifact for an imported grammar.
+  `src_digest` covers the grammar source; `digest` also covers the digests of the imported grammars in `imports`.
+  '''
+
+  def __init__(self, path:str, src_digest:str, imports:Dict[str,str], patterns:Dict[str,ImportedPattern]) -> None:
+    self.path = path
+    self.src_digest = src_digest
+    self.imports = imports
+    self.digest = sha256(''.join([src_digest, *(f'\n{p}:{d}' for p, d in sorted(imports.items()))]).encode()).hexdigest()
+    self.patterns = patterns
+
+
+_compiled_grammars:Dict[str,CompiledGrammar] = {} # In-process memo, keyed by path.
+
+
+def compile_grammar(path:str, import_stack:Tuple[str,...]=()) -> CompiledGrammar:
+  '''
+  Return the compiled artifact for the grammar at `path`,
+  from the in-process memo or the disk cache if they are up to date, or else by compiling it.
+  Raises FileNotFoundError if the grammar does not exist.
+  '''
+  with open(path, 'rb') as f: src_bytes = f.read()
+  src_digest = sha256(b'%d\n' % cache_version + src_bytes).hexdigest()
+
+  grammar:Optional[CompiledGrammar] = _compiled_grammars.get(path)
+  if grammar and grammar.src_digest == src_digest and imports_are_current(grammar, import_stack): return grammar
+
+  cache_path = path_join(path_dir(path), '__legscache__', path_name(path) + 'c')
+  cached = load_cached(cache_path, src_digest)
+  if isinstance(cached, CompiledGrammar) and imports_are_current(cached, import_stack):
+    grammar = cached
+  else:
+    from .parse import parse_legs # Deferred to avoid a circular import.
+    imports:Dict[str,str] = {}
+    _, patterns, _, _, _ = parse_legs(path, src_bytes.decode('utf8'), import_stack=import_stack, imports=imports)
+    grammar = CompiledGrammar(path=path, src_digest=src_digest, imports=imports,
+      patterns={ name : compile_pattern(pattern) for name, pattern in patterns.items() })
+    save_cached(cache_path, src_digest, grammar)
+  _compiled_grammars[path] = grammar
+  return grammar
+
+
+def imports_are_current(grammar:CompiledGrammar, import_stack:Tuple[str,...]) -> bool:
+  'Whether each grammar imported by `grammar` still compiles to the digest recorded in it.'
+  stack = (*import_stack, grammar.path)
+  for path, digest in grammar.imports.items():
+    if path in stack: return False # The imports have become circular; recompile to report the error.
+    try: current = compile_grammar(path, import_stack=stack)
+    except FileNotFoundError: return False # Recompile to report the error.
+    if current.digest != digest: return False
+  return True
+
+
+def compile_pattern(pattern:LegsPattern) -> ImportedPattern:
+  if isinstance(pattern, ImportedPattern): return pattern # Transitively imported; already compiled.
+  return ImportedPattern(pattern, gen_nfa_fragment(pattern))
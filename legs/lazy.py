@@ -0,0 +1,162 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+Compact NFAs for lazy determinization.
+
+Full determinization can be exponential in the size of the NFA,
+and for grammars that cross large Unicode classes with many literals it dominates build time.
+Instead, the `python-lazy` backend emits the NFA of each mode, and `legs_base.LazyLexerBase` determinizes it on demand,
+caching the DFA states that are actually visited (in the style of RE2).
+
+To keep the runtime simple, the emitted NFA has no empty transitions:
+each destination set is replaced by its closure, and each node's transitions are stored as
+(low byte, high byte, destination nodes) ranges.
+Each mode has a synthetic start node combining the closure of the NFA start node
+with the `invalid` transitions that `gen_dfa` adds to the start of every DFA.
+
+A state that matches several patterns is resolved by the subset rule of `minimize_dfa`:
+a kind takes precedence over another if every string matched by the first is also matched by the second.
+`gen_kind_precedences` computes this relation without determinizing the whole NFA,
+and kinds are numbered so that the runtime can simply choose the kind with the lowest index.
+States that the rule cannot resolve are reported as ambiguity errors, as full determinization does.
+'''
+
+from typing import Dict, FrozenSet, List, NamedTuple, Set, Tuple
+
+from pithy.io import errL
+from pithy.iterable import int_tuple_ranges
+
+from .build import gen_nfa
+from .nfa import NFA, NfaState, empty_symbol, gen_dfa
+from .patterns import LegsPattern
+
+
+NfaRange = Tuple[int,int,Tuple[int,...]] # Low byte, high byte (inclusive), destination nodes.
+
+
+class LazyNFA(NamedTuple):
+  kinds:Tuple[str,...] # kinds[0] is 'incomplete'; kinds[1] is 'invalid'; then the rest, in order of precedence.
+  mode_starts:Dict[str,int] # Synthetic start node for each mode.
+  node_kinds:List[int] # Kind index for each node, or 0.
+  node_ranges:List[Tuple[NfaRange,...]] # Transitions for each node.
+
+
+def gen_kind_precedences(nfa:NFA, patterns:Dict[str,LegsPattern]) -> Set[Tuple[str,str]]:
+  '''
+  Return the pairs of kinds (winner, loser) in the mode of `nfa` that the subset rule of `minimize_dfa` resolves.
+  As in `legs.build.extract_keywords`, only the general patterns are determinized;
+  the kinds matching each literal are found by matching its text against `nfa`.
+  Exits with an error if any combination of kinds is ambiguous.
+  '''
+  kind_sets:Set[FrozenSet[str]] = set() # The distinct sets of kinds matched by the states of the fat DFA.
+  general_patterns = sorted((kind, patterns[kind]) for kind in set(nfa.match_node_kinds.values())
+    if kind != 'invalid' and kind not in nfa.lit_patterns)
+  general_nfa = gen_nfa(name=nfa.name, named_patterns=general_patterns)
+  if general_patterns:
+    general_dfa = gen_dfa(general_nfa)
+    kind_sets.update(kinds for kinds in general_dfa.match_node_kind_sets.values() if 'invalid' not in kinds)
+  text_literals:Dict[str,Set[str]] = {}
+  for lit in nfa.lit_patterns:
+    text_literals.setdefault(patterns[lit].literal_pattern, set()).add(lit)
+  for text, lits in text_literals.items():
+    kind_sets.add(general_nfa.match(text) | lits) # `NFA.match` would omit the general kinds if given the literals.
+
+  # For each kind, the kinds that are matched by every state that matches it.
+  supersets:Dict[str,FrozenSet[str]] = {}
+  for kinds in kind_sets:
+    for kind in kinds:
+      supersets[kind] = supersets.get(kind, kinds) & kinds
+
+  def precedes(kind:str, other:str) -> bool:
+    return other in supersets[kind] and kind not in supersets[other]
+
+  ambiguous_kind_groups:Set[Tuple[str,...]] = set()
+  for kinds in kind_sets:
+    remaining = tuple(sorted(k for k in kinds if not any(precedes(o, k) for o in kinds)))
+    if len(remaining) != 1: ambiguous_kind_groups.add(remaining)
+  if ambiguous_kind_groups:
+    for group in sorted(ambiguous_kind_groups):
+      errL('Rules are ambiguous: ', ', '.join(group), '.')
+    exit(1)
+
+  return { (kind, other) for kind, others in supersets.items() for other in others if precedes(kind, other) }
+
+
+def gen_lazy_nfa(nfas:List[NFA], patterns:Dict[str,LegsPattern]) -> LazyNFA:
+  # Order the kinds so that each comes after every kind that takes precedence over it in any mode.
+  losers_winners:Dict[str,Set[str]] = {}
+  for nfa in nfas:
+    for winner, loser in gen_kind_precedences(nfa, patterns):
+      losers_winners.setdefault(loser, set()).add(winner)
+  depths:Dict[str,int] = {}
+  def depth(kind:str) -> int:
+    try: return depths[kind]
+    except KeyError: pass
+    d = depths[kind] = 1 + max((depth(w) for w in losers_winners.get(kind, ())), default=-1)
+    return d
+
+  literals = {kind for nfa in nfas for kind in nfa.lit_patterns}
+  ordered = sorted({kind for nfa in nfas for kind in nfa.match_node_kinds.values()} - {'invalid'},
+    key=lambda kind: (depth(kind), kind not in literals, kind))
+  kinds = ('incomplete', 'invalid', *ordered)
+  kind_indices = { kind : i for i, kind in enumerate(kinds) }
+
+  mode_starts:Dict[str,int] = {}
+  node_kinds:List[int] = []
+  node_ranges:List[Tuple[NfaRange,...]] = []
+
+  for nfa in nfas:
+    closures:Dict[int,NfaState] = {}
+    def closure(node:int) -> NfaState:
+      try: return closures[node]
+      except KeyError: pass
+      c = closures[node] = nfa.advance_empties({node})
+      return c
+
+    def closed_byte_dsts(nodes:FrozenSet[int]) -> Dict[int,Set[int]]:
+      byte_dsts:Dict[int,Set[int]] = {}
+      for node in nodes:
+        for byte, dsts in nfa.transitions.get(node, {}).items():
+          if byte == empty_symbol: continue
+          s = byte_dsts.setdefault(byte, set())
+          for dst in dsts: s.update(closure(dst))
+      return byte_dsts
+
+    start = -1 # Synthetic start node.
+    invalid = 1
+    start_byte_dsts = closed_byte_dsts(closure(0))
+    invalid_bytes = set(range(0x100)) - set(start_byte_dsts)
+    for byte in invalid_bytes: start_byte_dsts[byte] = {invalid}
+
+    # Number the reachable nodes, starting with the synthetic start node.
+    local_ids:Dict[int,int] = {}
+    node_byte_dsts:List[Dict[int,Set[int]]] = []
+    def local_id(node:int) -> int:
+      try: return local_ids[node]
+      except KeyError: pass
+      local_ids[node] = len(local_ids)
+      if node == start: node_byte_dsts.append(start_byte_dsts)
+      elif node == invalid: node_byte_dsts.append({ byte : {invalid} for byte in invalid_bytes })
+      else: node_byte_dsts.append(closed_byte_dsts(frozenset({node})))
+      return local_ids[node]
+
+    local_id(start)
+    base = len(node_ranges)
+    i = 0
+    while i < len(node_byte_dsts): # Grows as new destinations are discovered.
+      byte_dsts = node_byte_dsts[i]
+      dst_bytes:Dict[Tuple[int,...],List[int]] = {}
+      for byte, dsts in sorted(byte_dsts.items()):
+        dst_ids = tuple(sorted(base + local_id(dst) for dst in dsts))
+        dst_bytes.setdefault(dst_ids, []).append(byte)
+      ranges = sorted((lo, end - 1, dst_ids) for dst_ids, bytes_ in dst_bytes.items() for lo, end in int_tuple_ranges(bytes_))
+      node_ranges.append(tuple(ranges))
+      i += 1
+
+    for node, _ in sorted(local_ids.items(), key=lambda p: p[1]):
+      kind = 'invalid' if node == invalid else nfa.match_node_kinds.get(node)
+      node_kinds.append(0 if kind is None else kind_indices[kind])
+    mode_starts[nfa.name] = base
+
+  return LazyNFA(kinds=kinds, mode_starts=mode_starts, node_kinds=node_kinds,
+    node_ranges=node_ranges)
@@ -0,0 +1,63 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+# This file was generated by legs from grammars/legs.legs.
+
+from legs_base import DictLexerBase, Keywords, LazyModeData, ModeData, ModeTransitions, StateTags
+from typing import Dict, Iterator, Pattern, Tuple
+
+
+class LegsLexer(DictLexerBase):
+
+  pattern_descs:Dict[str,str] = { 'amp': '`&`',
+  'bar': '`|`',
+  'brckt_c': '`]`',
+  'brckt_o': '`[`',
+  'caret': '`^`',
+  'char': 'char',
+  'colon': '`:`',
+  'comment': 'comment',
+  'dash': '`-`',
+  'esc': 'esc',
+  'incomplete': 'incomplete',
+  'invalid': 'invalid',
+  'newline': 'newline',
+  'paren_c': '`)`',
+  'paren_o': '`(`',
+  'plus': '`+`',
+  'qmark': '`?`',
+  'ref': 'ref',
+  'section': 'section',
+  'section_invalid': 'section_invalid',
+  'space': 'space',
+  'star': '`*`',
+  'sym': 'sym',
+  'tag': 'tag'}
+
+  mode_transitions:ModeTransitions = {}
+
+  keywords:Keywords = {}
+
+  encoding:str = 'utf-8'
+
+  mode_data:Dict[str,ModeData] = LazyModeData( # type: ignore[assignment]
+    mode_starts=(('main', 0),),
+    kinds=( 'amp', 'bar', 'brckt_c', 'brckt_o', 'caret', 'char', 'colon', 'comment', 'dash', 'esc', 'invalid', 'newline', 'paren_c',
+  'paren_o', 'plus', 'qmark', 'ref', 'section', 'section_invalid', 'space', 'star', 'sym', 'tag'),
+    transitions=('B',
+    b'eNq1VMlSGlEUfd1qFFCcRRyeIJPKqCKCE4I4oOKsyAwKqWhFHLNRU/gHyR8kf2KFH6HZ09AUnXVy6UVXZdGtm6y4t/q8U+ece4oMMiEJKZU2yEZIlapRPUpq'
+    b'NE1a7QedjtTrmw0GcmysZXxcMjEhNRplJhNpNrdaLKTV2mZzyefm2ueXSLe7Y3m50xOWRyJd0Wh3LNYTj/cmEvJkkkw9yp+eyOfnvq858uUXkS8oKKq/WFLS'
+    b'9EC5omSYwWptiGWHf/8hiPp3+CVRA2okQEjTEJJg2QhWqUbUG9jvV21u40BAvbOL9/ZG9w/x0ZHm+BO+uFBdfsZXV+rsNb65Gb29xw8Pmi85nC9oKUpXLOlp'
+    b'2lCu6BlmrFobZ9mJD602l9ETNiYSxtSjMV8wUZS5WLLQtLVcsTCMrVqbZNmpZtSCJEiKZKgVtRFW67QcnsnBIbgCS0I22lEH6my0ueyesD2RsKce7V2oW4ok'
+    b'M7LcTL7goKjZYslJ065yxckwc9XaPMsu9KBe1IcUxMurvJ/4+apQwqQYIF5+KAaJ76/KIViVw8TLNyWW1vMQdjbyX/JStdZZ6y8Ws8IoNYfK4uvrpRth1CiH'
+    b'SuJUyn0mjNJwqFt8d7d8L4zSQi5YB4Fp9TBpDRCYdgwC04/Dqp+AwPTGd53aBHijGYhMFphMViAy2YDIMgmrZQqILNOQvEeW8+QLXopaKZZ8NL1arvgYZq1a'
+    b'W2fZDfs/J59BDng5MwuUDidMDhdQOuaA0jkPq3MBKJ2LnMn6Cfy3wiaXONQ5Tqc3M8IoN4eqH3JL5JDLfPjbIuF73rDqBQeeFbDm9cHkXQVr3jWw5luH1bcB'
+    b'1nx+vgsBkS5scqg0zmR2PgqjtnhruyLWtjnUFc5m966FUQG+V/sivdrhUHf4/v7gQRi1y6s/FFG/x3MdiXDt8x6PRTwewGFOZLmTfCFIUafFUoimw+VKiGEi'
+    b'1VqUZWOHvLu4iLsjDlX/F0hcCqOO35XByRuKgtCIk1OoSjAEUzAMVQlGoCqhKKyhGFQlFOcPlxQ5XIIPKCUSUPJdolN8AGciAZzxFT4XqfA5rz4toj79Ll1/'
+    b'ARYZXWU='),
+    match_kinds=('B',
+    b'eNoFwTcCgjAAQFEpIXSSLzBaR0d1cJAy2sA+WsD7n8H3NoZvCiuwhwJHyYEbeaGfBnHoRiLOEkclWmClZmbnxogxE6bMmLNQS7nK196WgpKKWu7Yc+DIiYaW'
+    b'Mxeu+sadB0/94s2HLx09P/44tQ4i'))
+
+  state_tags:StateTags = {}
+
+  linear_munch = True
+
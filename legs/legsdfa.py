@@ -0,0 +1,64 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+The `.legsdfa` binary artifact: the flat transition table for all modes, in a form that can be mapped into memory and used as is.
+
+All integers are little-endian. The layout is:
+* header (`legs_base.legsdfa_header`): magic, format version, table entry size (2 or 4), class count,
+  then the offset of the byte class translation table, the offset and entry count of the transition table,
+  and the offset and length of the metadata;
+* byte classes: 256 bytes, at offset 64;
+* transition table: as described by `legs.tables.FlatTable`, aligned to 8 bytes;
+* metadata: UTF-8 JSON object with `kinds`, `final_kind`, `loop_classes`, `mode_starts`, `mode_transitions`,
+  `keywords` (with the encoded text keys decoded as Latin-1, so that any encoding round-trips), `pattern_descs`, `encoding`,
+  `state_tags`, and `license`.
+
+Only the small metadata object requires parsing; see `legs_base.load_legsdfa`.
+'''
+
+import json
+from argparse import Namespace
+from array import array
+from sys import byteorder as sys_byteorder
+from typing import Dict, List
+
+from legs_base import legsdfa_header, legsdfa_magic, legsdfa_version
+
+from .defs import Keywords, ModeTransitions
+from .dfa import DFA
+from .tables import gen_flat_table
+
+
+def output_legsdfa(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
+
+  with open(path, 'wb') as f:
+    f.write(gen_legsdfa(dfas=dfas, mode_transitions=mode_transitions, keywords=keywords, pattern_descs=pattern_descs,
+      license=license, encoding=args.encoding))
+
+
+def gen_legsdfa(dfas:List[DFA], mode_transitions:ModeTransitions, keywords:Keywords, pattern_descs:Dict[str, str],
+ license:str, encoding:str='utf-8') -> bytes:
+  flat = gen_flat_table(dfas)
+  table_array = array(flat.typecode, flat.table)
+  if sys_byteorder == 'big': table_array.byteswap()
+  table = table_array.tobytes()
+  meta = json.dumps(dict(
+    kinds=flat.kinds,
+    final_kind=flat.final_kind,
+    loop_classes={ offset : list(classes) for offset, classes in flat.loop_classes.items() },
+    mode_starts=flat.mode_starts,
+    mode_transitions=mode_transitions,
+    keywords={ general : { text.decode('latin1') : kind for text, kind in texts.items() } for general, texts in keywords.items() },
+    pattern_descs=pattern_descs,
+    encoding=encoding,
+    state_tags=flat.state_tags,
+    license=license,
+  ), sort_keys=True).encode('utf8')
+
+  classes_offset = 64
+  table_offset = classes_offset + len(flat.byte_classes) # 320; aligned to 8.
+  meta_offset = table_offset + len(table)
+  header = legsdfa_header.pack(legsdfa_magic, legsdfa_version, table_array.itemsize, flat.class_count,
+    classes_offset, table_offset, len(flat.table), meta_offset, len(meta))
+  return b''.join([header, bytes(classes_offset - len(header)), flat.byte_classes, table, meta])
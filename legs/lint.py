@@ -0,0 +1,106 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+Static performance analysis of minimized DFAs.
+
+Generated lexers perform maximal munch: after reaching an accepting node they keep scanning,
+hoping to find a longer match; when the DFA dies they rewind to the last accepting position.
+The bytes scanned after the last accept are then scanned again as part of the following tokens.
+The length of such a rescan is bounded by the longest path through non-matching (post-match) nodes
+that begins at a matching node. If that region contains a cycle, the rescan is unbounded,
+and crafted inputs can force quadratic lexing time.
+'''
+
+from typing import Dict, List, Set, Tuple
+
+from pithy.io import *
+from pithy.string import pluralize
+
+from .dfa import DFA
+
+
+Unbounded = -1 # Sentinel distance for rescans through a cycle.
+
+
+def rescan_depths(dfa:DFA) -> Dict[int,int]:
+  '''
+  For each non-matching node, return the longest number of bytes that can be scanned
+  from that node (inclusive) while passing only through non-matching nodes, or `Unbounded`.
+  '''
+  match_nodes = dfa.match_nodes
+  succs = { node : [dst for dst in set(d.values()) if dst not in match_nodes]
+    for node, d in dfa.transitions.items() if node not in match_nodes }
+  depths:Dict[int,int] = {}
+  # Iterative depth-first search; nodes on the current path that are revisited indicate a cycle.
+  for root in succs:
+    if root in depths: continue
+    stack:List[Tuple[int,int]] = [(root, 0)]
+    on_path:Set[int] = {root}
+    while stack:
+      node, i = stack[-1]
+      node_succs = succs[node]
+      if i < len(node_succs):
+        stack[-1] = (node, i + 1)
+        dst = node_succs[i]
+        if dst in on_path: depths[dst] = Unbounded # Cycle; the rest of the cycle is marked as the stack unwinds.
+        elif dst not in depths:
+          stack.append((dst, 0))
+          on_path.add(dst)
+        continue
+      stack.pop()
+      on_path.remove(node)
+      if depths.get(node) == Unbounded: continue
+      sub_depths = [depths[dst] for dst in node_succs]
+      depths[node] = Unbounded if Unbounded in sub_depths else 1 + max(sub_depths, default=0)
+  return depths
+
+
+def lint_perf(dfas:List[DFA]) -> int:
+  '''
+  Print the worst-case rescan distance for each mode,
+  along with the pairs of patterns responsible: the pattern that was matched, and the pattern that was being attempted.
+  Returns the number of modes with unbounded rescans.
+  '''
+  unbounded_modes = 0
+  for dfa in dfas:
+    depths = rescan_depths(dfa)
+    match_nodes = dfa.match_nodes
+    pair_distances:Dict[Tuple[str,str],int] = {}
+    for node in sorted(match_nodes):
+      kind = dfa.match_kind(node)
+      assert kind is not None
+      for dst in set(dfa.transitions[node].values()):
+        if dst in match_nodes: continue
+        distance = depths[dst]
+        continuing = dfa.node_patterns.get(dst, frozenset()) - {kind}
+        for other in sorted(continuing) or ['?']:
+          pair = (kind, other)
+          prev = pair_distances.get(pair, 0)
+          if prev != Unbounded and (distance == Unbounded or distance > prev):
+            pair_distances[pair] = distance
+    distances = set(pair_distances.values())
+    if Unbounded in distances:
+      unbounded_modes += 1
+      worst = 'unbounded (quadratic worst case)'
+    else:
+      worst = pluralize(max(distances, default=0), 'byte')
+    outL(f'`{dfa.name}`: worst-case rescan distance: {worst}.')
+    for (kind, other), distance in sorted(pair_distances.items(), key=lambda p: (p[1] != Unbounded, -p[1], p[0])):
+      if distance == Unbounded:
+        outL(f'  warning: after matching `{kind}`, attempting `{other}` can rescan an unbounded number of bytes.')
+      else:
+        outL(f'  after matching `{kind}`, attempting `{other}` can rescan {pluralize(distance, "byte")}.')
+  return unbounded_modes
+
+
+munch_choices = ('auto', 'backtrack', 'linear')
+
+def use_linear_munch(munch:str, dfas:List[DFA]) -> bool:
+  '''
+  Resolve the `-munch` option for the generated lexer.
+  `linear` selects Reps' tabulating maximal munch, which memoizes failed (state, position) pairs
+  so that no byte is rescanned from the same state twice; `backtrack` selects plain maximal munch.
+  `auto` selects linear munch if any mode has post-match nodes, i.e. if rescans are possible at all.
+  '''
+  if munch == 'auto': return any(dfa.post_match_nodes for dfa in dfas)
+  return munch == 'linear'
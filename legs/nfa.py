@@ -10,13 +10,13 @@ that represents a nondeterministic jump between NFA nodes.
 
 from collections import defaultdict
 from itertools import count
-from typing import DefaultDict, Dict, FrozenSet, Iterable, List, Set
+from typing import DefaultDict, Dict, FrozenSet, Iterable, List, Optional, Set
 
 from pithy.io import errL, errSL
 from pithy.iterable import filtermap_with_mapping, int_tuple_ranges
 from pithy.string import prepend_to_nonempty
 
-from .dfa import DFA
+from .dfa import DFA, Tag
 from .unicode.codepoints import codes_desc
 
 
@@ -31,12 +31,15 @@ empty_symbol = -1 # not a legitimate byte value.
 class NFA:
   'Nondeterministic Finite Automaton.'
 
-  def __init__(self, name:str, transitions:NfaTransitions, match_node_kinds:Dict[int, str], lit_patterns:Set[str]) -> None:
+  def __init__(self, name:str, transitions:NfaTransitions, match_node_kinds:Dict[int, str], lit_patterns:Set[str],
+   node_patterns:Optional[Dict[int,str]]=None, tag_nodes:Optional[Dict[int,Tag]]=None) -> None:
     assert name
     self.name = name
     self.transitions = transitions
     self.match_node_kinds = match_node_kinds
     self.lit_patterns = lit_patterns
+    self.node_patterns = node_patterns or {} # Provenance: the pattern that generated each node; omits the start node.
+    self.tag_nodes = tag_nodes or {} # Nodes whose sole empty transition crosses a tag; see `Seq.gen_tagged_nfa`.
 
 
   @property
@@ -131,6 +134,18 @@ class NFA:
     s.update(*self.transitions[node].values())
     return FrozenSet(s)
 
+  def reachable_nodes(self, node:int) -> FrozenSet[int]:
+    'Return the nodes reachable from `node` by one or more transitions.'
+    nodes:Set[int] = set()
+    remaining = [node]
+    while remaining:
+      src = remaining.pop()
+      for dsts in self.transitions.get(src, {}).values():
+        for dst in dsts - nodes:
+          nodes.add(dst)
+          remaining.append(dst)
+    return frozenset(nodes)
+
   def validate(self) -> List[str]:
     start = self.advance_empties({0})
     msgs = []
@@ -172,7 +187,7 @@ class NFA:
 
 
 
-def gen_dfa(nfa:NFA) -> DFA:
+def gen_dfa(nfa:NFA, symbol_count:int=0x100) -> DFA:
   '''
   Generate a DFA from an NFA.
 
@@ -186,6 +201,17 @@ def gen_dfa(nfa:NFA) -> DFA:
   For each DFA node, there is a mapping from byte values to destination nodes.
   Conceputally, generating a lexer from a DFA is straightforward:
   switch on the current state, and then switch on the current byte.
+
+  The alphabet is the bytes by default; `symbol_count` sets the size of an alternative alphabet (see `legs.code_classes`),
+  all of whose symbols not matched from the start node lead to `invalid`.
+
+  Tags (see `Seq.gen_tagged_nfa`) are tracked in the manner of Laurikari's tagged DFAs, restricted to tags at the top level
+  of a pattern so that every match crosses each tag of its pattern exactly once.
+  A tag node is only ever in a DFA state if its tag was crossed by the step that entered that state,
+  so each DFA node simply records the tags of its tag nodes (`DFA.node_tags`), and a lexer that records the position
+  on entering each such node (keeping the last position at or before the token end) recovers the tag positions of the token.
+  This fails if a step crosses a tag while a thread that crossed it earlier continues;
+  which position is correct then depends on which thread eventually matches, so such tags are reported as ambiguous.
   '''
 
   indexer = iter(count())
@@ -197,6 +223,10 @@ def gen_dfa(nfa:NFA) -> DFA:
   start_node = nfa_states_to_dfa_nodes[start]
   invalid_node = nfa_states_to_dfa_nodes[invalid]
 
+  tag_nodes = nfa.tag_nodes
+  post_tag_nodes = { node : nfa.reachable_nodes(node) for node in tag_nodes } # The nodes of threads that crossed each tag.
+  ambiguous_tags:Set[Tag] = set()
+
   transitions:DefaultDict[int,Dict[int,int]] = defaultdict(dict)
   alphabet = nfa.alphabet
   remaining = {start}
@@ -207,18 +237,26 @@ def gen_dfa(nfa:NFA) -> DFA:
     for char in alphabet:
       dst_state = frozenset(nfa.advance(state, char))
       if not dst_state: continue # do not add empty sets.
+      for tag_node in dst_state.intersection(tag_nodes):
+        # Threads that crossed the tag earlier can only continue by transitions among the post-tag nodes.
+        if any(char in nfa.transitions.get(n, {}) for n in state & post_tag_nodes[tag_node]):
+          ambiguous_tags.add(tag_nodes[tag_node])
       dst_node = nfa_states_to_dfa_nodes[dst_state]
       d[char] = dst_node
       if dst_node not in transitions:
         remaining.add(dst_state)
 
+  if ambiguous_tags:
+    exit('\n'.join(f'error: `{nfa.name}`: tag is ambiguous: {kind} @{tag}; '
+      'it can be crossed again while an earlier crossing is still matching.' for kind, tag in sorted(ambiguous_tags)))
+
   # explicitly add transitions to and from `invalid`, which is otherwise not reachable.
   # `start` transitions to `invalid` for all bytes not yet covered.
   # `invalid` transitions to itself for those same bytes.
   assert invalid_node not in transitions
   start_dict = transitions[start_node]
   invalid_dict = transitions[invalid_node]
-  invalid_start_chars = set(range(0x100)) - set(start_dict)
+  invalid_start_chars = set(range(symbol_count)) - set(start_dict)
   for c in invalid_start_chars:
     start_dict[c] = invalid_node
     invalid_dict[c] = invalid_node
@@ -232,6 +270,15 @@ def gen_dfa(nfa:NFA) -> DFA:
       node_kinds[dfa_node].add(kind)
   match_node_kind_sets = { node : frozenset(kinds) for node, kinds in node_kinds.items() }
 
-  return DFA(name=nfa.name, transitions=dict(transitions), match_node_kind_sets=match_node_kind_sets, lit_patterns=nfa.lit_patterns)
+  # Provenance: each DFA node derives from the patterns of its constituent NFA nodes.
+  # The start node is shared by all patterns, so it is attributed to none of them.
+  node_patterns = { dfa_node : frozenset(filtermap_with_mapping(nfa_state, nfa.node_patterns))
+    for nfa_state, dfa_node in nfa_states_to_dfa_nodes.items() if dfa_node != start_node }
+
+  node_tags = { dfa_node : frozenset(tag_nodes[n] for n in nfa_state if n in tag_nodes)
+    for nfa_state, dfa_node in nfa_states_to_dfa_nodes.items() if not nfa_state.isdisjoint(tag_nodes) }
+
+  return DFA(name=nfa.name, transitions=dict(transitions), match_node_kind_sets=match_node_kind_sets, lit_patterns=nfa.lit_patterns,
+    node_patterns=node_patterns, node_tags=node_tags)
 
 
@@ -1,46 +1,59 @@
 # Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
 
-import re
-from typing import Container, Dict, FrozenSet, List, Match, NoReturn, Set, Tuple, Type
+from typing import Container, Dict, FrozenSet, Iterator, List, Match, NamedTuple, NoReturn, Optional, Set, Tuple, Type
 
+from legs_base import Source
 from pithy.buffer import Buffer
+from pithy.fs import path_dir, path_join
 from pithy.io import *
 from pithy.iterable import OnHeadless, fan_by_key_fn, group_by_heads
-from pithy.lex import Lexer
-from pithy.token import Token
 
 from .defs import ModeTransitions
+from .imports import compile_grammar
+from .legs_lexer import LegsLexer
 from .patterns import *
-from .unicode import CodeRange, CodeRanges, codes_for_ranges, ranges_for_codes
+from .unicode import CodeRange, CodeRanges, IntervalSet
 from .unicode.charsets import unicode_charsets
 
 
+class Token(NamedTuple):
+  '''
+  A grammar token, as lexed by the legs lexer generated from grammars/legs.legs.
+  `pos` and `end` are byte offsets into the UTF-8 encoded source text.
+  '''
+  kind:str
+  pos:int
+  end:int
+  line_idx:int
+  line_pos:int
+  source:Source
+
+  @property
+  def text(self) -> str: return self.source.text[self.pos:self.end].decode('utf8')
+
+  def fail(self, path:str, msg:str) -> NoReturn:
+    text = self.source.text
+    line_end = text.find(b'\n', self.line_pos)
+    if line_end == -1: line_end = len(text)
+    line = text[self.line_pos:line_end].decode('utf8', errors='replace')
+    prefix = text[self.line_pos:self.pos].decode('utf8', errors='replace')
+    indent = ''.join('\t' if c == '\t' else ' ' for c in prefix)
+    underline = '~' * max(1, len(text[self.pos:self.end].decode('utf8', errors='replace')))
+    exit(f'{path}:{self.line_idx+1}:{len(prefix)+1}: {msg}\n| {line}\n  {indent}{underline}')
+
+
+def lex_legs(path:str, src:str) -> Iterator[Token]:
+  'Lex the legs source given in `src`, dropping spaces.'
+  source = Source(name=path, text=src.encode('utf8'))
+  line_idx = 0
+  line_pos = 0
+  for kind, pos, end in LegsLexer(source=source):
+    if kind == 'space': continue
+    yield Token(kind=kind, pos=pos, end=end, line_idx=line_idx, line_pos=line_pos, source=source)
+    if kind == 'newline':
+      line_idx += 1
+      line_pos = end
 
-lexer = Lexer(flags='x', invalid='invalid', patterns=dict(
-  newline = r'\n',
-  space   = r'\ +',
-  section = r'\#\ *([Pp]atterns|[Mm]odes|[Tt]ransitions)[^\n]*',
-  section_invalid = r'\#[^\n]*',
-  comment = r'//[^\n]*',
-  sym     = r'\w+',
-  colon   = r':',
-  brckt_o = r'\[',
-  brckt_c = r'\]',
-  #brace_o = r'\{',
-  #brace_c = r'\}',
-  paren_o = r'\(',
-  paren_c = r'\)',
-  bar     = r'\|',
-  qmark   = r'\?',
-  star    = r'\*',
-  plus    = r'\+',
-  amp     = '&',
-  dash    = '-',
-  caret   = r'\^',
-  ref     = r'\$\w*',
-  esc     = r'\\[^\n]', # TODO: list escapable characters.
-  char    = r'[^\\\n]',
-))
 
 kind_descs = {
   'section_invalid' : 'invalid section',
@@ -51,16 +64,20 @@ kind_descs = {
 def desc_kind(kind:str) -> str: return kind_descs.get(kind, kind)
 
 
-def parse_legs(path:str, src:str) -> Tuple[str,Dict[str,LegsPattern],Dict[str,FrozenSet[str]],ModeTransitions]:
+def parse_legs(path:str, src:str, import_stack:Tuple[str,...]=(), imports:Optional[Dict[str,str]]=None) \
+ -> Tuple[str,Dict[str,LegsPattern],Dict[str,FrozenSet[str]],ModeTransitions,Dict[str,int]]:
   '''
   Parse the legs source given in `src`, returning:
   * the license string;
   * a dictionary of pattern names to LegsPattern objects;
   * a dictionary of mode names to pattern names;
-  * a dictionary of mode transitions.
+  * a dictionary of mode transitions;
+  * a dictionary of pattern names to the (one-based) source lines on which they are defined or imported.
+  `import_stack` contains the paths of the grammars that are importing this one.
+  If `imports` is given, the path and digest of each imported grammar are added to it.
   '''
 
-  tokens_with_comments = list(lexer.lex(src, drop={'space'}))
+  tokens_with_comments = list(lex_legs(path, src))
   # If first token is a comment, assume it is the license.
   license:str
   if tokens_with_comments and tokens_with_comments[0].kind == 'comment':
@@ -72,6 +89,7 @@ def parse_legs(path:str, src:str) -> Tuple[str,Dict[str,LegsPattern],Dict[str,Fr
   sections = list(group_by_heads(tokens, is_head=is_section, headless=OnHeadless.keep))
 
   patterns:Dict[str, LegsPattern] = {} # keyed by pattern name.
+  pattern_lines:Dict[str,int] = {} # keyed by pattern name.
   mode_pattern_kinds:Dict[str,FrozenSet[str]] = {} # keyed by mode name.
   mode_transitions:ModeTransitions = {}
 
@@ -82,7 +100,9 @@ def parse_legs(path:str, src:str) -> Tuple[str,Dict[str,LegsPattern],Dict[str,Fr
     else:
       section_name = ''
     if not section_name or section_name.startswith('patterns'):
-      parse_patterns(path, buffer, patterns)
+      parse_patterns(path, buffer, patterns, pattern_lines)
+    elif section_name.startswith('imports'):
+      parse_imports(path, buffer, patterns, pattern_lines, import_stack, imports)
     elif section_name.startswith('modes'):
       parse_modes(path, buffer, patterns.keys(), mode_pattern_kinds)
     elif section_name.startswith('transitions'):
@@ -92,10 +112,10 @@ def parse_legs(path:str, src:str) -> Tuple[str,Dict[str,LegsPattern],Dict[str,Fr
 
   if not mode_pattern_kinds:
     mode_pattern_kinds['main'] = frozenset(patterns)
-  return (license, patterns, mode_pattern_kinds, mode_transitions)
+  return (license, patterns, mode_pattern_kinds, mode_transitions, pattern_lines)
 
 
-def parse_patterns(path:str, buffer:Buffer[Token], patterns:Dict[str, LegsPattern]) -> None:
+def parse_patterns(path:str, buffer:Buffer[Token], patterns:Dict[str, LegsPattern], pattern_lines:Dict[str,int]) -> None:
   for token in buffer:
     kind = token.kind
     if kind == 'newline': continue
@@ -103,9 +123,47 @@ def parse_patterns(path:str, buffer:Buffer[Token], patterns:Dict[str, LegsPatter
     name = token.text
     if name in patterns:
       token.fail(path, f'duplicate pattern name: {name!r}.')
+    pattern_lines[name] = token.line_idx + 1
     patterns[name] = parse_pattern(path, token, buffer)
 
 
+def parse_imports(path:str, buffer:Buffer[Token], patterns:Dict[str, LegsPattern], pattern_lines:Dict[str,int],
+ import_stack:Tuple[str,...], imports:Optional[Dict[str,str]]) -> None:
+  for token in buffer:
+    kind = token.kind
+    if kind == 'newline': continue
+    check_is_sym(path, token, 'grammar name')
+    import_path = path_join(path_dir(path), token.text + '.legs')
+    if import_path == path or import_path in import_stack:
+      token.fail(path, f'circular import: {import_path!r}.')
+    try: grammar = compile_grammar(import_path, import_stack=(*import_stack, path))
+    except FileNotFoundError: token.fail(path, f'no such grammar: {import_path!r}.')
+    if imports is not None: imports[import_path] = grammar.digest
+    names:List[str] = []
+    for name_token in parse_import_names(path, buffer):
+      if name_token.text not in grammar.patterns: name_token.fail(path, f'unknown pattern name: {name_token.text!r}.')
+      names.append(name_token.text)
+    for name in (names or grammar.patterns):
+      if name in patterns: token.fail(path, f'duplicate pattern name: {name!r}.')
+      pattern_lines[name] = token.line_idx + 1
+      patterns[name] = grammar.patterns[name]
+
+
+def parse_import_names(path:str, buffer:Buffer[Token]) -> List[Token]:
+  'Parse the optional `: name...` list following an imported grammar name; an empty list means import all.'
+  names:List[Token] = []
+  for token in buffer:
+    kind = token.kind
+    if kind == 'newline': break
+    if not names and kind == 'colon':
+      names.append(token)
+      continue
+    if not names: token.fail(path, f'import expected colon or newline; found {desc_kind(kind)}.')
+    check_is_sym(path, token, 'pattern name')
+    names.append(token)
+  return names[1:]
+
+
 def parse_modes(path:str, buffer:Buffer[Token], patterns:Container[str], mode_pattern_kinds:Dict[str,FrozenSet[str]]) -> None:
   for token in buffer:
     kind = token.kind
@@ -169,26 +227,40 @@ def parse_pattern(path:str, sym_token:Token, buffer:Buffer[Token]) -> LegsPatter
   else:
     if next_token.kind != 'newline': # named pattern.
       consume(path, buffer, kind='colon', subj='pattern')
-      return parse_pattern_pattern(path, buffer, terminator='newline')
+      return parse_pattern_pattern(path, buffer, terminator='newline', top=True)
   # literal symbol pattern.
   text = sym_token.text
   return Seq.from_list([Charset.for_char(c) for c in text])
 
 
-def parse_pattern_pattern(path:str, buffer:Buffer[Token], terminator:str) -> LegsPattern:
-  'Parse a pattern and return a LegsPattern object.'
+def parse_pattern_pattern(path:str, buffer:Buffer[Token], terminator:str, top:bool=False) -> LegsPattern:
+  '''
+  Parse a pattern and return a LegsPattern object.
+  `@name` tags are only allowed if `top` is true, and then only in a sequence; see `Seq`.
+  '''
   els:List[LegsPattern] = []
-  def finish() -> LegsPattern: return Seq.from_list(els)
+  tags:List[Tuple[int,Token]] = []
+  def finish() -> LegsPattern:
+    if not tags: return Seq.from_list(els)
+    for i, tag_token in tags:
+      if i == 0 or i == len(els): tag_token.fail(path, 'tag must be preceded and followed by a pattern.')
+    return Seq(els, tags=[(i, tag_token.text[1:]) for i, tag_token in tags])
   for token in buffer:
     kind = token.kind
     def _fail(msg) -> 'NoReturn': token.fail(path, msg)
     def quantity(pattern_type:Type[QuantityPattern]) -> None:
-      if not els: _fail('quantity operator must be preceded by a pattern.')
+      if not els or (tags and tags[-1][0] == len(els)): _fail('quantity operator must be preceded by a pattern.')
       els[-1] = pattern_type(els[-1])
     if kind == terminator: return finish()
     elif kind == 'paren_o': els.append(parse_pattern_pattern(path, buffer, terminator='paren_c'))
-    elif kind == 'brckt_o': els.append(Charset(ranges=tuple(ranges_for_codes(sorted(parse_charset(path, buffer, token))))))
-    elif kind == 'bar': return parse_choice(path, buffer, left=finish(), terminator=terminator)
+    elif kind == 'brckt_o': els.append(Charset(ranges=parse_charset(path, buffer, token).ranges))
+    elif kind == 'bar':
+      if tags: tags[0][1].fail(path, 'tags are not allowed in a pattern with choices at the top level.')
+      return parse_choice(path, buffer, left=finish(), terminator=terminator)
+    elif kind == 'tag':
+      if not top: _fail('tags are only allowed at the top level of a pattern.')
+      if any(t.text == token.text for _, t in tags): _fail(f'duplicate tag name: {token.text[1:]!r}.')
+      tags.append((len(els), token))
     elif kind == 'qmark': quantity(Opt)
     elif kind == 'star': quantity(Star)
     elif kind == 'plus': quantity(Plus)
@@ -197,7 +269,7 @@ def parse_pattern_pattern(path:str, buffer:Buffer[Token], terminator:str) -> Leg
     elif kind == 'sym': els.extend(Charset.for_char(c) for c in token.text)
     elif kind in ('colon', 'amp', 'dash', 'caret', 'char'):
       els.append(Charset.for_char(token.text))
-    elif kind == 'invalid': _fail('invalid pattern token.')
+    elif kind in ('invalid', 'incomplete'): _fail('invalid pattern token.')
     else: _fail(f'unexpected pattern token: {desc_kind(kind)}.')
   return finish()
 
@@ -221,7 +293,7 @@ def parse_ref(path:str, token:Token) -> CodeRanges:
   except KeyError: token.fail(path, 'unknown charset name.')
 
 
-def parse_charset(path:str, buffer:Buffer[Token], start_token:Token, is_right=False, is_diff=False) -> Set[int]:
+def parse_charset(path:str, buffer:Buffer[Token], start_token:Token, is_right=False, is_diff=False) -> IntervalSet:
   '''
   The Legs character set syntax is different from traditional regular expressions.
   * `[...]` introduces a nested character set.
@@ -233,22 +305,27 @@ def parse_charset(path:str, buffer:Buffer[Token], start_token:Token, is_right=Fa
   it must be the only operator to appear within the character set;
   more complex expressions must be explicitly grouped.
   Thus, the set expression syntax has no operator precedence or associativity.
+  Sets are represented as ranges throughout, so large classes like `$Letter` never expand to individual code points.
   '''
-  codes:Set[int] = set()
+  codes = IntervalSet()
+
+  def add_codes(token:Token, other:IntervalSet) -> None:
+    nonlocal codes
+    repeated = codes & other
+    if repeated:
+      token.fail(path, f'repeated character in set: {repeated.ranges[0][0]!r}.')
+    codes = codes | other
 
-  def add_code(token:Token, code:int) -> None:
-    if code in codes:
-      token.fail(path, f'repeated character in set: {code!r}.')
-    codes.add(code)
+  def add_code(token:Token, code:int) -> None: add_codes(token, IntervalSet.for_code(code))
 
-  def parse_right(token:Token, is_diff_op:bool) -> Set[int]:
+  def parse_right(token:Token, is_diff_op:bool) -> IntervalSet:
     if not codes:
       token.fail(path, f'empty charset preceding operator.')
     if is_diff or (is_right and is_diff_op):
       token.fail(path, f'compound set expressions containing `-` or `^` operators must be grouped with `[...]`.')
     return parse_charset(path, buffer, token, is_right=True, is_diff=is_diff_op)
 
-  def finish() -> Set[int]:
+  def finish() -> IntervalSet:
       if not codes: start_token.fail(path, 'empty character set.')
       return codes
 
@@ -257,28 +334,26 @@ def parse_charset(path:str, buffer:Buffer[Token], start_token:Token, is_right=Fa
     if kind == 'brckt_c':
       return finish()
     if kind == 'brckt_o':
-      for code in parse_charset(path, buffer, token):
-        add_code(token, code)
+      add_codes(token, parse_charset(path, buffer, token))
     elif kind == 'ref':
-      for code in codes_for_ranges(parse_ref(path, token)):
-        add_code(token, code)
+      add_codes(token, IntervalSet(parse_ref(path, token)))
     elif kind == 'amp':
-      codes.intersection_update(parse_right(token, is_diff_op=False))
+      codes = codes & parse_right(token, is_diff_op=False)
       return finish()
     elif kind == 'dash':
-      codes.difference_update(parse_right(token, is_diff_op=True))
+      codes = codes - parse_right(token, is_diff_op=True)
       return finish()
     elif kind == 'caret':
-      codes.symmetric_difference_update(parse_right(token, is_diff_op=True))
+      codes = codes ^ parse_right(token, is_diff_op=True)
       return finish()
     elif kind == 'esc':
       add_code(token, parse_esc(path, token))
-    elif kind == 'sym':
+    elif kind in ('sym', 'tag'):
       for char in token.text:
         add_code(token, ord(char))
     elif kind in ('char', 'colon', 'bar', 'qmark', 'star', 'plus', 'paren_o', 'paren_c'):
       add_code(token, ord(token.text))
-    elif kind == 'invalid': token.fail(path, 'invalid pattern token.')
+    elif kind in ('invalid', 'incomplete'): token.fail(path, 'invalid pattern token.')
     else: token.fail(path, f'unexpected charset token: {desc_kind(kind)}.')
   start_token.fail(path, 'unterminated charset.')
 
@@ -308,7 +383,7 @@ escape_codes:Dict[str, int] = {
   's': ord(' '), # nonstandard space escape.
   't': ord('\t'),
 }
-escape_codes.update((c, ord(c)) for c in '\\#|$?*+()[]&-^:/')
+escape_codes.update((c, ord(c)) for c in '\\#|$?*+()[]&-^:/@')
 
 if False:
   for k, v in sorted(escape_codes.items()):
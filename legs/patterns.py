@@ -1,25 +1,30 @@
 # Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
 
+from collections import defaultdict
+from itertools import count
 from typing import Any, Callable, DefaultDict, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple, cast
 
 from pithy.io import errL, errSL
 from pithy.types import is_pair_of_int
 
 from .nfa import empty_symbol
-from .unicode import CodeRange, CodeRanges, codes_for_ranges, ranges_for_codes
+from .unicode import CodeRange, CodeRanges, codes_for_ranges, ranges_for_codes, utf8_byte_range_seqs
 from .unicode.codepoints import codes_desc
 
 
 __all__ = [
   'Charset',
   'Choice',
+  'ImportedPattern',
   'LegsPattern',
+  'NfaFragment',
   'NfaMutableTransitions',
   'Opt',
   'Plus',
   'QuantityPattern',
   'Seq',
   'Star',
+  'gen_nfa_fragment',
   'regex_for_codes',
 ]
 
@@ -28,6 +33,9 @@ MkNode = Callable[[], int]
 
 NfaMutableTransitions = DefaultDict[int, DefaultDict[int, Set[int]]]
 
+NfaFragment = Tuple[int, Dict[int, Dict[int, Tuple[int, ...]]]]
+#^ Node count and transitions of a standalone pattern NFA, in which node 0 is the start and node 1 is the end.
+
 
 class LegsPattern:
 
@@ -49,9 +57,20 @@ class LegsPattern:
     s = p.replace('\\', '\\\\').replace('`', '\\`')
     return f'`{s}`'
 
+  @property
+  def tag_names(self) -> Tuple[str,...]: return ()
+
   def gen_nfa(self, mk_node:MkNode, transitions:NfaMutableTransitions, start:int, end:int) -> None:
     raise NotImplementedError
 
+  def gen_tagged_nfa(self, mk_node:MkNode, transitions:NfaMutableTransitions, start:int, end:int) -> Dict[int,str]:
+    '''
+    Generate the NFA as for `gen_nfa`, and return the tag nodes: for each `@name` tag of the pattern,
+    the node whose sole (empty) transition crosses the tag. See `legs.nfa.gen_dfa`.
+    '''
+    self.gen_nfa(mk_node, transitions, start, end)
+    return {}
+
   def gen_regex(self, flavor:str) -> str: raise NotImplementedError
 
   def gen_regex_sub(self, flavor:str, precedence:int) -> str:
@@ -113,23 +132,55 @@ class Choice(StructPattern):
 
 
 class Seq(StructPattern):
+  '''
+  A sequence of patterns.
+  A top-level sequence can also have tags: `tags` holds (index, name) for each `@name` tag,
+  which marks the position between `els[index-1]` and `els[index]`.
+  '''
 
   precedence = 2
 
-  def __init__(self, els:Iterable[LegsPattern]) -> None:
+  def __init__(self, els:Iterable[LegsPattern], tags:Iterable[Tuple[int,str]]=()) -> None:
     self.els = tuple(els)
+    self.tags = tuple(tags)
     if len(self.els) < 2: raise ValueError(els)
 
   def __iter__(self) -> Iterator[LegsPattern]:
     return iter(self.els)
 
+  def describe(self, name:Optional[str], depth=0) -> None:
+    n = name + ' ' if name else ''
+    errL('  ' * depth, n, type(self).__name__, ':')
+    for i, sub in enumerate(self.els):
+      for _, tag in filter(lambda p: p[0] == i, self.tags):
+        errL('  ' * (depth+1), '@', tag)
+      sub.describe(name=None, depth=depth+1)
+
+  @property
+  def tag_names(self) -> Tuple[str,...]: return tuple(name for _, name in self.tags)
+
   def gen_nfa(self, mk_node:MkNode, transitions:NfaMutableTransitions, start:int, end:int) -> None:
-    if not self:
-      transitions[start][empty_symbol].add(end)
-      return
-    intermediates = [mk_node() for i in range(1, len(self.els))]
-    for sub, src, dst in zip(self.els, [start] + intermediates, intermediates + [end]):
+    self.gen_tagged_nfa(mk_node, transitions, start, end)
+
+  def gen_tagged_nfa(self, mk_node:MkNode, transitions:NfaMutableTransitions, start:int, end:int) -> Dict[int,str]:
+    # Each tag splits its boundary node in two, joined by an empty transition that crosses the tag.
+    # Patterns never add transitions out of their end node, so that transition is the only way out of the tag node.
+    tag_nodes:Dict[int,str] = {}
+    srcs = [start]
+    dsts:List[int] = []
+    for i in range(1, len(self.els)):
+      node = mk_node()
+      dsts.append(node)
+      for _, tag in filter(lambda p: p[0] == i, self.tags):
+        tag_nodes[node] = tag
+        dst = mk_node()
+        transitions[node][empty_symbol].add(dst)
+        node = dst
+      srcs.append(node)
+    dsts.append(end)
+    for sub, src, dst in zip(self.els, srcs, dsts):
       sub.gen_nfa(mk_node, transitions, src, dst)
+    return tag_nodes
 
   def gen_regex(self, flavor:str) -> str:
     sub_patterns = [sub.gen_regex_sub(flavor=flavor, precedence=self.precedence) for sub in self]
@@ -150,7 +201,7 @@ class Seq(StructPattern):
     return Choice.from_opts(reversed(incs))
 
   @property
-  def is_literal(self): return all(sub.is_literal for sub in self)
+  def is_literal(self): return not self.tags and all(sub.is_literal for sub in self)
 
   @property
   def literal_pattern(self): return ''.join(sub.literal_pattern for sub in self)
@@ -240,28 +291,31 @@ class Charset(LegsPattern):
 
 
   def gen_nfa(self, mk_node:MkNode, transitions:NfaMutableTransitions, start:int, end:int) -> None:
-    node_byte_nodes = DefaultDict[int,Dict[int,int]](dict)
-    for code in codes_for_ranges(self.ranges):
+    # Encode by byte ranges rather than by individual code points, so that large classes remain cheap.
+    node_range_nodes = DefaultDict[int,Dict[Tuple[int,int],int]](dict)
+    for byte_ranges in utf8_byte_range_seqs(self.ranges):
       node = start
-      enc_bytes = chr(code).encode()
-      for i, byte in enumerate(enc_bytes, 1-len(enc_bytes)):
+      for i, (low, high) in enumerate(byte_ranges, 1-len(byte_ranges)):
         if i: # Not the final byte.
-          byte_nodes = node_byte_nodes[node]
-          try: n = byte_nodes[byte]
+          range_nodes = node_range_nodes[node]
+          try: n = range_nodes[(low, high)]
           except KeyError:
             n = mk_node()
-            byte_nodes[byte] = n
-            transitions[node][byte].add(n)
+            range_nodes[(low, high)] = n
+            for byte in range(low, high+1):
+              transitions[node][byte].add(n)
           node = n
         else: # Final byte.
-          transitions[node][byte].add(end)
+          for byte in range(low, high+1):
+            transitions[node][byte].add(end)
 
 
   def gen_regex(self, flavor:str) -> str:
     ranges = self.ranges
-    if flavor.endswith('.bytes') and any(r[1] >= 0x80 for r in ranges):
-      # Some code points exceed ASCII range; need to encode char-by-char.
-      s = '|'.join(''.join(regex_for_code(byte, flavor) for byte in chr(code).encode()) for r in ranges for code in r)
+    if flavor.endswith('.bytes') and any(r[1] > 0x80 for r in ranges):
+      # Some code points exceed ASCII range; match their UTF-8 encodings as sequences of byte ranges, as for `gen_nfa`.
+      s = '|'.join(''.join(regex_for_code_ranges(((low, high+1),), flavor) for low, high in byte_ranges)
+        for byte_ranges in utf8_byte_range_seqs(ranges))
       return f'(?:{s})'
     return regex_for_code_ranges(ranges, flavor)
 
@@ -289,6 +343,61 @@ class Charset(LegsPattern):
     return Charset(ranges=((code, code + 1),))
 
 
+class ImportedPattern(LegsPattern):
+  '''
+  A pattern imported from another grammar.
+  Its NFA is precompiled into a fragment that is spliced into the importing automaton,
+  so that importing grammars do not regenerate it.
+  '''
+
+  def __init__(self, pattern:LegsPattern, fragment:NfaFragment) -> None:
+    self.pattern = pattern
+    self.fragment = fragment
+    self.precedence = pattern.precedence
+
+  def describe(self, name:Optional[str], depth=0) -> None: self.pattern.describe(name=name, depth=depth)
+
+  @property
+  def is_literal(self) -> bool: return self.pattern.is_literal
+
+  @property
+  def literal_pattern(self) -> str: return self.pattern.literal_pattern
+
+  @property
+  def tag_names(self) -> Tuple[str,...]: return self.pattern.tag_names
+
+  def gen_tagged_nfa(self, mk_node:MkNode, transitions:NfaMutableTransitions, start:int, end:int) -> Dict[int,str]:
+    # The fragment does not record tag nodes, so tagged patterns are regenerated.
+    if self.tag_names: return self.pattern.gen_tagged_nfa(mk_node, transitions, start, end)
+    self.gen_nfa(mk_node, transitions, start, end)
+    return {}
+
+  def gen_nfa(self, mk_node:MkNode, transitions:NfaMutableTransitions, start:int, end:int) -> None:
+    node_count, fragment_transitions = self.fragment
+    nodes = [start, end]
+    nodes.extend(mk_node() for _ in range(2, node_count))
+    for src, d in fragment_transitions.items():
+      node_transitions = transitions[nodes[src]]
+      for byte, dsts in d.items():
+        node_transitions[byte].update(nodes[dst] for dst in dsts)
+
+  def gen_regex(self, flavor:str) -> str: return self.pattern.gen_regex(flavor=flavor)
+
+  def gen_incomplete(self) -> Optional[LegsPattern]: return self.pattern.gen_incomplete()
+
+
+def gen_nfa_fragment(pattern:LegsPattern) -> NfaFragment:
+  '''
+  Generate the NFA for a single pattern as a relocatable fragment.
+  Patterns never add transitions into their start node or out of their end node,
+  so splicing the fragment between any two nodes is equivalent to generating the pattern there directly.
+  '''
+  indexer = count(2)
+  transitions:NfaMutableTransitions = defaultdict(lambda: defaultdict(set))
+  pattern.gen_nfa(lambda: next(indexer), transitions, 0, 1)
+  node_count = next(indexer)
+  return (node_count, { src : { byte : tuple(sorted(dsts)) for byte, dsts in d.items() } for src, d in transitions.items() })
+
 
 def regex_for_code(code:int, flavor:str) -> str:
   if 0x30 <= code <= 0x39 or 0x41 <= code <= 0x5A or 0x61 <= code <= 0x7A or code == 0x5F:
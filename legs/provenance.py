@@ -0,0 +1,75 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+Provenance maps relate the states of generated lexers back to the grammar patterns from which they derive.
+Each state records the set of patterns whose NFA nodes were merged into it during determinization and minimization.
+Paired with per-state visit counts gathered at runtime (see `legs_base.count_state_visits`),
+this lets us attribute lexing cost to the patterns and source lines responsible.
+'''
+
+import json
+from argparse import Namespace
+from collections import Counter, defaultdict
+from typing import Any, DefaultDict, Dict, List
+
+from pithy.io import *
+from pithy.json import write_json
+from pithy.string import pluralize
+
+from .dfa import DFA
+
+
+def gen_provenance(dfas:List[DFA], pattern_lines:Dict[str,int]) -> Dict[str,Any]:
+  'Generate a JSON-compatible provenance map.'
+  states:Dict[str,Any] = {}
+  for dfa in dfas:
+    for node in sorted(dfa.transitions):
+      states[str(node)] = {
+        'mode': dfa.name,
+        'patterns': sorted(dfa.node_patterns.get(node, ())), # Empty for start nodes.
+      }
+  return {
+    'patterns': dict(sorted(pattern_lines.items())),
+    'modes': { dfa.name : dfa.start_node for dfa in dfas },
+    'states': states,
+  }
+
+
+def output_provenance(path:str, dfas:List[DFA], pattern_lines:Dict[str,int], license:str, args:Namespace) -> None:
+  provenance = gen_provenance(dfas, pattern_lines)
+  provenance['license'] = license
+  provenance['grammar'] = args.path
+  with open(path, 'w', encoding='utf8') as f:
+    write_json(f, provenance)
+
+
+def describe_heat(path:str, dfas:List[DFA], pattern_lines:Dict[str,int]) -> None:
+  '''
+  Print a per-pattern heat report for the state visit counts in the JSON file at `path`,
+  which maps state numbers to counts as produced by `legs_base.count_state_visits`.
+  A state that derives from several patterns counts towards each of them,
+  so the pattern totals can exceed the total number of visits.
+  '''
+  try:
+    with open(path) as f: counts = json.load(f)
+  except FileNotFoundError: exit(f'legs error: no such heat counts file: {path!r}')
+  node_patterns = { node : patterns for dfa in dfas for node, patterns in dfa.node_patterns.items() }
+  start_node = dfas[0].start_node if dfas else 0
+  end_node = dfas[-1].end_node if dfas else 0
+  pattern_heat:Counter[str] = Counter()
+  pattern_states:DefaultDict[str,int] = defaultdict(int)
+  total = 0
+  for state_str, count in counts.items():
+    state = int(state_str)
+    total += count
+    if not (start_node <= state < end_node): exit(f'legs error: heat counts refer to unknown state: {state}.')
+    patterns = node_patterns.get(state) or frozenset({'<start>'})
+    for pattern in patterns:
+      pattern_heat[pattern] += count
+      pattern_states[pattern] += 1
+  outL(f'total state visits: {total}')
+  for pattern, heat in sorted(pattern_heat.items(), key=lambda p: (-p[1], p[0])):
+    line = pattern_lines.get(pattern)
+    loc = f'line {line}' if line else 'no line'
+    share = heat / total if total else 0
+    outL(f'{heat:>12} {share:>7.2%}  {pattern} ({loc}; {pluralize(pattern_states[pattern], "state")})')
@@ -1,43 +1,60 @@
 # Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
 
 import re
+from array import array
+from bisect import bisect_right
 from argparse import Namespace
+from base64 import b64encode
 from collections import defaultdict
 from pprint import pformat
-from typing import Dict, FrozenSet, List, Optional, Tuple
+from sys import byteorder as sys_byteorder
+from typing import Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+from zlib import compress as zlib_compress
 
-from legs_base import ModeTransitions
+from legs_base import HybridMode
 from pithy.fs import add_file_execute_permissions
 from pithy.io import *
 from pithy.optional import unwrap
 from pithy.string import render_template
 
-from .defs import MatchStateKinds, ModeData, ModeTransitions, StateTransitions
+from .defs import Keywords, MatchStateKinds, ModeData, ModeTransitions, StateTransitions
+from .code_classes import gen_code_table
 from .dfa import DFA
+from .hybrid import gen_hybrid_modes
+from .lazy import gen_lazy_nfa
+from .lint import use_linear_munch
+from .nfa import NFA
 from .patterns import Choice, LegsPattern, regex_for_codes
+from .tables import FlatTable, gen_ascii_table, gen_comb_table, gen_flat_table, gen_sparse_table, gen_stride_table
 
 
 def output_python(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
-  pattern_descs:Dict[str, str], license:str, args:Namespace):
-
-  mode_data:Dict[str,ModeData] = {}
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
 
   for dfa in dfas:
-    mode = dfa.name
-    match_node_kinds = { match_node : unwrap(dfa.match_kind(match_node)) for match_node in dfa.match_nodes }
     kinds = { kind : py_safe_sym(kind) for kind in dfa.pattern_kinds }
     kinds['incomplete'] = 'incomplete'
     assert len(kinds) == len(set(kinds.values()))
-    mode_data[mode] = (dfa.start_node, dfa.transitions, match_node_kinds)
+
+  mode_starts = tuple((dfa.name, dfa.start_node) for dfa in dfas) # Ordered as in the encoded arrays.
+  kind_list = sorted({ kind for dfa in dfas for kind in dfa.pattern_kinds } | {'invalid'})
+  transitions, match_kinds = gen_mode_data_arrays(dfas, kind_indices={ kind : i for i, kind in enumerate(kind_list) })
 
   with open(path, 'w', encoding='utf8') as f:
     src = render_template(template,
       Name=args.type_prefix,
+      kinds=fmt_obj(tuple(kind_list)),
+      encoding=repr(args.encoding),
+      keywords=fmt_obj(keywords),
       license=license,
-      mode_data=fmt_obj(mode_data),
+      linear_munch=str(use_linear_munch(args.munch, dfas)),
+      match_kinds=fmt_array_args(match_kinds),
+      mode_starts=fmt_obj(mode_starts),
       mode_transitions=fmt_obj(mode_transitions),
       pattern_descs=fmt_obj(pattern_descs),
       patterns_path=args.path,
+      state_tags=fmt_obj({ node : tuple(sorted(tags)) for dfa in dfas for node, tags in sorted(dfa.node_tags.items()) }),
+      transitions=fmt_array_args(transitions),
     )
     f.write(src)
     if args.test:
@@ -45,10 +62,35 @@ def output_python(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
       f.write(test_src)
 
 
+def gen_mode_data_arrays(dfas:List[DFA], kind_indices:Dict[str,int]) -> Tuple[List[int],List[int]]:
+  '''
+  Encode the transitions and match kinds of `dfas` in the compact form decoded by `legs_base.LazyModeData`.
+  For each mode, `transitions` holds the node count, then for each node:
+  the node, its range count, and (low byte, high byte, destination) for each range.
+  For each mode, `match_kinds` holds the match node count, then (node, kind index) for each match node.
+  '''
+  transitions:List[int] = []
+  match_kinds:List[int] = []
+  for dfa in dfas:
+    transitions.append(len(dfa.transitions))
+    for node, byte_dsts in sorted(dfa.transitions.items()):
+      ranges:List[List[int]] = []
+      for byte, dst in sorted(byte_dsts.items()):
+        if ranges and ranges[-1][1] == byte - 1 and ranges[-1][2] == dst: ranges[-1][1] = byte
+        else: ranges.append([byte, byte, dst])
+      transitions.extend((node, len(ranges)))
+      for r in ranges: transitions.extend(r)
+    match_nodes = sorted(dfa.match_nodes)
+    match_kinds.append(len(match_nodes))
+    for node in match_nodes:
+      match_kinds.extend((node, kind_indices[unwrap(dfa.match_kind(node))]))
+  return transitions, match_kinds
+
+
 template = '''# ${license}
 # This file was generated by legs from ${patterns_path}.
 
-from legs_base import DictLexerBase, ModeData, ModeTransitions
+from legs_base import DictLexerBase, Keywords, LazyModeData, ModeData, ModeTransitions, StateTags
 from typing import Dict, Iterator, Pattern, Tuple
 
 
@@ -58,7 +100,746 @@ class ${Name}Lexer(DictLexerBase):
 
   mode_transitions:ModeTransitions = ${mode_transitions}
 
-  mode_data:Dict[str,ModeData] = ${mode_data}
+  keywords:Keywords = ${keywords}
+
+  encoding:str = ${encoding}
+
+  mode_data:Dict[str,ModeData] = LazyModeData( # type: ignore[assignment]
+    mode_starts=${mode_starts},
+    kinds=${kinds},
+    transitions=(${transitions}),
+    match_kinds=(${match_kinds}))
+
+  state_tags:StateTags = ${state_tags}
+
+  linear_munch = ${linear_munch}
+
+'''
+
+
+
+def output_python_table(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
+
+  flat = gen_flat_table(dfas)
+  ascii_flat = gen_ascii_table(dfas)
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(table_template,
+      Name=args.type_prefix,
+      ascii_table=fmt_array_table(ascii_flat) if ascii_flat else 'None',
+      byte_classes=fmt_obj(flat.byte_classes),
+      class_count=str(flat.class_count),
+      final_kind=str(flat.final_kind),
+      kinds=fmt_obj(flat.kinds),
+      encoding=repr(args.encoding),
+      keywords=fmt_obj(keywords),
+      license=license,
+      loop_classes=fmt_obj(flat.loop_classes),
+      mode_starts=fmt_obj(flat.mode_starts),
+      mode_transitions=fmt_obj(mode_transitions),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+      state_tags=fmt_obj(flat.state_tags),
+      table=fmt_obj(flat.table),
+      typecode=repr(flat.typecode),
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+def fmt_array_table(flat:FlatTable) -> str:
+  'Format `flat` as a `legs_base.ArrayTable` constructor.'
+  fields = [
+    ('kinds', fmt_obj(flat.kinds)),
+    ('final_kind', str(flat.final_kind)),
+    ('mode_starts', fmt_obj(flat.mode_starts)),
+    ('byte_classes', fmt_obj(flat.byte_classes)),
+    ('class_count', str(flat.class_count)),
+    ('table', f'_array({flat.typecode!r}, {fmt_obj(flat.table)})'),
+    ('loop_classes', fmt_obj(flat.loop_classes)),
+    ('state_tags', fmt_obj(flat.state_tags)),
+  ]
+  return 'ArrayTable(\n' + ',\n'.join(f'    {name}={val}' for name, val in fields) + ')'
+
+
+table_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from array import array as _array
+from legs_base import ArrayLexerBase, ArrayTable, Keywords, ModeTransitions, StateTags
+from typing import Dict, Optional, Sequence, Tuple
+
+
+class ${Name}Lexer(ArrayLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Keywords = ${keywords}
+
+  encoding:str = ${encoding}
+
+  kinds:Tuple[str,...] = ${kinds}
+
+  final_kind:int = ${final_kind}
+
+  mode_starts:Dict[str,int] = ${mode_starts}
+
+  byte_classes:bytes = ${byte_classes}
+
+  class_count:int = ${class_count}
+
+  table:Sequence[int] = _array(${typecode}, ${table})
+
+  loop_classes:Dict[int,bytes] = ${loop_classes}
+
+  state_tags:StateTags = ${state_tags}
+
+  ascii_table:Optional[ArrayTable] = ${ascii_table}
+
+'''
+
+
+
+def output_python_hybrid(path:str, dfas:List[DFA], mode_transitions:ModeTransitions, patterns:Dict[str,LegsPattern],
+  mode_kind_sets:Mapping[str,Iterable[FrozenSet[str]]], keywords:Keywords, pattern_descs:Dict[str, str], license:str,
+  args:Namespace):
+
+  flat = gen_flat_table(dfas)
+  ascii_flat = gen_ascii_table(dfas)
+  hybrid_modes = gen_hybrid_modes(dfas, patterns=patterns, mode_kind_sets=mode_kind_sets)
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(hybrid_template,
+      Name=args.type_prefix,
+      ascii_table=fmt_array_table(ascii_flat) if ascii_flat else 'None',
+      byte_classes=fmt_obj(flat.byte_classes),
+      class_count=str(flat.class_count),
+      final_kind=str(flat.final_kind),
+      hybrid_modes=fmt_hybrid_modes(hybrid_modes),
+      kinds=fmt_obj(flat.kinds),
+      keywords=fmt_obj(keywords),
+      license=license,
+      loop_classes=fmt_obj(flat.loop_classes),
+      mode_starts=fmt_obj(flat.mode_starts),
+      mode_transitions=fmt_obj(mode_transitions),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+      table=fmt_obj(flat.table),
+      typecode=repr(flat.typecode),
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+def fmt_hybrid_modes(hybrid_modes:Dict[str,HybridMode]) -> str:
+  'Format `hybrid_modes` as a dict of `legs_base.HybridMode` constructors, with each regex as a verbose bytes literal.'
+  items:List[str] = []
+  for mode, h in hybrid_modes.items():
+    fields = [
+      ('regex', f"br'''{h.regex.decode('ascii')}'''"),
+      ('kinds', fmt_obj(h.kinds)),
+      ('continuations', fmt_obj(h.continuations)),
+      ('literals', fmt_obj(h.literals)),
+    ]
+    items.append(f'    {mode!r} : HybridMode(\n' + ',\n'.join(f'      {name}={val}' for name, val in fields) + ')')
+  return '{\n' + ',\n'.join(items) + '}'
+
+
+hybrid_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from array import array as _array
+from legs_base import ArrayTable, HybridLexerBase, HybridMode, Keywords, ModeTransitions
+from typing import Dict, Optional, Sequence, Tuple
+
+
+class ${Name}Lexer(HybridLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Keywords = ${keywords}
+
+  kinds:Tuple[str,...] = ${kinds}
+
+  final_kind:int = ${final_kind}
+
+  mode_starts:Dict[str,int] = ${mode_starts}
+
+  byte_classes:bytes = ${byte_classes}
+
+  class_count:int = ${class_count}
+
+  table:Sequence[int] = _array(${typecode}, ${table})
+
+  loop_classes:Dict[int,bytes] = ${loop_classes}
+
+  ascii_table:Optional[ArrayTable] = ${ascii_table}
+
+  hybrid_modes:Dict[str,HybridMode] = ${hybrid_modes}
+
+'''
+
+
+
+def output_python_str(path:str, patterns:Dict[str,LegsPattern], mode_pattern_kinds:Dict[str,FrozenSet[str]],
+  mode_transitions:ModeTransitions, keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
+
+  code_table = gen_code_table(patterns, mode_pattern_kinds, utf16=False)
+  flat = code_table.flat
+  latin1_classes = bytes(code_table.classes[bisect_right(code_table.bounds, code) - 1] for code in range(0x100))
+  str_keywords = { general : { text.decode('utf8') : kind for text, kind in texts.items() } for general, texts in keywords.items() }
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(str_template,
+      Name=args.type_prefix,
+      byte_classes=fmt_obj(latin1_classes),
+      class_count=str(flat.class_count),
+      code_bounds=fmt_obj(code_table.bounds),
+      code_classes=fmt_obj(code_table.classes),
+      final_kind=str(flat.final_kind),
+      kinds=fmt_obj(flat.kinds),
+      keywords=fmt_obj(str_keywords),
+      license=license,
+      loop_classes=fmt_obj(flat.loop_classes),
+      mode_starts=fmt_obj(flat.mode_starts),
+      mode_transitions=fmt_obj(mode_transitions),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+      state_tags=fmt_obj(flat.state_tags),
+      table=fmt_obj(flat.table),
+      typecode=repr(flat.typecode),
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+str_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from array import array as _array
+from legs_base import ModeTransitions, StateTags, StrLexerBase
+from typing import Dict, Sequence, Tuple
+
+
+class ${Name}Lexer(StrLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Dict[str,Dict[str,str]] = ${keywords} # type: ignore[assignment]
+
+  kinds:Tuple[str,...] = ${kinds}
+
+  final_kind:int = ${final_kind}
+
+  mode_starts:Dict[str,int] = ${mode_starts}
+
+  byte_classes:bytes = ${byte_classes}
+
+  code_bounds:Sequence[int] = ${code_bounds}
+
+  code_classes:bytes = ${code_classes}
+
+  class_count:int = ${class_count}
+
+  table:Sequence[int] = _array(${typecode}, ${table})
+
+  loop_classes:Dict[int,bytes] = ${loop_classes}
+
+  state_tags:StateTags = ${state_tags}
+
+'''
+
+
+
+def output_python_units(path:str, patterns:Dict[str,LegsPattern], mode_pattern_kinds:Dict[str,FrozenSet[str]],
+  mode_transitions:ModeTransitions, keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace,
+  encoding:str):
+
+  code_table = gen_code_table(patterns, mode_pattern_kinds, utf16=encoding.startswith('utf-16'))
+  flat = code_table.flat
+  unit_keywords = { general : { text.decode('utf8').encode(encoding) : kind for text, kind in texts.items() }
+    for general, texts in keywords.items() }
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(units_template,
+      Name=args.type_prefix,
+      class_count=str(flat.class_count),
+      code_bounds=fmt_obj(code_table.bounds),
+      code_classes=fmt_obj(code_table.classes),
+      encoding=repr(encoding),
+      final_kind=str(flat.final_kind),
+      kinds=fmt_obj(flat.kinds),
+      keywords=fmt_obj(unit_keywords),
+      license=license,
+      loop_classes=fmt_obj(flat.loop_classes),
+      mode_starts=fmt_obj(flat.mode_starts),
+      mode_transitions=fmt_obj(mode_transitions),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+      state_tags=fmt_obj(flat.state_tags),
+      table=fmt_obj(flat.table),
+      typecode=repr(flat.typecode),
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+units_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from array import array as _array
+from legs_base import Keywords, ModeTransitions, StateTags, UnitLexerBase
+from typing import Dict, Sequence, Tuple
+
+
+class ${Name}Lexer(UnitLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Keywords = ${keywords}
+
+  encoding:str = ${encoding}
+
+  kinds:Tuple[str,...] = ${kinds}
+
+  final_kind:int = ${final_kind}
+
+  mode_starts:Dict[str,int] = ${mode_starts}
+
+  code_bounds:Sequence[int] = ${code_bounds}
+
+  code_classes:bytes = ${code_classes}
+
+  class_count:int = ${class_count}
+
+  table:Sequence[int] = _array(${typecode}, ${table})
+
+  loop_classes:Dict[int,bytes] = ${loop_classes}
+
+  state_tags:StateTags = ${state_tags}
+
+'''
+
+
+
+def output_python_stride(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
+
+  stride = gen_stride_table(dfas, budget=args.stride_budget)
+  flat = stride.flat
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(stride_template,
+      Name=args.type_prefix,
+      byte_classes=fmt_obj(flat.byte_classes),
+      class_count=str(flat.class_count),
+      final_kind=str(flat.final_kind),
+      encoding=repr(args.encoding),
+      keywords=fmt_obj(keywords),
+      kinds=fmt_obj(flat.kinds),
+      license=license,
+      loop_classes=fmt_obj(flat.loop_classes),
+      mode_starts=fmt_obj(flat.mode_starts),
+      mode_transitions=fmt_obj(mode_transitions),
+      pair_limit=str(stride.pair_limit),
+      pair_rows=fmt_obj(stride.pair_rows),
+      pair_table=fmt_array(stride.pair_table),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+      table=fmt_array(flat.table),
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+stride_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from legs_base import Keywords, ModeTransitions, StrideLexerBase, decode_array as _a
+from typing import Dict, Sequence, Tuple
+
+
+class ${Name}Lexer(StrideLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Keywords = ${keywords}
+
+  encoding:str = ${encoding}
+
+  kinds:Tuple[str,...] = ${kinds}
+
+  final_kind:int = ${final_kind}
+
+  mode_starts:Dict[str,int] = ${mode_starts}
+
+  byte_classes:bytes = ${byte_classes}
+
+  class_count:int = ${class_count}
+
+  table:Sequence[int] = ${table}
+
+  loop_classes:Dict[int,bytes] = ${loop_classes}
+
+  pair_limit:int = ${pair_limit}
+
+  pair_rows:Dict[int,int] = ${pair_rows}
+
+  pair_table:Sequence[int] = ${pair_table}
+
+'''
+
+
+
+def output_python_sparse(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
+
+  sparse = gen_sparse_table(dfas, threshold=args.sparse_threshold)
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(sparse_template,
+      Name=args.type_prefix,
+      final_kind=str(sparse.final_kind),
+      kinds=fmt_obj(sparse.kinds),
+      encoding=repr(args.encoding),
+      keywords=fmt_obj(keywords),
+      license=license,
+      mode_starts=fmt_obj(sparse.mode_starts),
+      mode_transitions=fmt_obj(mode_transitions),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+      state_bounds=fmt_obj(sparse.state_bounds),
+      state_dsts=fmt_obj(sparse.state_dsts),
+      state_kinds=fmt_obj(sparse.state_kinds),
+      state_rows=fmt_obj(sparse.state_rows),
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+sparse_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from legs_base import Keywords, ModeTransitions, SparseLexerBase
+from typing import Dict, Optional, Sequence, Tuple
+
+
+class ${Name}Lexer(SparseLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Keywords = ${keywords}
+
+  encoding:str = ${encoding}
+
+  kinds:Tuple[str,...] = ${kinds}
+
+  final_kind:int = ${final_kind}
+
+  mode_starts:Dict[str,int] = ${mode_starts}
+
+  state_kinds:Sequence[int] = ${state_kinds}
+
+  state_bounds:Sequence[Sequence[int]] = ${state_bounds}
+
+  state_dsts:Sequence[Sequence[int]] = ${state_dsts}
+
+  state_rows:Sequence[Optional[Sequence[int]]] = ${state_rows}
+
+'''
+
+
+
+def output_python_comb(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
+
+  comb = gen_comb_table(dfas)
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(comb_template,
+      Name=args.type_prefix,
+      byte_classes=fmt_obj(comb.byte_classes),
+      final_kind=str(comb.final_kind),
+      kinds=fmt_obj(comb.kinds),
+      encoding=repr(args.encoding),
+      keywords=fmt_obj(keywords),
+      license=license,
+      mode_starts=fmt_obj(comb.mode_starts),
+      mode_transitions=fmt_obj(mode_transitions),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+      comb_base=fmt_array(comb.base),
+      comb_check=fmt_array(comb.check),
+      comb_default=fmt_array(comb.default),
+      comb_next=fmt_array(comb.next),
+      state_kinds=fmt_array(comb.state_kinds),
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+comb_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from legs_base import CombLexerBase, Keywords, ModeTransitions, decode_array as _a
+from typing import Dict, Sequence, Tuple
+
+
+class ${Name}Lexer(CombLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Keywords = ${keywords}
+
+  encoding:str = ${encoding}
+
+  kinds:Tuple[str,...] = ${kinds}
+
+  final_kind:int = ${final_kind}
+
+  mode_starts:Dict[str,int] = ${mode_starts}
+
+  byte_classes:bytes = ${byte_classes}
+
+  state_kinds:Sequence[int] = ${state_kinds}
+
+  comb_default:Sequence[int] = ${comb_default}
+
+  comb_base:Sequence[int] = ${comb_base}
+
+  comb_check:Sequence[int] = ${comb_check}
+
+  comb_next:Sequence[int] = ${comb_next}
+
+'''
+
+
+
+def output_python_code(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
+
+  mode_fns = { dfa.name : f'_lex_{py_safe_sym(dfa.name)}' for dfa in dfas }
+  lexer_name = f'{args.type_prefix}Lexer'
+  mode_fn_codes = [gen_mode_fn_code(dfa, mode_fns, mode_transitions.get(dfa.name, {}), keywords, lexer_name)
+    for dfa in dfas]
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(code_template,
+      Name=args.type_prefix,
+      encoding=repr(args.encoding),
+      keywords=fmt_obj(keywords),
+      license=license,
+      main_fn=mode_fns['main'],
+      mode_fns='\n\n'.join(mode_fn_codes),
+      mode_transitions=fmt_obj(mode_transitions),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+def gen_mode_fn_code(dfa:DFA, mode_fns:Dict[str,str], kind_transitions:Dict[str,Tuple[str,str]],
+ keywords:Keywords, lexer_name:str) -> str:
+  '''
+  Generate a generator function that lexes the tokens of a single mode,
+  delegating to the generator of a child mode for each push transition, and returning the position at which it pops.
+  The DFA is compiled into nested `if` statements that bisect first the current state and then the current byte.
+  Keyword reclassification is only emitted for modes that contain a general kind of `keywords`.
+  '''
+
+  final_nodes = dfa.final_nodes
+
+  def byte_action(dst:int, is_start:bool) -> List[str]:
+    kind = dfa.match_kind(dst)
+    if kind is None: return [f'state = {dst}']
+    if dst in final_nodes: # Emit the token without reading another byte.
+      if is_start: return [f'end = pos + 1; kind = {kind!r}; pos = len_text # Final; skip the loop.']
+      return [f'end = pos + 1; kind = {kind!r}; break # Final.']
+    return [f'state = {dst}; end = pos + 1; kind = {kind!r}']
+
+  def state_action(node:int, is_start:bool=False) -> List[str]:
+    dsts = dfa.transitions.get(node)
+    if not dsts: return ['break']
+    segments:List[Tuple[int,Tuple[str,...]]] = []
+    for byte in range(0x100):
+      action = tuple(byte_action(dsts[byte], is_start)) if byte in dsts else ('break',)
+      if not segments or segments[-1][1] != action: segments.append((byte, action))
+    return gen_bisect_code('byte', segments)
+
+  # The transition from the start node is hoisted out of the loop, since every token begins there.
+  # Final match states are never entered; a final transition from the start node sets `pos` past the loop,
+  # and `pos` is then restored from `end`.
+  start_code = state_action(dfa.start_node, is_start=True)
+  assert not any(line.startswith('break') for line in start_code) # The start node transitions on every byte.
+  state_segments = [(node, tuple(state_action(node))) for node in range(dfa.start_node, dfa.end_node)]
+  state_code = gen_bisect_code('state', state_segments)
+
+  push_code:List[str] = []
+  for kind, (child_mode, child_pop_kind) in sorted(kind_transitions.items()):
+    push_code.append(f'elif kind == {kind!r}: pos = yield from {mode_fns[child_mode]}(text, pos, {child_pop_kind!r})')
+
+  has_keywords = any(kind in keywords for kind in dfa.pattern_kinds)
+
+  return render_template(mode_fn_template,
+    fn=mode_fns[dfa.name],
+    keyword_code='\n    if kind in keywords: kind = keywords[kind].get(text[token_pos:end], kind)' if has_keywords else '',
+    keywords_def=f'\n  keywords = {lexer_name}.keywords' if has_keywords else '',
+    mode=dfa.name,
+    push_code=''.join('\n    ' + line for line in push_code),
+    start_code='\n    '.join(start_code),
+    state_code='\n      '.join(state_code),
+  )
+
+
+def gen_bisect_code(var:str, segments:List[Tuple[int,Tuple[str,...]]]) -> List[str]:
+  '''
+  Generate lines of code that select among `segments`, each being a (low bound, action lines) pair;
+  each segment extends up to the low bound of the next.
+  Since the segments partition the domain of `var`, each leaf is reached by comparisons alone.
+  '''
+  if len(segments) == 1: return list(segments[0][1])
+  mid = len(segments) // 2
+  lines = [f'if {var} < {segments[mid][0]}:']
+  lines.extend('  ' + line for line in gen_bisect_code(var, segments[:mid]))
+  right = gen_bisect_code(var, segments[mid:])
+  if right[0].startswith('if '): # Chain the nested comparison as `elif`.
+    lines.append('el' + right[0])
+    lines.extend(right[1:])
+  else:
+    lines.append('else:')
+    lines.extend('  ' + line for line in right)
+  return lines
+
+
+mode_fn_template = '''def ${fn}(text:bytes, pos:int, pop_kind:Optional[str]) -> Generator[Token,None,int]:
+  'Lex mode `${mode}`.'
+  new = tuple.__new__
+  len_text = len(text)${keywords_def}
+  while pos < len_text:
+    token_pos = pos
+    kind = 'incomplete'
+    end = 0
+    byte = text[pos]
+    ${start_code}
+    pos += 1
+    while pos < len_text:
+      byte = text[pos]
+      ${state_code}
+      pos += 1
+    # Matching stopped or reached end of text.
+    if not end: end = pos # Never reached a match state; incomplete.
+    pos = end${keyword_code}
+    yield new(Token, (kind, token_pos, end))
+    # Check for mode transition.
+    if kind == pop_kind: return pos${push_code}
+  return pos
+'''
+
+
+code_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from legs_base import CodeLexerBase, Keywords, ModeTransitions, Token
+from typing import Dict, Generator, Optional
+
+
+${mode_fns}
+
+
+class ${Name}Lexer(CodeLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Keywords = ${keywords}
+
+  encoding:str = ${encoding}
+
+  lex = staticmethod(${main_fn})
+
+'''
+
+
+
+def output_python_lazy(path:str, nfas:List[NFA], patterns:Dict[str,LegsPattern], mode_transitions:ModeTransitions,
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
+
+  lazy = gen_lazy_nfa(nfas, patterns)
+
+  with open(path, 'w', encoding='utf8') as f:
+    src = render_template(lazy_template,
+      Name=args.type_prefix,
+      kinds=fmt_obj(lazy.kinds),
+      keywords=fmt_obj(keywords),
+      license=license,
+      mode_starts=fmt_obj(lazy.mode_starts),
+      mode_transitions=fmt_obj(mode_transitions),
+      node_kinds=fmt_obj(lazy.node_kinds),
+      node_ranges=fmt_obj(lazy.node_ranges),
+      pattern_descs=fmt_obj(pattern_descs),
+      patterns_path=args.path,
+    )
+    f.write(src)
+    if args.test:
+      test_src = render_template(test_template, Name=args.type_prefix)
+      f.write(test_src)
+
+
+lazy_template = '''# ${license}
+# This file was generated by legs from ${patterns_path}.
+
+from legs_base import Keywords, LazyLexerBase, ModeTransitions
+from typing import Dict, Sequence, Tuple
+
+
+class ${Name}Lexer(LazyLexerBase):
+
+  pattern_descs:Dict[str,str] = ${pattern_descs}
+
+  mode_transitions:ModeTransitions = ${mode_transitions}
+
+  keywords:Keywords = ${keywords}
+
+  kinds:Tuple[str,...] = ${kinds}
+
+  mode_starts:Dict[str,int] = ${mode_starts}
+
+  node_kinds:Sequence[int] = ${node_kinds}
+
+  node_ranges:Sequence[Sequence[Tuple[int,int,Tuple[int,...]]]] = ${node_ranges}
 
 '''
 
@@ -66,7 +847,7 @@ class ${Name}Lexer(DictLexerBase):
 
 def output_python_re(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
   patterns:Dict[str,LegsPattern], incomplete_patterns:Dict[str,Optional[LegsPattern]],
-  pattern_descs:Dict[str, str], license:str, args:Namespace):
+  keywords:Keywords, pattern_descs:Dict[str, str], license:str, args:Namespace):
 
   flavor = 'py.re.bytes'
 
@@ -100,6 +881,7 @@ def output_python_re(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
   with open(path, 'w', encoding='utf8') as f:
     src = render_template(re_template,
       Name=args.type_prefix,
+      keywords=fmt_obj(keywords),
       license=license,
       mode_patterns_repr=mode_patterns_repr,
       mode_transitions=fmt_obj(mode_transitions),
@@ -116,10 +898,30 @@ def fmt_obj(object:Any) -> str:
   return pformat(object, indent=2, width=128, compact=True)
 
 
+def fmt_array(values:List[int]) -> str:
+  '''
+  Format `values` as a call to `legs_base.decode_array` (imported as `_a`),
+  using the smallest sufficient typecode, and little-endian data compressed with zlib and encoded as base64 lines.
+  '''
+  return f'_a({fmt_array_args(values)})'
+
+
+def fmt_array_args(values:List[int]) -> str:
+  'Format the `typecode, data` arguments to `legs_base.decode_array` for `values`.'
+  typecode = 'B' if max(values, default=0) < 0x100 else 'H' if max(values) < 0x10000 else 'I'
+  a = array(typecode, values)
+  if sys_byteorder == 'big': a.byteswap()
+  data = b64encode(zlib_compress(a.tobytes(), 9)).decode('ascii')
+  w = 120
+  if len(data) <= w: return f"{typecode!r}, b'{data}'"
+  lines = '\n'.join(f"    b'{data[i:i+w]}'" for i in range(0, len(data), w))
+  return f"{typecode!r},\n{lines}"
+
+
 re_template = '''# ${license}
 # This file was generated by legs from ${patterns_path}.
 
-from legs_base import RegexLexerBase, ModeData, ModeTransitions
+from legs_base import Keywords, ModeData, ModeTransitions, RegexLexerBase
 from re import compile as _re_compile
 from typing import Dict, Iterator, Pattern, Tuple
 
@@ -129,6 +931,8 @@ class ${Name}Lexer(RegexLexerBase):
 
   mode_transitions:ModeTransitions = ${mode_transitions}
 
+  keywords:Keywords = ${keywords}
+
   mode_patterns:Dict[str,Pattern] = ${mode_patterns_repr}
 
 '''
@@ -10,12 +10,13 @@ from pithy.fs import add_file_execute_permissions, path_dir, path_join
 from pithy.iterable import closed_int_intervals
 from pithy.string import render_template
 
-from .defs import ModeTransitions
+from .defs import Keywords, ModeTransitions
 from .dfa import DFA
+from .lint import use_linear_munch
 
 
 def output_swift(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
- pattern_descs:Dict[str,str], license:str, args:Namespace) -> None:
+ keywords:Keywords, pattern_descs:Dict[str,str], license:str, args:Namespace) -> None:
 
   # Create safe mode names.
   modes = { dfa.name : swift_safe_sym(dfa.name) for dfa in dfas }
@@ -39,6 +40,11 @@ def output_swift(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
 
   mode_transitions_dict = {SwiftEnum(modes[name]):mode_trans_dict(d) for name, d in mode_transitions.items()}
 
+  # Keywords dictionary.
+
+  keywords_dict = {SwiftEnum(kind_syms[general]): {text: SwiftEnum(kind_syms[kind]) for text, kind in texts.items()}
+    for general, texts in keywords.items()}
+
   # State cases.
 
   def byte_case_patterns(chars:List[int]) -> List[str]:
@@ -50,10 +56,15 @@ def output_swift(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
   def byte_case(dfa:DFA, chars:List[int], dst:int) -> str:
     pattern_kind = dfa.match_kind(dst)
     sym = None if pattern_kind is None else kind_syms.get(pattern_kind)
+    suffix = f'; last = pos; kind = .{sym}' if sym else ''
+    if sym and dst in dfa.final_nodes: # No transitions out; stop without reading another byte.
+      suffix += '; visited.removeAll()'
+      if 0x0a in chars: suffix += '; if byte == 0x0a { source.newlinePositions.append(pos) }'
+      suffix += '; break loop'
     return 'case {chars}: state = {dst}{suffix}'.format(
       chars=', '.join(byte_case_patterns(chars)),
       dst=dst,
-      suffix=f'; last = pos; kind = .{sym}' if sym else '')
+      suffix=suffix)
 
   def byte_cases(dfa:DFA, node:int) -> List[str]:
     dst_chars:DefaultDict[int, List[int]] = DefaultDict(list)
@@ -91,6 +102,8 @@ def output_swift(path:str, dfas:List[DFA], mode_transitions:ModeTransitions,
     src = render_template(template,
       Name=args.type_prefix,
       license=license,
+      keywords_dict=swift_repr(keywords_dict, indent=2),
+      linear_munch=str(use_linear_munch(args.munch, dfas)).lower(),
       mode_case_defs='\n  '.join(mode_case_defs),
       mode_transitions_dict=swift_repr(mode_transitions_dict, indent=2),
       patterns_path=args.path,
@@ -150,6 +163,11 @@ public struct ${Name}Lexer: Sequence, IteratorProtocol {
   private var stack: [(${Name}LexMode, ${Name}TokenKind?)] = [(.main, nil)]
   private var pos: Int = 0
 
+  // Linear-time maximal munch (Reps, 1998): when a scan stops, each (state, position) pair visited since the last match
+  // is recorded as failed, mapped to the position where the scan stopped; later scans stop when they reach a failed pair.
+  private static let linearMunch = ${linear_munch}
+  private var failed: [Int: Int] = [:] // Keyed by `pos << 32 | state`.
+
   public init(source: Source) {
     self.source = source
   }
@@ -168,6 +186,8 @@ public struct ${Name}Lexer: Sequence, IteratorProtocol {
     var state = mode.startState
     var last: Int = -1
     var kind: ${Name}TokenKind = .incomplete
+    var stop: Int? = nil
+    var visited: [Int] = [] // Failed keys visited since the last match.
 
     loop: while pos < source.text.count {
       let byte = source.text[pos]
@@ -182,6 +202,26 @@ public struct ${Name}Lexer: Sequence, IteratorProtocol {
         source.newlinePositions.append(pos)
       }
       pos += 1
+      if ${Name}Lexer.linearMunch {
+        if last == pos - 1 { // Matched.
+          visited.removeAll(keepingCapacity: true)
+        } else {
+          let key = pos << 32 | state
+          if let s = failed[key] {
+            stop = s
+            break loop
+          }
+          visited.append(key)
+        }
+      }
+    }
+    if ${Name}Lexer.linearMunch {
+      if stop == nil { stop = pos }
+      for key in visited { failed[key] = stop! }
+      if last == -1 && stop! > pos { // Incomplete; the token extends to where the original scan stopped.
+        for p in pos..<stop! where source.text[p] == 0x0a { source.newlinePositions.append(p) }
+        pos = stop!
+      }
     }
 
     let tokenPos = self.pos
@@ -194,6 +234,9 @@ public struct ${Name}Lexer: Sequence, IteratorProtocol {
     }
     assert(tokenPos < tokenEnd, "tokenPos: \(tokenPos); tokenEnd: \(tokenEnd)")
     self.pos = tokenEnd
+    if let keyword = ${Name}Lexer.keywords[kind]?[Array(source.text[tokenPos..<tokenEnd])] {
+      kind = keyword
+    }
     if kind == popKind {
       stack.removeLast()
     } else {
@@ -205,6 +248,9 @@ public struct ${Name}Lexer: Sequence, IteratorProtocol {
   }
 
   private static let modeTransitions: Dictionary<${Name}LexMode, Dictionary<TokenKind, (${Name}LexMode, TokenKind?)>> = ${mode_transitions_dict}
+
+  // Tokens of these kinds are reclassified by their text after matching; see `legs.build.extract_keywords`.
+  private static let keywords: Dictionary<TokenKind, Dictionary<[UInt8], TokenKind>> = ${keywords_dict}
 }
 '''
 
@@ -283,6 +329,7 @@ def swift_esc_str(string:str) -> str:
 def swift_repr(obj:Any, indent=0) -> str:
   if isinstance(obj, int): return repr(obj)
   if isinstance(obj, str): return f'"{swift_esc_str(obj)}"'
+  if isinstance(obj, bytes): return f'[{", ".join(hex(b) for b in obj)}]'
   if isinstance(obj, SwiftEnum): return obj.swift_repr
   if isinstance(obj, tuple): return f'({",".join(swift_repr(el) for el in obj)})'
   if isinstance(obj, dict):
@@ -0,0 +1,359 @@
+# Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
+
+'''
+Transition table layouts for generated lexers.
+
+The DFAs for all modes are flattened into a single table of rows, one row per node.
+Bytes are first partitioned into equivalence classes: two bytes are in the same class
+if every node transitions identically on both of them.
+Each row then has one column per byte class, plus a final column holding the node's match kind.
+
+Nodes are identified at runtime by the offset of their row into the table,
+so that the lexer performs a single addition and index per byte.
+Row 0 is the dead row: a transition to offset 0 means "no transition".
+Kind index 0 means "not a match node"; it also indexes the `incomplete` kind, which is the result of failing to match.
+Match nodes without transitions ("final" nodes) have kind indices at or above `final_kind`, so that lexers can stop at once.
+
+Alternatively, the sparse layout stores each node as its own state:
+nodes whose transitions consist of a few byte ranges are stored as sorted range lists to be searched with `bisect`,
+while the remainder are stored as dense 256-entry rows.
+This bounds the size of the table for large grammars, where the flat layout can grow to megabytes.
+
+Nodes that transition to themselves are also recorded along with their loop bytes (or byte classes),
+so that lexers can skip runs of such bytes in bulk.
+Likewise, for grammars with tags, the nodes that set tags are recorded with their tags (see `legs.nfa.gen_dfa`).
+
+For sources that are pure ASCII, lexers can instead use a smaller flat table of the DFAs projected onto ASCII bytes.
+
+The stride layout adds, for the hottest nodes of the flat table and within a memory budget,
+rows of transitions over pairs of byte classes, so that lexers can often consume two bytes per step.
+'''
+
+from itertools import chain
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+from pithy.optional import unwrap
+
+from .dfa import DFA, Tag, project_dfa
+
+
+class FlatTable(NamedTuple):
+  byte_classes:bytes # Translation table from byte to byte class.
+  class_count:int # The match kind column index; the row width is `class_count + 1`.
+  kinds:Tuple[str,...] # Kind strings, indexed by the match kind column. kinds[0] is 'incomplete'.
+  final_kind:int # Kind indices at or above this belong to final states; see `KindIndexer`.
+  mode_starts:Dict[str,int] # Row offset of the start node for each mode.
+  table:List[int]
+  loop_classes:Dict[int,bytes] # Row offset of each self-looping node, mapped to the byte classes of its self transitions.
+  state_tags:Dict[int,Tuple[Tag,...]] = {} # Row offset of each node that sets tags, mapped to its tags; see `DFA.node_tags`.
+
+  @property
+  def row_width(self) -> int: return self.class_count + 1
+
+  @property
+  def typecode(self) -> str:
+    'The smallest `array` typecode that can hold every table entry.'
+    return 'H' if max(self.table, default=0) < 0x10000 else 'I'
+
+
+def gen_byte_classes(dfas:List[DFA], symbol_count:int=0x100) -> Tuple[bytes, int]:
+  '''
+  Partition the bytes (or the symbols of an alternative alphabet of size `symbol_count`; see `legs.code_classes`)
+  into classes of identical columns across all nodes of `dfas`.
+  Returns the translation table from byte to class and the number of classes.
+  Exits if there are more than 256 classes, which can only happen for alternative alphabets.
+  '''
+  rows = [dfa.transitions[n] for dfa in dfas for n in sorted(dfa.transitions)]
+  columns:Dict[Tuple[int,...],int] = {}
+  classes = []
+  for byte in range(symbol_count):
+    column = tuple(row.get(byte, -1) for row in rows)
+    classes.append(columns.setdefault(column, len(columns)))
+  if len(columns) > 0x100:
+    exit(f'legs error: the automata require {len(columns)} symbol classes; the maximum is 256.')
+  return bytes(classes), len(columns)
+
+
+class KindIndexer:
+  '''
+  Assign kind indices to the match nodes of `dfas` in order of first use; index 0 is reserved for `incomplete`.
+  Final nodes (see `DFA.final_nodes`) get separate indices, starting at `final_kind` after all other kinds,
+  so that a lexer can test for a final state with a single comparison, and emit the token without reading another byte.
+  A kind can therefore appear in `kinds` twice.
+  '''
+
+  def __init__(self, dfas:List[DFA]) -> None:
+    self.final_nodes = frozenset().union(*(dfa.final_nodes for dfa in dfas))
+    non_final:Dict[str,int] = {} # Maps kinds to indices, in order of first use.
+    final:Dict[str,int] = {}
+    for dfa in dfas:
+      for node in sorted(dfa.match_node_kind_sets):
+        group = final if node in self.final_nodes else non_final
+        group.setdefault(unwrap(dfa.match_kind(node)), len(group))
+    self.final_kind = 1 + len(non_final)
+    self.kinds = ['incomplete', *non_final, *final]
+    self.indices:Dict[Tuple[str,bool],int] = {
+      **{ (kind, False) : 1 + i for kind, i in non_final.items() },
+      **{ (kind, True) : self.final_kind + i for kind, i in final.items() }}
+
+  def index(self, dfa:DFA, node:int) -> int:
+    'Return the kind index for `node`, or 0 if it is not a match node.'
+    if node not in dfa.match_node_kind_sets: return 0
+    return self.indices[(unwrap(dfa.match_kind(node)), node in self.final_nodes)]
+
+
+def gen_flat_table(dfas:List[DFA], first_nodes:Sequence[int]=(), symbol_count:int=0x100) -> FlatTable:
+  '''
+  Generate the flat table for `dfas`. Rows are in node order, except that the rows for `first_nodes` come first.
+  `symbol_count` is the size of the alphabet; see `gen_byte_classes`.
+  '''
+  byte_classes, class_count = gen_byte_classes(dfas, symbol_count=symbol_count)
+  row_width = class_count + 1
+  kind_indexer = KindIndexer(dfas)
+
+  # Assign rows; row 0 is dead.
+  node_rows:Dict[int,int] = {}
+  for node in chain(first_nodes, *(sorted(dfa.all_nodes) for dfa in dfas)):
+    if node not in node_rows: node_rows[node] = (len(node_rows) + 1) * row_width
+
+  table = [0] * ((len(node_rows) + 1) * row_width)
+  loop_classes:Dict[int,bytes] = {}
+  state_tags:Dict[int,Tuple[Tag,...]] = {}
+  for dfa in dfas:
+    for node, tags in sorted(dfa.node_tags.items()): state_tags[node_rows[node]] = tuple(sorted(tags))
+    for node in sorted(dfa.all_nodes):
+      offset = node_rows[node]
+      for byte, dst in dfa.transitions.get(node, {}).items():
+        table[offset + byte_classes[byte]] = node_rows[dst]
+      table[offset + class_count] = kind_indexer.index(dfa, node)
+      loops = self_loop_bytes(dfa, node)
+      if loops: loop_classes[offset] = bytes(sorted({byte_classes[byte] for byte in loops}))
+
+  mode_starts = { dfa.name : node_rows[dfa.start_node] for dfa in dfas }
+  return FlatTable(byte_classes=byte_classes, class_count=class_count, kinds=tuple(kind_indexer.kinds),
+    final_kind=kind_indexer.final_kind, mode_starts=mode_starts, table=table, loop_classes=loop_classes, state_tags=state_tags)
+
+
+def gen_ascii_table(dfas:List[DFA]) -> Optional[FlatTable]:
+  '''
+  Generate a flat table of `dfas` projected onto ASCII bytes (see `project_dfa`), for lexing sources that are pure ASCII.
+  Such sources never enter the multi-byte UTF-8 subautomata of Unicode character classes, so the projected table can be much smaller.
+  Returns None if the projection is no smaller than the full table, i.e. the grammar has no such subautomata.
+  '''
+  full = gen_flat_table(dfas)
+  flat = gen_flat_table([project_dfa(dfa, range(0x80)) for dfa in dfas])
+  if len(flat.table) >= len(full.table): return None
+  return flat
+
+
+def self_loop_bytes(dfa:DFA, node:int) -> List[int]:
+  '''
+  Return the bytes on which `node` transitions to itself.
+  Lexers skip runs of these bytes with a single call to a compiled pattern (see `legs_base.compile_run_matcher`),
+  rather than stepping through them one byte at a time; this matters for spaces, comments, and string bodies.
+  '''
+  return sorted(byte for byte, dst in dfa.transitions.get(node, {}).items() if dst == node)
+
+
+class StrideTable(NamedTuple):
+  flat:FlatTable
+  pair_limit:int # Row offsets below this have pair rows; all other rows are after them.
+  pair_rows:Dict[int,int] # Row offset of each node below `pair_limit`, mapped to the offset of its row in `pair_table`.
+  pair_table:List[int] # Rows over pairs of byte classes, with one column per (first class * class count + second class).
+
+
+def gen_stride_table(dfas:List[DFA], budget:int) -> StrideTable:
+  '''
+  Generate a flat table along with two-byte transitions for as many nodes as fit in `budget` bytes.
+  A pair of byte classes (c1, c2) from node `s` leads to the node reached after both bytes,
+  unless the first step dies, loops on `s` (which lexers skip in bulk instead), or reaches a match node,
+  whose end position must be recorded; or the second step dies. Those entries are 0, and lexers take single steps.
+  A failed pair lookup costs more than it saves, so a node only gets a pair row if at least half of the byte classes
+  on which it transitions can be paired.
+  Nodes are considered in table order, which puts the nodes nearest the mode starts (or the hottest; see `renumber_dfa`) first.
+  The rows of the chosen nodes are then moved to the front of the flat table,
+  so that lexers can test for a pair row with a single comparison.
+  '''
+  def pair_row(flat:FlatTable, state:int) -> Optional[List[int]]:
+    table = flat.table
+    class_count = flat.class_count
+    row = [0] * (class_count * class_count)
+    live = 0
+    paired = 0
+    for c1 in range(class_count):
+      mid = table[state + c1]
+      if not mid: continue
+      live += 1
+      if mid == state or table[mid + class_count]: continue
+      paired += 1
+      base = c1 * class_count
+      for c2 in range(class_count):
+        row[base + c2] = table[mid + c2]
+    return row if (paired and paired * 2 >= live) else None
+
+  # Choose the nodes using the table in node order.
+  flat = gen_flat_table(dfas)
+  itemsize = 2 if flat.typecode == 'H' else 4
+  max_rows = budget // (itemsize * flat.class_count * flat.class_count)
+  nodes = [node for dfa in dfas for node in sorted(dfa.all_nodes)]
+  pair_nodes:List[int] = []
+  for i, node in enumerate(nodes):
+    if len(pair_nodes) >= max_rows: break
+    if pair_row(flat, (i + 1) * flat.row_width): pair_nodes.append(node)
+
+  # Regenerate the table with the chosen nodes first.
+  flat = gen_flat_table(dfas, first_nodes=pair_nodes)
+  pair_rows:Dict[int,int] = {}
+  pair_table:List[int] = []
+  for i in range(len(pair_nodes)):
+    state = (i + 1) * flat.row_width
+    pair_rows[state] = len(pair_table)
+    pair_table.extend(unwrap(pair_row(flat, state)))
+  pair_limit = (len(pair_nodes) + 1) * flat.row_width
+  return StrideTable(flat=flat, pair_limit=pair_limit, pair_rows=pair_rows, pair_table=pair_table)
+
+
+class SparseTable(NamedTuple):
+  kinds:Tuple[str,...] # Kind strings, indexed by `state_kinds`. kinds[0] is 'incomplete'.
+  final_kind:int # Kind indices at or above this belong to final states; see `KindIndexer`.
+  mode_starts:Dict[str,int] # Start state for each mode.
+  state_bounds:List[Tuple[int,...]] # Range start bytes for sparse states; empty for dense states.
+  state_dsts:List[Tuple[int,...]] # Range destinations for sparse states; empty for dense states.
+  state_kinds:List[int]
+  state_rows:List[Optional[Tuple[int,...]]] # 256-entry rows for dense states; None for sparse states.
+
+
+def gen_sparse_table(dfas:List[DFA], threshold:int) -> SparseTable:
+  '''
+  Generate a table in which each node with at most `threshold` distinct byte ranges is stored as a sorted range list,
+  and every other node as a dense row. State 0 is dead.
+  '''
+  kind_indexer = KindIndexer(dfas)
+  node_states:Dict[int,int] = {}
+  for dfa in dfas:
+    for node in sorted(dfa.all_nodes):
+      node_states[node] = len(node_states) + 1
+
+  state_bounds:List[Tuple[int,...]] = [(0,)]
+  state_dsts:List[Tuple[int,...]] = [(0,)]
+  state_kinds = [0]
+  state_rows:List[Optional[Tuple[int,...]]] = [None]
+  for dfa in dfas:
+    for node in sorted(dfa.all_nodes):
+      dsts = dfa.transitions.get(node, {})
+      row = tuple(node_states[dsts[byte]] if byte in dsts else 0 for byte in range(0x100))
+      bounds = tuple(byte for byte in range(0x100) if byte == 0 or row[byte] != row[byte-1])
+      if len(bounds) <= threshold:
+        state_bounds.append(bounds)
+        state_dsts.append(tuple(row[byte] for byte in bounds))
+        state_rows.append(None)
+      else:
+        state_bounds.append(())
+        state_dsts.append(())
+        state_rows.append(row)
+      state_kinds.append(kind_indexer.index(dfa, node))
+
+  mode_starts = { dfa.name : node_states[dfa.start_node] for dfa in dfas }
+  return SparseTable(kinds=tuple(kind_indexer.kinds), final_kind=kind_indexer.final_kind, mode_starts=mode_starts,
+    state_bounds=state_bounds, state_dsts=state_dsts, state_kinds=state_kinds, state_rows=state_rows)
+
+
+class CombTable(NamedTuple):
+  byte_classes:bytes # Translation table from byte to byte class.
+  kinds:Tuple[str,...] # Kind strings, indexed by `state_kinds`. kinds[0] is 'incomplete'.
+  final_kind:int # Kind indices at or above this belong to final states; see `KindIndexer`.
+  mode_starts:Dict[str,int] # Start state for each mode.
+  base:List[int] # Offset of each state's row into `next` and `check`.
+  next:List[int] # Destination states.
+  check:List[int] # Owner state of each entry in `next`; 0 for unused entries.
+  default:List[int] # Template state consulted for entries that a state does not store itself; 0 for none.
+  state_kinds:List[int]
+
+  def arrays(self) -> Dict[str,List[int]]:
+    return dict(base=self.base, next=self.next, check=self.check, default=self.default, state_kinds=self.state_kinds)
+
+
+def gen_comb_table(dfas:List[DFA], max_templates:int=64) -> CombTable:
+  '''
+  Generate a row-displacement ("comb vector") table in the style of yacc and flex.
+  Each state stores only the entries of its row (over byte classes) that differ from its default state,
+  and the sparse rows are overlaid into shared `next` and `check` arrays at offsets chosen by first fit.
+  Default states are chosen from a most-recently-used list of template states, which never have defaults themselves,
+  so a lookup consults at most two rows. State 0 is dead.
+  '''
+  byte_classes, class_count = gen_byte_classes(dfas)
+  kind_indexer = KindIndexer(dfas)
+  node_states:Dict[int,int] = {}
+  for dfa in dfas:
+    for node in sorted(dfa.all_nodes):
+      node_states[node] = len(node_states) + 1
+  state_count = len(node_states) + 1
+
+  rows:List[Tuple[int,...]] = [(0,) * class_count]
+  state_kinds = [0]
+  for dfa in dfas:
+    for node in sorted(dfa.all_nodes):
+      row = [0] * class_count
+      for byte, dst in dfa.transitions.get(node, {}).items():
+        row[byte_classes[byte]] = node_states[dst]
+      rows.append(tuple(row))
+      state_kinds.append(kind_indexer.index(dfa, node))
+
+  # Choose defaults and the entries that each state must store.
+  default = [0] * state_count
+  entries:List[List[Tuple[int,int]]] = [[]] # Per state: (class, dst) pairs.
+  templates:List[int] = [] # Most recently used first.
+  for state in range(1, state_count):
+    state_row = rows[state]
+    own = [(c, dst) for c, dst in enumerate(state_row) if dst]
+    best_state = 0
+    best_entries = own
+    for template in templates:
+      diff = [(c, dst) for c, (dst, t_dst) in enumerate(zip(state_row, rows[template])) if dst != t_dst]
+      if len(diff) < len(best_entries):
+        best_state = template
+        best_entries = diff
+    if best_state and len(best_entries) * 2 <= len(own):
+      default[state] = best_state
+      entries.append(best_entries)
+      templates.remove(best_state)
+      templates.insert(0, best_state)
+    else:
+      entries.append(own)
+      if len(own) > 1:
+        templates.insert(0, state)
+        del templates[max_templates:]
+
+  # Overlay the rows by first fit, densest rows first.
+  base = [0] * state_count
+  check = [0] * class_count
+  next_ = [0] * class_count
+  occupied = bytearray(class_count)
+  for state in sorted(range(1, state_count), key=lambda s: (-len(entries[s]), s)):
+    state_entries = entries[state]
+    if not state_entries: continue # Any base will do; 0 is always in bounds.
+    c0 = state_entries[0][0]
+    offset = -c0
+    while True:
+      # Find the next offset at which the first entry fits, then check the rest.
+      offset = occupied.find(0, offset + c0) - c0
+      if offset < 0: # No free slot; append.
+        offset = max(0, len(occupied) - c0)
+        break
+      if not any(offset + c < len(occupied) and occupied[offset + c] for c, _ in state_entries): break
+      offset += 1
+    end = offset + class_count
+    if end > len(check):
+      ext = end - len(check)
+      check.extend([0] * ext)
+      next_.extend([0] * ext)
+      occupied.extend(bytes(ext))
+    base[state] = offset
+    for c, dst in state_entries:
+      check[offset + c] = state
+      next_[offset + c] = dst
+      occupied[offset + c] = 1
+
+  mode_starts = { dfa.name : node_states[dfa.start_node] for dfa in dfas }
+  return CombTable(byte_classes=byte_classes, kinds=tuple(kind_indexer.kinds), final_kind=kind_indexer.final_kind,
+    mode_starts=mode_starts, base=base, next=next_, check=check, default=default, state_kinds=state_kinds)
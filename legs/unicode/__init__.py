@@ -1,7 +1,9 @@
 # Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
 
+from bisect import bisect_right
+from heapq import merge
 from itertools import chain
-from typing import Collection, Dict, Iterable, Tuple
+from typing import Any, Collection, Dict, Iterable, Iterator, Optional, Tuple
 
 
 # use pairs instead of real range objects because they are sortable, and faster to load in the interpreter.
@@ -90,6 +92,78 @@ def ranges_for_codes(seq:Iterable[int]) -> Iterable[CodeRange]:
   yield (low, end)
 
 
+def utf8_byte_range_seqs(seq:Iterable[CodeRange]) -> Iterator[Tuple[Tuple[int,int], ...]]:
+  '''
+  Yield sequences of closed byte ranges whose concatenations exactly match the UTF-8 encodings of the code points in `seq`.
+  Each code range is split into subranges whose encodings have the same length
+  and vary only in a suffix of continuation bytes, so the output size is proportional to the number of ranges,
+  not the number of code points. (This is the algorithm used by RE2 and Rust's regex-syntax.)
+  '''
+  for start, end in seq:
+    stack = [(start, end - 1)] # Closed intervals.
+    while stack:
+      s, e = stack.pop()
+      if s <= surrogates[1] - 1 and e >= surrogates[0]:
+        raise ValueError(f'surrogate code points cannot be encoded as UTF-8: {(s, e+1)}')
+      split = _utf8_split(s, e)
+      if split:
+        stack.extend(reversed(split))
+        continue
+      if e < 0x80:
+        yield ((s, e),)
+      else:
+        yield tuple(zip(chr(s).encode(), chr(e).encode()))
+
+
+def utf16_unit_range_seqs(seq:Iterable[CodeRange]) -> Iterator[Tuple[Tuple[int,int], ...]]:
+  '''
+  Yield sequences of closed UTF-16 code unit ranges whose concatenations exactly match the UTF-16 encodings of the code points in `seq`.
+  Code points in the Basic Multilingual Plane are single units; the rest are pairs of high and low surrogates,
+  split by high surrogate so that the output size is proportional to the number of ranges, as for `utf8_byte_range_seqs`.
+  '''
+  for start, end in seq:
+    s = start
+    e = end - 1 # Closed interval.
+    if s <= surrogates[1] - 1 and e >= surrogates[0]:
+      raise ValueError(f'surrogate code points cannot be encoded as UTF-16: {(start, end)}')
+    if s < 0x10000:
+      yield ((s, min(e, 0xFFFF)),)
+      s = 0x10000
+    if e < s: continue
+    hs, ls = divmod(s - 0x10000, 0x400)
+    he, le = divmod(e - 0x10000, 0x400)
+    hi = high_surrogates[0]
+    lo = low_surrogates[0]
+    if hs == he:
+      yield ((hi + hs, hi + hs), (lo + ls, lo + le))
+      continue
+    if ls:
+      yield ((hi + hs, hi + hs), (lo + ls, lo + 0x3FF))
+      hs += 1
+    last = None
+    if le != 0x3FF:
+      last = ((hi + he, hi + he), (lo, lo + le))
+      he -= 1
+    if hs <= he: yield ((hi + hs, hi + he), (lo, lo + 0x3FF))
+    if last: yield last
+
+
+def _utf8_split(s:int, e:int) -> Optional[Tuple[Tuple[int,int],Tuple[int,int]]]:
+  '''
+  Split the closed interval `s`-`e` in two if its endpoints have different encoded lengths,
+  or if the interval cannot be expressed as a single sequence of byte ranges.
+  '''
+  for boundary in (0x7F, 0x7FF, 0xFFFF):
+    if s <= boundary < e: return ((s, boundary), (boundary+1, e))
+  if e < 0x80: return None
+  for i in range(1, 4):
+    m = (1 << (6*i)) - 1 # Mask of the bits encoded by the trailing `i` continuation bytes.
+    if (s & ~m) != (e & ~m):
+      if (s & m) != 0: return ((s, s | m), ((s | m) + 1, e))
+      if (e & m) != m: return ((s, (e & ~m) - 1), (e & ~m, e))
+  return None
+
+
 def coalesce_sorted_ranges(seq:Iterable[CodeRange]) -> Iterable[CodeRange]:
   it = iter(seq)
   try: low, end = next(it)
@@ -109,7 +183,7 @@ def coalesce_sorted_ranges(seq:Iterable[CodeRange]) -> Iterable[CodeRange]:
 
 
 def union_sorted_ranges(*seqs:Iterable[CodeRange]) -> Iterable[CodeRange]:
-  return coalesce_sorted_ranges(sorted(chain(*seqs)))
+  return coalesce_sorted_ranges(merge(*seqs))
 
 
 def intersect_sorted_ranges(seq_a:Iterable[CodeRange], seq_b:Iterable[CodeRange]) -> Iterable[CodeRange]:
@@ -133,3 +207,85 @@ def intersect_sorted_ranges(seq_a:Iterable[CodeRange], seq_b:Iterable[CodeRange]
         a, ae = (be, ae) # if b is empty it will get dropped on next pass, assuming seq_b is coalesced.
   except StopIteration: return
 
+
+
+def difference_sorted_ranges(seq_a:Iterable[CodeRange], seq_b:Iterable[CodeRange]) -> Iterable[CodeRange]:
+  'Both sequences must be sorted and coalesced.'
+  iter_b = iter(seq_b)
+  end = (unicode_range.stop, unicode_range.stop) # Past every range, so it neither drops nor overlaps any a.
+  b, be = next(iter_b, end)
+  for a, ae in seq_a:
+    while be <= a: # drop b.
+      b, be = next(iter_b, end)
+    s = a
+    while b < ae: # b overlaps the remainder of a.
+      if s < b: yield (s, b)
+      if ae <= be: # b covers the rest of a; keep b, as it may also overlap the next a.
+        s = ae
+        break
+      s = be
+      b, be = next(iter_b, end)
+    if s < ae: yield (s, ae)
+
+
+def symmetric_difference_sorted_ranges(seq_a:Iterable[CodeRange], seq_b:Iterable[CodeRange]) -> Iterable[CodeRange]:
+  'Both sequences must be sorted and coalesced.'
+  a = tuple(seq_a)
+  b = tuple(seq_b)
+  return difference_sorted_ranges(union_sorted_ranges(a, b), intersect_sorted_ranges(a, b))
+
+
+class IntervalSet:
+  '''
+  An immutable set of code points, represented as a tuple of sorted, coalesced, half-open ranges.
+  Set operations are performed by merging range sequences,
+  so their cost is proportional to the number of ranges rather than the number of code points.
+  '''
+
+  def __init__(self, ranges:Iterable[CodeRange]=()) -> None:
+    'Create a set from sorted ranges; ranges may overlap or abut, and are coalesced.'
+    self.ranges:CodeRanges = tuple(coalesce_sorted_ranges(ranges))
+
+  @staticmethod
+  def for_code(code:int) -> 'IntervalSet': return IntervalSet(((code, code+1),))
+
+  @staticmethod
+  def for_codes(codes:Iterable[int]) -> 'IntervalSet': return IntervalSet(ranges_for_codes(sorted(set(codes))))
+
+  def __repr__(self) -> str: return f'{type(self).__name__}({self.ranges!r})'
+
+  def __bool__(self) -> bool: return bool(self.ranges)
+
+  def __len__(self) -> int: return sum(e - s for s, e in self.ranges)
+
+  def __iter__(self) -> Iterator[int]: return iter(codes_for_ranges(self.ranges))
+
+  def __contains__(self, code:Any) -> bool:
+    i = bisect_right(self.ranges, (code, 0x110000))
+    return i > 0 and code < self.ranges[i-1][1]
+
+  def __eq__(self, other:Any) -> bool:
+    if not isinstance(other, IntervalSet): return NotImplemented
+    return self.ranges == other.ranges
+
+  def __hash__(self) -> int: return hash(self.ranges)
+
+  def union(self, other:'IntervalSet') -> 'IntervalSet':
+    return IntervalSet(union_sorted_ranges(self.ranges, other.ranges))
+
+  def intersection(self, other:'IntervalSet') -> 'IntervalSet':
+    return IntervalSet(intersect_sorted_ranges(self.ranges, other.ranges))
+
+  def difference(self, other:'IntervalSet') -> 'IntervalSet':
+    return IntervalSet(difference_sorted_ranges(self.ranges, other.ranges))
+
+  def symmetric_difference(self, other:'IntervalSet') -> 'IntervalSet':
+    return IntervalSet(symmetric_difference_sorted_ranges(self.ranges, other.ranges))
+
+  def isdisjoint(self, other:'IntervalSet') -> bool:
+    return not any(intersect_sorted_ranges(self.ranges, other.ranges))
+
+  __or__ = union
+  __and__ = intersection
+  __sub__ = difference
+  __xor__ = symmetric_difference
@@ -1,6 +1,15 @@
 # Dedicated to the public domain under CC0: https://creativecommons.org/publicdomain/zero/1.0/.
 
-from typing import Dict, Iterator, List, Match, NamedTuple, Optional, Pattern, Tuple
+from array import array
+from base64 import b64decode as _b64decode
+from bisect import bisect_right as _bisect_right
+from json import loads as _json_loads
+from mmap import ACCESS_READ as _ACCESS_READ, mmap as _mmap
+from re import compile as _re_compile, escape as _re_escape
+from struct import Struct as _Struct
+from sys import byteorder as _byteorder
+from zlib import decompress as _zlib_decompress
+from typing import Any, Callable, Counter, Dict, FrozenSet, Iterable, Iterator, List, Literal, Match, NamedTuple, Optional, Pattern, Sequence, Set, Tuple, Type
 
 
 class Token(NamedTuple):
@@ -9,8 +18,13 @@ class Token(NamedTuple):
   end:int
 
 
+_new_tuple = tuple.__new__
+
+
 class Source:
 
+  newline:Any = b'\n'
+
   def __init__(self, name:str, text:bytes) -> None:
     self.name = name
     self.text = text
@@ -26,14 +40,14 @@ class Source:
 
   def get_line_start(self, pos:int) -> int:
     'Return the character index for the start of the line containing `pos`.'
-    return self.text.rfind(b'\n', 0, pos) + 1 # rfind returns -1 for no match, so just add one.
+    return self.text.rfind(self.newline, 0, pos) + 1 # rfind returns -1 for no match, so just add one.
 
   def get_line_end(self, pos:int) -> int:
     '''
     Return the character index for the end of the line containing `pos`;
     a newline is considered the final character of a line.
     '''
-    line_end = self.text.find(b'\n', pos)
+    line_end = self.text.find(self.newline, pos)
     return len(self.text) if line_end == -1 else line_end + 1
 
 
@@ -48,7 +62,7 @@ class Source:
     pos = token.pos
     end = token.end
     line_pos = self.get_line_start(pos)
-    line_idx = self.text.count(b'\n', 0, pos) # number of newlines preceeding pos.
+    line_idx = self.text.count(self.newline, 0, pos) # number of newlines preceeding pos.
     return self.diagnostic_for_pos(pos=pos, end=end, line_pos=line_pos, line_idx=line_idx, msg=msg, show_missing_newline=show_missing_newline)
 
 
@@ -56,11 +70,11 @@ class Source:
     last_pos = len(self.text) - 1
     line_pos:int
     line_idx:int
-    newline_pos = self.text.rfind(b'\n')
+    newline_pos = self.text.rfind(self.newline)
     if newline_pos >= 0:
       if newline_pos == last_pos: # terminating newline.
         line_pos = self.get_line_start(pos=newline_pos)
-        line_idx = self.text.count(b'\n', 0, newline_pos) # number of newlines preceeding newline_pos.
+        line_idx = self.text.count(self.newline, 0, newline_pos) # number of newlines preceeding newline_pos.
       else: # no terminating newline.
         line_pos = newline_pos + 1
         line_idx = len(self.newline_positions)
@@ -185,35 +199,92 @@ class Source:
     return val
 
 
+class StrSource(Source):
+  'A source of `str` text, for `StrLexerBase`; positions are `str` indices rather than byte offsets.'
+
+  newline = '\n'
+
+  def __init__(self, name:str, text:str) -> None: # type: ignore[override]
+    super().__init__(name=name, text=text) # type: ignore[arg-type]
+
+  def get_line_str(self, pos:int, end:int) -> str:
+    assert pos < end, (pos, end)
+    return self.text[pos:end] # type: ignore[return-value]
+
+  def bytes_for(self, token:Token, offset=0) -> bytes:
+    return self.text[token.pos+offset:token.end].encode('utf8') # type: ignore[attr-defined]
+
+
 StateTransitions = Dict[int,Dict[int,int]] # state -> byte -> dst_state.
 MatchStateKinds = Dict[int,str] # state -> token kind.
 ModeData = Tuple[int,StateTransitions,MatchStateKinds] # start_node, state_transitions, match_state_kinds.
 
 KindModeTransitions = Dict[str,Tuple[str,str]]
 ModeTransitions = Dict[str,KindModeTransitions]
+Keywords = Dict[str,Dict[bytes,str]] # General kind -> keyword text -> keyword kind; see `legs.build.extract_keywords`.
+StateTags = Dict[int,Tuple[Tuple[str,str],...]] # state -> (kind, tag name) of each tag set on entering it; see `legs.nfa.gen_dfa`.
+TagLog = List[Tuple[Tuple[Tuple[str,str],...],int]] # (tags, position) for each tagged state entered while matching a token.
 
 
 class LexerBase(Iterator[Token]):
+  '''
+  Lexers are iterators of tokens.
+  For grammars with `@name` tags, lexers that support them (those with `state_tags`) record the tag positions
+  while matching, at the cost of a slower loop; after each token, `tags` maps the tag names of its pattern to their positions.
+  '''
 
   mode_transitions:ModeTransitions
   pattern_descs:Dict[str,str]
+  keywords:Keywords = {} # Tokens of these kinds are reclassified by their text after matching.
+  encoding:str = 'utf-8' # The encoding of the source text; see `legs.code_classes`.
+  state_tags:StateTags = {}
 
   def __init__(self, source:Source) -> None:
     self.source = source
     self.pos = 0
+    self.tags:Dict[str,int] = {}
 
   def __iter__(self) -> Iterator[Token]: return self
 
+  def _set_tags(self, kind:str, end:int, log:TagLog) -> None:
+    '''
+    Set `tags` for a token of `kind` ending at `end` from `log`.
+    The last position of each tag wins, but positions past the end were recorded after the final match, and are ignored.
+    '''
+    tags:Dict[str,int] = {}
+    for state_tags, pos in log:
+      if pos > end: break
+      for tag_kind, name in state_tags:
+        if tag_kind == kind: tags[name] = pos
+    self.tags = tags
+
 
 class DictLexerBase(LexerBase):
 
   mode_data:Dict[str,ModeData]
+  linear_munch = False # If true, use `_next_linear`; see `legs.lint.use_linear_munch`.
 
   def __init__(self, source:Source) -> None:
     self.stack:List[Tuple[str,Optional[str]]] = [('main', None)] # [(mode, pop_kind)].
+    self.failed:Dict[Tuple[int,int],int] = {} # Memo for `_next_linear`.
+    cls = type(self)
+    try:
+      self.loop_matches = cls.__dict__['_loop_matches']
+      self.final_states = cls.__dict__['_final_states']
+    except KeyError:
+      self.loop_matches = { state : compile_run_matcher(byte for byte, dst in byte_dsts.items() if dst == state)
+        for _, transitions, _ in self.mode_data.values()
+        for state, byte_dsts in transitions.items() if state in byte_dsts.values() }
+      # Final states are match states with no transitions; the lexer stops as soon as it reaches one.
+      self.final_states = frozenset(state for _, transitions, match_node_kinds in self.mode_data.values()
+        for state in match_node_kinds if not transitions.get(state))
+      setattr(cls, '_loop_matches', self.loop_matches)
+      setattr(cls, '_final_states', self.final_states)
     super().__init__(source=source)
 
   def __next__(self) -> Token:
+    if self.state_tags: return self._next_tagged()
+    if self.linear_munch: return self._next_linear()
     text = self.source.text
     len_text = len(text)
     pos = self.pos
@@ -222,18 +293,26 @@ class DictLexerBase(LexerBase):
     assert mode in self.mode_data, (mode, list(self.mode_data))
     mode_start, transitions, match_node_kinds = self.mode_data[mode]
 
+    loop_matches = self.loop_matches
+    final_states = self.final_states
+
     state = mode_start
     end = None
     kind = 'incomplete'
     while pos < len_text:
       byte = text[pos]
-      try: state = transitions[state][byte]
+      try: dst = transitions[state][byte]
       except KeyError: break
+      if dst == state: # Self-loop; skip the whole run at once.
+        pos = loop_matches[state](text, pos).end() # type: ignore[union-attr]
       else: # advance.
+        state = dst
         pos += 1
-        try: kind = match_node_kinds[state]
-        except KeyError: pass
-        else: end = pos
+      try: kind = match_node_kinds[state]
+      except KeyError: pass
+      else:
+        end = pos
+        if state in final_states: break
     # Matching stopped or reached end of text.
     token_pos = self.pos
     if end is None: # Never reached a match state.
@@ -241,6 +320,57 @@ class DictLexerBase(LexerBase):
       end = pos
     assert token_pos < end # Token cannot be zero length. TODO: support zero-length tokens?
     self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(text[token_pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    else:
+      try: child_frame = self.mode_transitions[mode][kind]
+      except KeyError: pass
+      else: self.stack.append(child_frame)
+    return Token(pos=token_pos, end=end, kind=kind)
+
+  def _next_tagged(self) -> Token:
+    'As for `__next__`, but also record the positions of tags; see `LexerBase`. Tags take precedence over `linear_munch`.'
+    text = self.source.text
+    len_text = len(text)
+    pos = self.pos
+    if pos == len_text: raise StopIteration
+    mode, pop_kind = self.stack[-1]
+    mode_start, transitions, match_node_kinds = self.mode_data[mode]
+
+    loop_matches = self.loop_matches
+    final_states = self.final_states
+    state_tags = self.state_tags
+
+    state = mode_start
+    log:TagLog = []
+    if state in state_tags: log.append((state_tags[state], pos))
+    end = None
+    kind = 'incomplete'
+    while pos < len_text:
+      byte = text[pos]
+      try: dst = transitions[state][byte]
+      except KeyError: break
+      if dst == state: # Self-loop; skip the whole run at once.
+        pos = loop_matches[state](text, pos).end() # type: ignore[union-attr]
+      else: # advance.
+        state = dst
+        pos += 1
+      if state in state_tags: log.append((state_tags[state], pos))
+      try: kind = match_node_kinds[state]
+      except KeyError: pass
+      else:
+        end = pos
+        if state in final_states: break
+    # Matching stopped or reached end of text.
+    token_pos = self.pos
+    if end is None: # Never reached a match state.
+      assert kind == 'incomplete'
+      end = pos
+    self._set_tags(kind, end, log)
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(text[token_pos:end], kind)
     # Check for mode transition.
     if kind == pop_kind:
       self.stack.pop()
@@ -250,6 +380,797 @@ class DictLexerBase(LexerBase):
       else: self.stack.append(child_frame)
     return Token(pos=token_pos, end=end, kind=kind)
 
+  def _next_linear(self) -> Token:
+    '''
+    Maximal munch in linear time, using the tabulation of Reps, "Maximal-munch tokenization in linear time" (1998).
+    When a scan stops, each (state, position) pair visited since the last match cannot lead to a match;
+    these pairs are recorded in `failed`, along with the position at which the scan stopped.
+    A later scan that reaches a failed pair stops immediately, so no pair is scanned past twice.
+    '''
+    text = self.source.text
+    len_text = len(text)
+    pos = self.pos
+    if pos == len_text: raise StopIteration
+    mode, pop_kind = self.stack[-1]
+    mode_start, transitions, match_node_kinds = self.mode_data[mode]
+    failed = self.failed
+    loop_matches = self.loop_matches
+    final_states = self.final_states
+
+    state = mode_start
+    end = None
+    kind = 'incomplete'
+    stop = None
+    visited:List[Tuple[int,int]] = [] # Pairs visited since the last match.
+    while pos < len_text:
+      byte = text[pos]
+      try: dst = transitions[state][byte]
+      except KeyError: break
+      if dst == state and (end is None or state in match_node_kinds):
+        # Self-loop that cannot be rescanned, because the run is part of this token whatever the outcome;
+        # skip the whole run at once. Other runs are scanned bytewise so that each pair is memoized.
+        pos = loop_matches[state](text, pos).end() # type: ignore[union-attr]
+      else:
+        state = dst
+        pos += 1
+      try: kind = match_node_kinds[state]
+      except KeyError: pass
+      else:
+        end = pos
+        visited.clear()
+        if state in final_states: break
+        continue
+      key = (state, pos)
+      try: stop = failed[key]
+      except KeyError: visited.append(key)
+      else: break # Known to fail; `stop` is where the original scan stopped.
+    # Matching stopped or reached end of text.
+    if stop is None: stop = pos
+    for key in visited: failed[key] = stop
+    token_pos = self.pos
+    if end is None: # Never reached a match state.
+      assert kind == 'incomplete'
+      end = stop
+    assert token_pos < end
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(text[token_pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    else:
+      try: child_frame = self.mode_transitions[mode][kind]
+      except KeyError: pass
+      else: self.stack.append(child_frame)
+    return Token(pos=token_pos, end=end, kind=kind)
+
+
+class LazyModeData:
+  '''
+  Class attribute descriptor for the `mode_data` of generated `DictLexerBase` subclasses.
+  The tables are emitted as compressed arrays (see `legs.python.gen_mode_data_arrays`) rather than dict literals,
+  which are slow for CPython to compile and unmarshal on import;
+  they are decoded the first time that `mode_data` is accessed, and the result then replaces the descriptor.
+  '''
+
+  def __init__(self, mode_starts:Tuple[Tuple[str,int],...], kinds:Tuple[str,...],
+   transitions:Tuple[str,bytes], match_kinds:Tuple[str,bytes]) -> None:
+    self.mode_starts = mode_starts
+    self.kinds = kinds
+    self.transitions = transitions
+    self.match_kinds = match_kinds
+
+  def __set_name__(self, owner:type, name:str) -> None:
+    self.owner = owner
+    self.name = name
+
+  def __get__(self, obj:Any, cls:type) -> Dict[str,ModeData]:
+    mode_data = self.decode()
+    setattr(self.owner, self.name, mode_data)
+    return mode_data
+
+  def decode(self) -> Dict[str,ModeData]:
+    kinds = self.kinds
+    t = decode_array(*self.transitions)
+    m = decode_array(*self.match_kinds)
+    ti = 0
+    mi = 0
+    mode_data:Dict[str,ModeData] = {}
+    for mode, start in self.mode_starts:
+      transitions:StateTransitions = {}
+      node_count = t[ti]; ti += 1
+      for _ in range(node_count):
+        node = t[ti]
+        range_count = t[ti+1]
+        ti += 2
+        byte_dsts:Dict[int,int] = {}
+        for _ in range(range_count):
+          lo, hi, dst = t[ti:ti+3]
+          ti += 3
+          byte_dsts.update(dict.fromkeys(range(lo, hi + 1), dst))
+        transitions[node] = byte_dsts
+      match_count = m[mi]; mi += 1
+      match_node_kinds = { m[i] : kinds[m[i+1]] for i in range(mi, mi + 2 * match_count, 2) }
+      mi += 2 * match_count
+      mode_data[mode] = (start, transitions, match_node_kinds)
+    return mode_data
+
+
+ModeFrame = Tuple[int,KindModeTransitions,Optional[str]] # start_state, kind_transitions, pop_kind.
+
+
+class TableLexerBase(LexerBase):
+  '''
+  Common base for the table-driven lexers, in which states are integers and 0 is the dead state.
+  Match kinds are stored as indices into `kinds`; index 0 means "no match" and also names the `incomplete` kind.
+  Each mode stack frame caches the start state and transitions of its mode, so that per-token overhead is minimal.
+  '''
+
+  kinds:Tuple[str,...]
+  final_kind:int # Kind indices at or above this belong to final states, which have no transitions.
+  mode_starts:Dict[str,int]
+
+  def __init__(self, source:Source) -> None:
+    self.stack:List[ModeFrame] = [self._frame('main', None)]
+    super().__init__(source=source)
+
+  def _frame(self, mode:str, pop_kind:Optional[str]) -> ModeFrame:
+    return (self.mode_starts[mode], self.mode_transitions.get(mode, {}), pop_kind)
+
+
+class ArrayTable(NamedTuple):
+  'The table attributes of an `ArrayLexerBase`, as generated by `legs.tables.gen_flat_table`.'
+  kinds:Tuple[str,...]
+  final_kind:int
+  mode_starts:Dict[str,int]
+  byte_classes:bytes
+  class_count:int
+  table:Sequence[int]
+  loop_classes:Dict[int,bytes]
+  state_tags:StateTags = {}
+
+
+class ArrayLexerBase(TableLexerBase):
+  '''
+  A lexer driven by a single flat transition table, as generated by `legs.tables.gen_flat_table`.
+  Each DFA state is a row of `table`, identified by its offset, with one column per byte class;
+  the final column (at index `class_count`) holds an index into `kinds` for match states, or 0.
+  Row 0 is the dead state, so a transition to 0 means that matching has stopped.
+  The text is translated to byte classes once, up front.
+  If the source is pure ASCII and the class has an `ascii_table` (see `legs.tables.gen_ascii_table`),
+  the lexer instance uses that smaller table instead.
+  '''
+
+  byte_classes:bytes
+  class_count:int
+  table:Sequence[int]
+  loop_classes:Dict[int,bytes] # For each self-looping state, the byte classes on which it transitions to itself.
+  ascii_table:Optional[ArrayTable] = None
+
+  def __init__(self, source:Source) -> None:
+    cls = type(self)
+    ascii_table = self.ascii_table
+    if ascii_table is not None and source.text.isascii():
+      (self.kinds, self.final_kind, self.mode_starts, self.byte_classes, self.class_count, self.table, loop_classes,
+        self.state_tags) = ascii_table
+      loop_matches_attr = '_ascii_loop_matches'
+    else:
+      loop_classes = self.loop_classes
+      loop_matches_attr = '_loop_matches'
+    self.text:Any = source.text # Sliced by token positions for keyword lookup.
+    self.classes = self._translate(source.text)
+    try: self.loop_matches = cls.__dict__[loop_matches_attr]
+    except KeyError:
+      self.loop_matches = { state : compile_run_matcher(c) for state, c in loop_classes.items() }
+      setattr(cls, loop_matches_attr, self.loop_matches)
+    super().__init__(source=source)
+
+  def _translate(self, text:bytes) -> bytes:
+    'Translate `text` to byte classes.'
+    return text.translate(self.byte_classes)
+
+  def __next__(self) -> Token:
+    if self.state_tags: return self._next_tagged()
+    classes = self.classes
+    len_text = len(classes)
+    token_pos = pos = self.pos
+    if pos == len_text: raise StopIteration
+    state, kind_transitions, pop_kind = self.stack[-1]
+    table = self.table
+    kind_col = self.class_count
+    loop_matches = self.loop_matches
+    final_kind = self.final_kind
+    kind_idx = 0
+    end = 0
+    while pos < len_text:
+      dst = table[state + classes[pos]]
+      if dst == state: # Self-loop; skip the whole run at once.
+        pos = loop_matches[state](classes, pos).end() # type: ignore[union-attr]
+      else:
+        if not dst: break
+        state = dst
+        pos += 1
+      k = table[state + kind_col]
+      if k:
+        kind_idx = k
+        end = pos
+        if k >= final_kind: break # Final; no need to read another byte.
+    # Matching stopped or reached end of text.
+    if not kind_idx: end = pos # Never reached a match state; incomplete.
+    kind = self.kinds[kind_idx]
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(self.text[token_pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    elif kind in kind_transitions:
+      self.stack.append(self._frame(*kind_transitions[kind]))
+    return _new_tuple(Token, (kind, token_pos, end)) # Faster than calling the NamedTuple constructor.
+
+  def _next_tagged(self) -> Token:
+    'As for `__next__`, but also record the positions of tags; see `LexerBase`.'
+    classes = self.classes
+    len_text = len(classes)
+    token_pos = pos = self.pos
+    if pos == len_text: raise StopIteration
+    state, kind_transitions, pop_kind = self.stack[-1]
+    table = self.table
+    kind_col = self.class_count
+    loop_matches = self.loop_matches
+    final_kind = self.final_kind
+    state_tags = self.state_tags
+    log:TagLog = []
+    if state in state_tags: log.append((state_tags[state], pos))
+    kind_idx = 0
+    end = 0
+    while pos < len_text:
+      dst = table[state + classes[pos]]
+      if dst == state: # Self-loop; skip the whole run at once.
+        pos = loop_matches[state](classes, pos).end() # type: ignore[union-attr]
+      else:
+        if not dst: break
+        state = dst
+        pos += 1
+      if state in state_tags: log.append((state_tags[state], pos))
+      k = table[state + kind_col]
+      if k:
+        kind_idx = k
+        end = pos
+        if k >= final_kind: break # Final; no need to read another byte.
+    # Matching stopped or reached end of text.
+    if not kind_idx: end = pos # Never reached a match state; incomplete.
+    kind = self.kinds[kind_idx]
+    self._set_tags(kind, end, log)
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(self.text[token_pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    elif kind in kind_transitions:
+      self.stack.append(self._frame(*kind_transitions[kind]))
+    return _new_tuple(Token, (kind, token_pos, end))
+
+
+class _CodeClassMap(dict):
+  'A `str.translate` table from code points to classes, computed on demand from the intervals of a `StrLexerBase`.'
+
+  def __init__(self, bounds:Sequence[int], classes:bytes) -> None:
+    super().__init__()
+    self.bounds = bounds
+    self.classes = classes
+
+  def __missing__(self, code:int) -> int:
+    c = self[code] = self.classes[_bisect_right(self.bounds, code) - 1]
+    return c
+
+
+class StrLexerBase(ArrayLexerBase):
+  '''
+  A flat table lexer over the code points of `str` text (see `StrSource`), as generated by `legs.code_classes`.
+  Token positions are `str` indices, and no UTF-8 encoding is required.
+  Code points are translated to classes through `code_bounds`, the ascending start code points of intervals,
+  and `code_classes`, the class of each interval; `byte_classes` holds the classes of the first 256 code points,
+  so that Latin-1 text is translated in a single pass. Keyword texts are `str`.
+  '''
+
+  code_bounds:Sequence[int]
+  code_classes:bytes
+
+  def __init__(self, source:StrSource) -> None: # type: ignore[override]
+    super().__init__(source=source)
+
+  def _translate(self, text:str) -> bytes: # type: ignore[override]
+    try: return text.encode('latin1').translate(self.byte_classes)
+    except UnicodeEncodeError: pass
+    cls = type(self)
+    try: class_map = cls.__dict__['_class_map']
+    except KeyError:
+      class_map = _CodeClassMap(self.code_bounds, self.code_classes)
+      setattr(cls, '_class_map', class_map)
+    return text.translate(class_map).encode('latin1')
+
+
+_uint32_typecode:Literal['I','L'] = 'I' if array('I').itemsize == 4 else 'L'
+
+
+class _UnitText:
+  'Slices UTF-16 or UTF-32 text by unit positions rather than byte offsets, for keyword lookup in `UnitLexerBase`.'
+
+  def __init__(self, data:bytes, unit_size:int) -> None:
+    self.data = data
+    self.unit_size = unit_size
+
+  def __getitem__(self, s:slice) -> bytes:
+    return self.data[s.start * self.unit_size:s.stop * self.unit_size]
+
+
+class UnitLexerBase(ArrayLexerBase):
+  '''
+  A flat table lexer over UTF-16 or UTF-32 text (`encoding` is one of 'utf-16-le', 'utf-16-be', 'utf-32-le', 'utf-32-be'),
+  as generated by `legs.code_classes`.
+  Token positions are unit indices. Text in native byte order is viewed as units in place rather than transcoded;
+  units are translated to classes through `code_bounds`, the ascending start units of intervals,
+  and `code_classes`, the class of each interval. Keyword texts are encoded in `encoding`.
+  For UTF-16, the automata match surrogate pairs, so an unpaired surrogate is `invalid` or `incomplete`.
+  '''
+
+  encoding:str
+  code_bounds:Sequence[int]
+  code_classes:bytes
+
+  def __init__(self, source:Source) -> None:
+    self.unit_size = 2 if self.encoding.startswith('utf-16') else 4
+    super().__init__(source=source)
+    self.text = _UnitText(source.text, self.unit_size)
+
+  def _translate(self, text:bytes) -> bytes:
+    if len(text) % self.unit_size: raise ValueError(f'{self.encoding} text has a trailing partial unit.')
+    typecode:Literal['H','I','L'] = 'H' if self.unit_size == 2 else _uint32_typecode
+    units:Sequence[int]
+    if self.encoding.endswith(_byteorder[0] + 'e'): units = memoryview(text).cast(typecode)
+    else: # Copy and swap.
+      swapped = array(typecode)
+      swapped.frombytes(text)
+      swapped.byteswap()
+      units = swapped
+    cls = type(self)
+    try: class_map = cls.__dict__['_class_map']
+    except KeyError:
+      class_map = _CodeClassMap(self.code_bounds, self.code_classes)
+      setattr(cls, '_class_map', class_map)
+    return bytes(map(class_map.__getitem__, units))
+
+
+class StrideLexerBase(ArrayLexerBase):
+  '''
+  A flat table lexer that also steps over two bytes at a time, as generated by `legs.tables.gen_stride_table`.
+  The hot states with two-byte transitions come first in `table`, below `pair_limit`;
+  `pair_rows` maps each of them to the offset of its row of `pair_table`,
+  with one column per pair of byte classes (first class times `class_count` plus second class).
+  Each entry is the state reached after both bytes, or 0 if the pair cannot be taken in one step:
+  because the intermediate state matches (and so must record the token end), loops on itself, or stops,
+  or because the second byte stops matching. Such steps, and the remaining states, fall back to single bytes.
+  Pairs are read as native 16-bit words, through views of the text at both even and odd alignments.
+  '''
+
+  pair_limit:int
+  pair_rows:Dict[int,int]
+  pair_table:Sequence[int]
+
+  def __init__(self, source:Source) -> None:
+    cls = type(self)
+    try:
+      self.pair_bases = cls.__dict__['_pair_bases']
+      self.pair_classes = cls.__dict__['_pair_classes']
+    except KeyError:
+      # Pair row offsets indexed by state.
+      pair_bases = array('I', bytes(4 * self.pair_limit))
+      for state, offset in self.pair_rows.items(): pair_bases[state] = offset
+      self.pair_bases = pair_bases
+      # Pair class for every native 16-bit word.
+      classes = self.byte_classes
+      n = self.class_count
+      if _byteorder == 'little': pairs = (classes[lo] * n + classes[hi] for hi in range(0x100) for lo in range(0x100))
+      else: pairs = (classes[hi] * n + classes[lo] for hi in range(0x100) for lo in range(0x100))
+      self.pair_classes = array('H', pairs) # At most 256 * 256 pair classes.
+      setattr(cls, '_pair_bases', self.pair_bases)
+      setattr(cls, '_pair_classes', self.pair_classes)
+    text = source.text
+    even = array('H')
+    even.frombytes(text[:len(text) & ~1])
+    odd = array('H')
+    odd.frombytes(text[1:1 + ((len(text) - 1) & ~1)])
+    self.words = (even, odd)
+    super().__init__(source=source)
+
+  def __next__(self) -> Token:
+    classes = self.classes
+    len_text = len(classes)
+    token_pos = pos = self.pos
+    if pos == len_text: raise StopIteration
+    state, kind_transitions, pop_kind = self.stack[-1]
+    table = self.table
+    kind_col = self.class_count
+    loop_matches = self.loop_matches
+    final_kind = self.final_kind
+    pair_limit = self.pair_limit
+    pair_bases = self.pair_bases
+    pair_classes = self.pair_classes
+    pair_table = self.pair_table
+    words = self.words
+    last = len_text - 1
+    kind_idx = 0
+    end = 0
+    while pos < len_text:
+      if state < pair_limit and pos < last:
+        dst = pair_table[pair_bases[state] + pair_classes[words[pos & 1][pos >> 1]]]
+        if dst: # Two bytes at once.
+          state = dst
+          pos += 2
+          k = table[state + kind_col]
+          if k:
+            kind_idx = k
+            end = pos
+            if k >= final_kind: break # Final; no need to read another byte.
+          continue
+      dst = table[state + classes[pos]]
+      if dst == state: # Self-loop; skip the whole run at once.
+        pos = loop_matches[state](classes, pos).end() # type: ignore[union-attr]
+      else:
+        if not dst: break
+        state = dst
+        pos += 1
+      k = table[state + kind_col]
+      if k:
+        kind_idx = k
+        end = pos
+        if k >= final_kind: break # Final; no need to read another byte.
+    # Matching stopped or reached end of text.
+    if not kind_idx: end = pos # Never reached a match state; incomplete.
+    kind = self.kinds[kind_idx]
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(self.text[token_pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    elif kind in kind_transitions:
+      self.stack.append(self._frame(*kind_transitions[kind]))
+    return _new_tuple(Token, (kind, token_pos, end)) # Faster than calling the NamedTuple constructor.
+
+
+class HybridMode(NamedTuple):
+  'The regex fast path for one mode of a `HybridLexerBase`, as generated by `legs.hybrid.gen_hybrid_modes`.'
+  regex:bytes # One group per kind.
+  kinds:Tuple[str,...] # The kind of each group.
+  continuations:Tuple[bytes,...] # For each group, the bytes on which the DFA might extend a match of that kind.
+  literals:Tuple[Dict[bytes,str],...] # For each group, the texts that the DFA resolves to a different kind.
+
+
+class HybridLexerBase(ArrayLexerBase):
+  '''
+  A flat table lexer that first tries an anchored match of a combined regex for the current mode at each token.
+  The regex match is used if the DFA is certain to produce the same token; otherwise the DFA runs from the token start.
+  See `legs.hybrid` for the conditions, and why they are exact.
+  '''
+
+  hybrid_modes:Dict[str,HybridMode]
+
+  def __init__(self, source:Source) -> None:
+    super().__init__(source=source)
+    cls = type(self)
+    try: matchers = cls.__dict__['_hybrid_matchers']
+    except KeyError:
+      # For each mode, the regex `match` method, and for each group (from 1) the kind, stop bytes and literal texts.
+      matchers = {}
+      for mode, h in self.hybrid_modes.items():
+        groups:List[Any] = [None]
+        for kind, continuations, literals in zip(h.kinds, h.continuations, h.literals):
+          stops = bytes(byte not in continuations for byte in range(0x100))
+          groups.append((kind, stops, literals))
+        matchers[mode] = (_re_compile(h.regex).match, tuple(groups))
+      setattr(cls, '_hybrid_matchers', matchers)
+    # Frames identify modes by start state, which differs between the full and ASCII tables.
+    self.state_matchers = { self.mode_starts[mode] : m for mode, m in matchers.items() }
+
+  def __next__(self) -> Token:
+    text = self.text
+    pos = self.pos
+    state, kind_transitions, pop_kind = self.stack[-1]
+    match, groups = self.state_matchers[state]
+    m = match(text, pos)
+    if m is None: return super().__next__()
+    kind, stops, literals = groups[m.lastindex]
+    end = m.end()
+    if end < len(text) and not stops[text[end]]: return super().__next__() # The DFA might extend the match.
+    if literals: kind = literals.get(text[pos:end], kind)
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(text[pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    elif kind in kind_transitions:
+      self.stack.append(self._frame(*kind_transitions[kind]))
+    return _new_tuple(Token, (kind, pos, end)) # Faster than calling the NamedTuple constructor.
+
+
+class SparseLexerBase(TableLexerBase):
+  '''
+  A lexer whose states are stored individually, as generated by `legs.tables.gen_sparse_table`.
+  States with few distinct byte ranges are stored as sorted range start bytes in `state_bounds`
+  and the corresponding destinations in `state_dsts`, looked up with `bisect`;
+  the remaining states are stored as dense 256-entry rows in `state_rows` (None for sparse states).
+  `state_kinds` holds the index into `kinds` for each state, or 0.
+  '''
+
+  state_bounds:Sequence[Sequence[int]]
+  state_dsts:Sequence[Sequence[int]]
+  state_kinds:Sequence[int]
+  state_rows:Sequence[Optional[Sequence[int]]]
+
+  def __next__(self) -> Token:
+    text = self.source.text
+    len_text = len(text)
+    token_pos = pos = self.pos
+    if pos == len_text: raise StopIteration
+    state, kind_transitions, pop_kind = self.stack[-1]
+    state_bounds = self.state_bounds
+    state_dsts = self.state_dsts
+    state_kinds = self.state_kinds
+    state_rows = self.state_rows
+    final_kind = self.final_kind
+    kind_idx = 0
+    end = 0
+    while pos < len_text:
+      row = state_rows[state]
+      if row is None:
+        state = state_dsts[state][_bisect_right(state_bounds[state], text[pos]) - 1]
+      else:
+        state = row[text[pos]]
+      if not state: break
+      pos += 1
+      k = state_kinds[state]
+      if k:
+        kind_idx = k
+        end = pos
+        if k >= final_kind: break # Final; no need to read another byte.
+    # Matching stopped or reached end of text.
+    if not kind_idx: end = pos # Never reached a match state; incomplete.
+    kind = self.kinds[kind_idx]
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(text[token_pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    elif kind in kind_transitions:
+      self.stack.append(self._frame(*kind_transitions[kind]))
+    return _new_tuple(Token, (kind, token_pos, end)) # Faster than calling the NamedTuple constructor.
+
+
+class CombLexerBase(TableLexerBase):
+  '''
+  A lexer driven by a row-displacement ("comb vector") table, as generated by `legs.tables.gen_comb_table`.
+  The entry for state `s` and byte class `c` is `comb_next[comb_base[s] + c]` if `comb_check[comb_base[s] + c] == s`;
+  otherwise it is the entry for the same class in the template state `comb_default[s]`,
+  or dead if `s` has no template. Templates never have templates themselves, so each lookup is constant time.
+  `state_kinds` holds the index into `kinds` for each state, or 0.
+  '''
+
+  byte_classes:bytes
+  comb_base:Sequence[int]
+  comb_check:Sequence[int]
+  comb_default:Sequence[int]
+  comb_next:Sequence[int]
+  state_kinds:Sequence[int]
+
+  def __init__(self, source:Source) -> None:
+    self.classes = source.text.translate(self.byte_classes)
+    super().__init__(source=source)
+
+  def __next__(self) -> Token:
+    classes = self.classes
+    len_text = len(classes)
+    token_pos = pos = self.pos
+    if pos == len_text: raise StopIteration
+    state, kind_transitions, pop_kind = self.stack[-1]
+    base = self.comb_base
+    check = self.comb_check
+    default = self.comb_default
+    next_ = self.comb_next
+    state_kinds = self.state_kinds
+    final_kind = self.final_kind
+    kind_idx = 0
+    end = 0
+    while pos < len_text:
+      c = classes[pos]
+      i = base[state] + c
+      if check[i] == state:
+        state = next_[i]
+      else:
+        template = default[state]
+        if not template: break
+        i = base[template] + c
+        state = next_[i] if check[i] == template else 0
+      if not state: break
+      pos += 1
+      k = state_kinds[state]
+      if k:
+        kind_idx = k
+        end = pos
+        if k >= final_kind: break # Final; no need to read another byte.
+    # Matching stopped or reached end of text.
+    if not kind_idx: end = pos # Never reached a match state; incomplete.
+    kind = self.kinds[kind_idx]
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(self.source.text[token_pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    elif kind in kind_transitions:
+      self.stack.append(self._frame(*kind_transitions[kind]))
+    return _new_tuple(Token, (kind, token_pos, end)) # Faster than calling the NamedTuple constructor.
+
+
+class CodeLexerBase(LexerBase):
+  '''
+  Base for lexers generated as straight-line code.
+  `lex` is a generator function for the main mode, which takes the text, starting position, and pop kind;
+  each mode's generator delegates to the generators of its child modes.
+  Iterating over the lexer returns the generator itself, avoiding a method call per token;
+  consequently `pos` is not updated as tokens are produced.
+  '''
+
+  lex:Callable[[bytes,int,Optional[str]],Iterator[Token]]
+
+  def __init__(self, source:Source) -> None:
+    super().__init__(source=source)
+    self.tokens = self.lex(source.text, 0, None)
+
+  def __iter__(self) -> Iterator[Token]: return self.tokens
+
+  def __next__(self) -> Token: return next(self.tokens)
+
+
+class LazyDFA:
+  '''
+  A DFA that is determinized on demand from a compact NFA, as generated by `legs.lazy.gen_lazy_nfa`.
+  Each discovered DFA state (a set of NFA nodes) is assigned an integer id,
+  with a row of 256 destination ids that are filled in as bytes are encountered (-1 means not yet computed).
+  State 0 is dead. When `max_states` is reached, the cache is cleared and rebuilt from scratch.
+  The lists are cleared in place, so that callers can hold references to them across a clear.
+  '''
+
+  def __init__(self, mode_starts:Dict[str,int], node_kinds:Sequence[int],
+   node_ranges:Sequence[Sequence[Tuple[int,int,Tuple[int,...]]]], max_states:int, final_kind:int) -> None:
+    if max_states <= len(mode_starts) + 1: raise ValueError(f'max_states is too small: {max_states}')
+    self.mode_starts = mode_starts
+    self.final_kind = final_kind # Added to the kinds of final states, which have no transitions.
+    self.node_kinds = node_kinds
+    self.node_ranges = node_ranges
+    self.max_states = max_states
+    self.state_ids:Dict[FrozenSet[int],int] = {}
+    self.state_nodes:List[FrozenSet[int]] = []
+    self.state_kinds:List[int] = []
+    self.state_rows:List[array] = []
+    self.start_states:Dict[str,int] = {} # Start state for each mode.
+    self.clear_count = 0
+    self.clear()
+
+  def clear(self) -> None:
+    self.state_ids.clear()
+    del self.state_nodes[:]
+    del self.state_kinds[:]
+    del self.state_rows[:]
+    self.intern(frozenset()) # Dead state.
+    for mode, node in self.mode_starts.items():
+      self.start_states[mode] = self.intern(frozenset({node}))
+
+  def intern(self, nodes:FrozenSet[int]) -> int:
+    try: return self.state_ids[nodes]
+    except KeyError: pass
+    if len(self.state_nodes) >= self.max_states:
+      self.clear_count += 1
+      self.clear()
+    state = len(self.state_nodes)
+    self.state_ids[nodes] = state
+    self.state_nodes.append(nodes)
+    kind = self.resolve_kind(nodes)
+    if kind and not any(self.node_ranges[n] for n in nodes): kind += self.final_kind
+    self.state_kinds.append(kind)
+    self.state_rows.append(array('i', _unknown_row))
+    return state
+
+  def resolve_kind(self, nodes:FrozenSet[int]) -> int:
+    'Choose the kind for a state; kinds are numbered in order of precedence (see `legs.lazy`), so the minimum is preferred.'
+    node_kinds = self.node_kinds
+    return min((node_kinds[n] for n in nodes if node_kinds[n]), default=0)
+
+  def step(self, state:int, byte:int) -> int:
+    'Compute, cache and return the destination of `state` for `byte`.'
+    dsts:Set[int] = set()
+    node_ranges = self.node_ranges
+    for node in self.state_nodes[state]:
+      for lo, hi, nodes in node_ranges[node]:
+        if byte < lo: break
+        if byte <= hi:
+          dsts.update(nodes)
+          break
+    if not dsts: dst = 0
+    else:
+      clear_count = self.clear_count
+      dst = self.intern(frozenset(dsts))
+      if self.clear_count != clear_count: return dst # `state` was evicted.
+    self.state_rows[state][byte] = dst
+    return dst
+
+
+_unknown_row = [-1] * 0x100
+
+
+class LazyLexerBase(LexerBase):
+  '''
+  A lexer that determinizes its NFA lazily while lexing, as generated by the `python-lazy` backend.
+  The DFA state cache is shared by all instances of a lexer class and bounded by `max_states`.
+  '''
+
+  kinds:Tuple[str,...]
+  max_states:int = 4096
+  mode_starts:Dict[str,int] # NFA start node for each mode.
+  node_kinds:Sequence[int]
+  node_ranges:Sequence[Sequence[Tuple[int,int,Tuple[int,...]]]]
+
+  @classmethod
+  def lazy_dfa(cls) -> LazyDFA:
+    try: return cls.__dict__['_lazy_dfa']
+    except KeyError: pass
+    dfa = LazyDFA(mode_starts=cls.mode_starts, node_kinds=cls.node_kinds, node_ranges=cls.node_ranges,
+      max_states=cls.max_states, final_kind=len(cls.kinds))
+    setattr(cls, '_lazy_dfa', dfa)
+    return dfa
+
+  def __init__(self, source:Source) -> None:
+    self.stack:List[Tuple[str,KindModeTransitions,Optional[str]]] = [('main', self.mode_transitions.get('main', {}), None)]
+    self.dfa = self.lazy_dfa()
+    super().__init__(source=source)
+
+  def __next__(self) -> Token:
+    text = self.source.text
+    len_text = len(text)
+    token_pos = pos = self.pos
+    if pos == len_text: raise StopIteration
+    mode, kind_transitions, pop_kind = self.stack[-1]
+    dfa = self.dfa
+    state_rows = dfa.state_rows
+    state_kinds = dfa.state_kinds
+    final_kind = dfa.final_kind
+    state = dfa.start_states[mode]
+    kind_idx = 0
+    end = 0
+    while pos < len_text:
+      byte = text[pos]
+      dst = state_rows[state][byte]
+      if dst < 0: dst = dfa.step(state, byte)
+      state = dst
+      if not state: break
+      pos += 1
+      k = state_kinds[state]
+      if k:
+        kind_idx = k
+        end = pos
+        if k >= final_kind: # Final; no need to read another byte.
+          kind_idx -= final_kind
+          break
+    # Matching stopped or reached end of text.
+    if not kind_idx: end = pos # Never reached a match state; incomplete.
+    kind = self.kinds[kind_idx]
+    self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(text[token_pos:end], kind)
+    # Check for mode transition.
+    if kind == pop_kind:
+      self.stack.pop()
+    elif kind in kind_transitions:
+      child_mode, child_pop_kind = kind_transitions[kind]
+      self.stack.append((child_mode, self.mode_transitions.get(child_mode, {}), child_pop_kind))
+    return _new_tuple(Token, (kind, token_pos, end)) # Faster than calling the NamedTuple constructor.
+
 
 class RegexLexerBase(LexerBase):
 
@@ -283,6 +1204,7 @@ class RegexLexerBase(LexerBase):
     kind = m.lastgroup
     assert pos < end, (kind, m)
     self.pos = end # Advance lexer state.
+    if kind in self.keywords: kind = self.keywords[kind].get(text[pos:end], kind)
     # Check for mode transition.
     if kind == pop_kind:
       self.stack.pop()
@@ -293,6 +1215,100 @@ class RegexLexerBase(LexerBase):
     return Token(pos=pos, end=end, kind=kind)
 
 
+def compile_run_matcher(byte_set:Iterable[int]) -> Callable[[bytes,int],Optional[Match[bytes]]]:
+  '''
+  Return the `match` method of a compiled pattern that matches a run of the bytes in `byte_set`.
+  The lexers use these to skip over runs of self-looping states in a single call.
+  '''
+  ranges:List[List[int]] = []
+  for byte in sorted(byte_set):
+    if ranges and ranges[-1][1] == byte - 1: ranges[-1][1] = byte
+    else: ranges.append([byte, byte])
+  def esc(byte:int) -> bytes: return _re_escape(bytes((byte,)))
+  byte_class = b''.join(esc(lo) if lo == hi else esc(lo) + b'-' + esc(hi) for lo, hi in ranges)
+  return _re_compile(b'[' + byte_class + b']*').match
+
+
+def decode_array(typecode:str, data:bytes) -> array:
+  'Decode an array of little-endian integers from zlib-compressed, base64 `data`, as emitted in generated lexers.'
+  a = array(typecode)
+  a.frombytes(_zlib_decompress(_b64decode(data)))
+  if _byteorder == 'big': a.byteswap()
+  return a
+
+
+legsdfa_magic = b'LEGSDFA\0'
+legsdfa_version = 6
+legsdfa_header = _Struct('<8s8I') # See `legs.legsdfa` for the layout.
+
+
+def load_legsdfa(path:str, name:str='') -> Type[ArrayLexerBase]:
+  '''
+  Load a `.legsdfa` artifact and return a new lexer class named `{name}Lexer`.
+  The file is mapped read-only, and on little-endian hosts the transition table is used directly from the mapping,
+  so that processes loading the same artifact share its pages.
+  '''
+  with open(path, 'rb') as f:
+    data = memoryview(_mmap(f.fileno(), 0, access=_ACCESS_READ))
+  if len(data) < legsdfa_header.size: raise ValueError(f'{path}: truncated legsdfa header.')
+  magic, version, entry_size, class_count, classes_offset, table_offset, table_len, meta_offset, meta_len = \
+    legsdfa_header.unpack_from(data)
+  if magic != legsdfa_magic: raise ValueError(f'{path}: not a legsdfa file.')
+  if version != legsdfa_version: raise ValueError(f'{path}: unsupported legsdfa version: {version}.')
+  if meta_offset + meta_len > len(data): raise ValueError(f'{path}: truncated legsdfa file.')
+  typecode:Literal['H','I'] = 'H' if entry_size == 2 else 'I'
+  table_bytes = data[table_offset:table_offset + table_len * entry_size]
+  table:Sequence[int]
+  if _byteorder == 'little': table = table_bytes.cast(typecode)
+  else: # Copy and swap.
+    table = array(typecode, bytes(table_bytes))
+    table.byteswap()
+  meta = _json_loads(bytes(data[meta_offset:meta_offset + meta_len]))
+  attrs = dict(
+    byte_classes=bytes(data[classes_offset:classes_offset + 0x100]),
+    class_count=class_count,
+    kinds=tuple(meta['kinds']),
+    final_kind=meta['final_kind'],
+    loop_classes={ int(offset) : bytes(classes) for offset, classes in meta['loop_classes'].items() },
+    mode_starts=meta['mode_starts'],
+    mode_transitions={ mode : { kind : tuple(frame) for kind, frame in kind_transitions.items() }
+      for mode, kind_transitions in meta['mode_transitions'].items() },
+    keywords={ general : { text.encode('latin1') : kind for text, kind in texts.items() }
+      for general, texts in meta['keywords'].items() },
+    pattern_descs=meta['pattern_descs'],
+    encoding=meta['encoding'],
+    state_tags={ int(offset) : tuple((kind, name) for kind, name in tags) for offset, tags in meta['state_tags'].items() },
+    table=table)
+  return type(f'{name}Lexer', (ArrayLexerBase,), attrs)
+
+
+def count_state_visits(LexerClass:Type[DictLexerBase], source:Source, counts:Optional[Counter[int]]=None) -> Counter[int]:
+  '''
+  Lex `source` with `LexerClass`, counting the visits made to each DFA state.
+  Bytes that are scanned past the end of a token and then rescanned are counted each time they are visited.
+  Counts accumulate into `counts` if it is provided, so that a whole corpus can be profiled.
+  The resulting counts can be saved as JSON and rolled up into a per-pattern report with `legs -heat`.
+  '''
+  if counts is None: counts = Counter()
+  text = source.text
+  len_text = len(text)
+  lexer = LexerClass(source=source)
+  while True:
+    pos = lexer.pos
+    mode = lexer.stack[-1][0]
+    try: next(lexer)
+    except StopIteration: break
+    # Replay the scan for the token just lexed, counting every state entered.
+    state, transitions, _ = lexer.mode_data[mode]
+    counts[state] += 1
+    while pos < len_text:
+      try: state = transitions[state][text[pos]]
+      except KeyError: break
+      counts[state] += 1
+      pos += 1
+  return counts
+
+
 def ploy_repr(string: str) -> str:
   r = ["'"]
   for char in string:
@@ -311,20 +1327,43 @@ def ploy_repr(string: str) -> str:
 # Legs testing.
 
 
-def test_main(LexerClass) -> None:
-  from sys import argv
-  for index, arg in enumerate(argv):
-    if index == 0: continue
+def test_main(LexerClass, args:Optional[Sequence[str]]=None) -> None:
+  if args is None:
+    from sys import argv
+    args = argv[1:]
+  for index, arg in enumerate(args, 1):
     name = f'arg{index}'
     print(f'\n{name}: {ploy_repr(arg)}')
-    source = Source(name=name, text=arg.encode('utf8'))
-    for token in LexerClass(source=source):
+    source:Source
+    lexer:LexerBase
+    if issubclass(LexerClass, StrLexerBase):
+      source = StrSource(name=name, text=arg)
+      lexer = LexerClass(source=source)
+    elif LexerClass.encoding == 'utf-8':
+      source = Source(name=name, text=arg.encode('utf8'))
+      lexer = LexerClass(source=source)
+    else:
+      # Positions are units of the encoding; diagnose them against the `str`,
+      # which is exact for single-byte encodings, and for UTF-16 in the Basic Multilingual Plane.
+      lexer = LexerClass(source=Source(name=name, text=arg.encode(LexerClass.encoding)))
+      source = StrSource(name=name, text=arg)
+    for token in lexer:
       kind_desc = LexerClass.pattern_descs[token.kind]
-      msg = test_desc(source=source, token=token, kind_desc=kind_desc)
+      msg = test_desc(source=source, token=token, kind_desc=kind_desc, tags=lexer.tags)
       print(source.diagnostic_for_token(token, msg=msg, show_missing_newline=False), end='')
 
 
-def test_desc(source:Source, token:Token, kind_desc:str) -> str:
+def test_desc(source:Source, token:Token, kind_desc:str, tags:Optional[Dict[str,int]]=None) -> str:
+  '''
+  Describe `token` for `test_main`: numeric kinds are described with their values, and tags with their offsets in the token.
+  If the lexer recorded a `digits` tag, the digits start there, rather than after a conventional prefix.
+  '''
+  if tags is None: tags = {}
+  desc = test_value_desc(source, token, kind_desc, tags)
+  return desc + ''.join(f' @{name}:{pos - token.pos}' for name, pos in sorted(tags.items(), key=lambda p: (p[1], p[0])))
+
+
+def test_value_desc(source:Source, token:Token, kind_desc:str, tags:Dict[str,int]) -> str:
   off = 2 # "0_" prefix is the common case.
   base:Optional[int]
   if token.kind == 'num':     base = 10; off = 0
@@ -336,5 +1375,16 @@ def test_desc(source:Source, token:Token, kind_desc:str) -> str:
   else: base = None
 
   if base is None: return kind_desc
+  if 'digits' in tags: off = tags['digits'] - token.pos
   val = source.parse_digits(token=token, offset=off, base=base)
   return f'{kind_desc}: {val}'
+
+
+def legsdfa_test_main() -> None:
+  'Run `test_main` for the `.legsdfa` artifact named by the first argument; used by `legs -test`.'
+  from sys import argv
+  if len(argv) < 2: exit('usage: python3 -m legs_base [path.legsdfa] [test strings...]')
+  test_main(load_legsdfa(argv[1]), args=argv[2:])
+
+
+if __name__ == '__main__': legsdfa_test_main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+
+from tempfile import TemporaryDirectory
+
+from utest import *
+from legs import LegsError, compile
+from legs_base import Source
+
+
+grammar = '''
+num: $Dec+
+word: $Ascii_Letter+
+space: \s+
+'''
+
+def lex(lexer_class, text:str):
+  return [(t.kind, t.pos, t.end) for t in lexer_class(Source(name='test', text=text.encode()))]
+
+with TemporaryDirectory() as cache_dir:
+  Lexer = compile(grammar, name='Test', cache_dir=cache_dir)
+  utest('TestLexer', lambda: Lexer.__name__)
+  utest_seq([('word', 0, 2), ('space', 2, 3), ('num', 3, 5), ('invalid', 5, 6)], lex, Lexer, 'ab 12!')
+  # Memoized in-process, and on disk.
+  utest(Lexer.table, lambda: compile(grammar, cache_dir=cache_dir).table)
+  utest(Lexer.table, lambda: compile(grammar, cache_dir=cache_dir, disk_cache=False).table)
+
+  # Pure ASCII sources use the smaller ASCII projection of the table; others use the full table.
+  Unicode = compile('word: $Letter+\nspace: \\s+\n', name='Unicode', cache_dir=cache_dir)
+  utest(True, lambda: len(Unicode.ascii_table.table) < len(Unicode.table))
+  utest_seq([('word', 0, 2), ('space', 2, 3), ('word', 3, 5)], lex, Unicode, 'ab cd')
+  utest_seq([('word', 0, 3), ('space', 3, 4), ('word', 4, 6)], lex, Unicode, 'aé cd')
+
+  # Single-byte encodings lex the encoded bytes directly, so positions are character indices.
+  Latin1 = compile('word: $Letter+\nspace: \\s+\n', name='Latin1', encoding='latin_1', cache_dir=cache_dir)
+  utest('iso8859-1', lambda: Latin1.encoding)
+  utest_seq([('word', 0, 2), ('space', 2, 3), ('word', 3, 5)], lambda: [(t.kind, t.pos, t.end)
+    for t in Latin1(Source(name='test', text='aé cd'.encode('latin1')))])
+
+  # Tags record positions within the most recent token.
+  Tagged = compile('num: $Dec+ @frac (. $Dec+)?\nspace: \\s+\n', name='Tagged', cache_dir=cache_dir)
+  def lex_tags(text:str):
+    lexer = Tagged(Source(name='test', text=text.encode()))
+    return [(t.kind, dict(lexer.tags)) for t in lexer]
+  utest_seq([('num', {'frac': 2}), ('space', {}), ('num', {'frac': 4})], lex_tags, '12 3.5')
+
+  # Invalid grammars raise `LegsError` with the diagnostic, rather than exiting.
+  def compile_error(source:str) -> str:
+    try: compile(source, disk_cache=False)
+    except LegsError as e: return str(e)
+    return ''
+  utest('Rules are ambiguous: a, b.', compile_error, 'a: x\nb: x\n')
+  utest(True, lambda: compile_error('x: [\n').startswith('<source>:'))
@@ -0,0 +1,34 @@
+#!/usr/bin/env python3
+
+from tempfile import TemporaryDirectory
+
+from utest import *
+from legs import compile
+from legs.imports import _compiled_grammars
+from legs_base import Source
+from pithy.fs import path_join
+
+
+def write(path:str, text:str) -> None:
+  with open(path, 'w') as f: f.write(text)
+
+def lex(dir:str, text:str):
+  path = path_join(dir, 'a.legs')
+  with open(path) as f: Lexer = compile(f.read(), path=path, disk_cache=False)
+  return [(t.kind, t.pos, t.end) for t in Lexer(Source(name='test', text=text.encode()))]
+
+with TemporaryDirectory() as dir:
+  # a imports b, which imports c.
+  write(path_join(dir, 'a.legs'), '# Imports\nb\n')
+  write(path_join(dir, 'b.legs'), '# Imports\nc\n# Patterns\nnum: $Dec+\n')
+  write(path_join(dir, 'c.legs'), 'word: x+\n')
+  utest_seq([('word', 0, 2)], lex, dir, 'xx')
+
+  # Editing the transitive import invalidates the in-process memo of b.
+  write(path_join(dir, 'c.legs'), 'word: y+\n')
+  utest_seq([('invalid', 0, 2)], lex, dir, 'xx')
+
+  # And the disk cache of b.
+  write(path_join(dir, 'c.legs'), 'word: x+\n')
+  _compiled_grammars.clear()
+  utest_seq([('word', 0, 2)], lex, dir, 'xx')
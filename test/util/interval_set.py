@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+
+from utest import *
+from legs.unicode import *
+
+
+def I(*ranges) -> IntervalSet: return IntervalSet(ranges)
+
+utest_seq([], difference_sorted_ranges, [], [(0, 1)])
+utest_seq([(0, 1)], difference_sorted_ranges, [(0, 1)], [])
+utest_seq([(0, 1), (3, 4)], difference_sorted_ranges, [(0, 4)], [(1, 3)])
+utest_seq([(0, 1), (5, 6)], difference_sorted_ranges, [(0, 2), (4, 6)], [(1, 5)])
+utest_seq([], difference_sorted_ranges, [(1, 2), (3, 4)], [(0, 8)])
+
+utest_seq([(0, 1), (3, 4)], symmetric_difference_sorted_ranges, [(0, 3)], [(1, 4)])
+utest_seq([(0, 4)], symmetric_difference_sorted_ranges, [(0, 2)], [(2, 4)])
+
+utest(I((0, 3)), IntervalSet, [(0, 1), (1, 2), (2, 3)])
+utest(I((0, 2), (4, 5)), IntervalSet.for_codes, [4, 1, 0])
+utest(I((0, 5)), I((0, 2)).union, I((1, 5)))
+utest(I((1, 2)), I((0, 2)).intersection, I((1, 5)))
+utest(I((0, 1)), I((0, 2)).difference, I((1, 5)))
+utest(I((0, 1), (2, 5)), I((0, 2)).symmetric_difference, I((1, 5)))
+utest(True, I((0, 2)).isdisjoint, I((2, 3)))
+utest(False, I((0, 3)).isdisjoint, I((2, 3)))
+utest(3, len, I((0, 2), (4, 5)))
+utest([0, 1, 4], list, I((0, 2), (4, 5)))
+utest(True, I((0, 2), (4, 5)).__contains__, 4)
+utest(False, I((0, 2), (4, 5)).__contains__, 2)